@@ -1,9 +1,12 @@
 # extended_cdr_pipeline_auto_full.py
-import csv, hashlib, time, os, json, subprocess
+import hashlib, time, os, json
 from web3 import Web3
 from datetime import datetime
 import requests
 from solcx import compile_standard, install_solc, set_solc_version, get_installed_solc_versions
+from file_tailer import ResumableTailer
+from ipfs_client import KuboClient
+from cdr_parser import iter_rows
 
 # ---------- Install & set Solidity compiler safely ----------
 SOLC_VERSION = "0.8.20"
@@ -77,6 +80,9 @@ else:
     contract = w3.eth.contract(address=CONTRACT_ADDRESS, abi=abi)
     print("✅ Contract deployed at:", CONTRACT_ADDRESS)
 
+# ---------- IPFS (Kubo HTTP API, one persistent session) ----------
+ipfs_node = KuboClient(os.getenv("IPFS_API_URL", "http://127.0.0.1:5001"))
+
 # ---------- Logs & mapping ----------
 LOG_FILE = "cdr_pipeline.log"
 MAPPING_FILE = "cdr_ipfs_map.json"
@@ -86,14 +92,7 @@ def sha256_hex(s: str) -> str:
     return hashlib.sha256(s.encode()).hexdigest()
 
 def store_offchain_ipfs(canon_str):
-    fname = f"cdr_{int(time.time()*1000)}.json"
-    with open(fname, "w") as f:
-        json.dump({"cdr": canon_str}, f)
-    try:
-        cid = subprocess.check_output(["ipfs", "add", "-q", fname]).decode().strip()
-    finally:
-        os.remove(fname)
-    return cid
+    return ipfs_node.add_json({"cdr": canon_str})
 
 def log_cdr(cdr_info, status):
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -137,17 +136,12 @@ def normalize(row):
     }, separators=(',', ':'), sort_keys=True)
     return canon, src, dst
 
-def tail_csv(path):
-    with open(path, "r") as f:
-        f.seek(0, os.SEEK_END)
-        while True:
-            pos = f.tell()
-            line = f.readline()
-            if not line:
-                time.sleep(0.5)
-                f.seek(pos)
-                continue
-            yield next(csv.reader([line]))
+TAIL_CHECKPOINT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "onchain_offset.json")
+tailer = ResumableTailer(CDR_FILE, TAIL_CHECKPOINT, max_wait=0.5, poll_interval=0.5)
+
+def tail_csv():
+    """Yield (row, position); commit position once the row is handled."""
+    yield from iter_rows(tailer.lines())
 
 # ---------- Verify via IPFS ----------
 def verify_offchain_vs_onchain_from_ipfs(cid, chain_hash):
@@ -167,7 +161,7 @@ def verify_offchain_vs_onchain_from_ipfs(cid, chain_hash):
 print("📡 Watching Asterisk CDRs in real-time... (Ctrl+C to stop)")
 
 try:
-    for row in tail_csv(CDR_FILE):
+    for row, pos in tail_csv():
         try:
             canon, caller, callee = normalize(row)
             h = sha256_hex(canon)
@@ -206,5 +200,7 @@ try:
         except Exception as e:
             print("Row error:", e)
 
+        tailer.commit(pos)
+
 except KeyboardInterrupt:
     print("\n🛑 Stopped monitoring.")
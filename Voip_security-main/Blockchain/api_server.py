@@ -1,8 +1,30 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from web3 import Web3
-import json, pathlib, hashlib, requests, subprocess, os, time
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, Field, field_validator
+from web3 import Web3, AsyncWeb3, AsyncHTTPProvider
+from web3.exceptions import TimeExhausted, TransactionNotFound
+import json, pathlib, hashlib, os, re, threading, time, asyncio
+import aiohttp
+from ingest_queue import IngestQueue, QueueFull
+from cdr_mirror import CDRMirror, SORT_KEYS, encode_cursor, decode_cursor
+import cdr_export
+from cdr_feed import CDRFeed
+from chain_follower import ChainFollower
+from backup_log import BackupLog
+from ipfs_map import CIDIndex
+from ipfs_gateway import GatewayClient, GatewayError, is_valid_ref
+from ipfs_client import KuboClient
+from merkle import build_batch, leaf_hash, verify_proof
+from dedup_index import DedupIndex
+from restore_engine import RestoreEngine, RestoreBusy
+from nonce_manager import NonceManager
+from range_reader import RangeReader
+from verify_cache import VerificationCache
+import cdr_codec
+from rating import RatingEngine, load_tariffs, GROUP_BY
+from metrics import Registry, CONTENT_TYPE
+import pandas as pd
 
 # ==========================================================
 #  FASTAPI INITIALIZATION
@@ -26,33 +48,105 @@ CONTRACT_DIR = BASE_DIR.parent / "voip_contract_project" / "backend"
 ABI_FILE = CONTRACT_DIR / "cdr_abi.json"
 ADDRESS_FILE = CONTRACT_DIR / "contract_address.txt"
 IPFS_MAP_FILE = CONTRACT_DIR / "cdr_ipfs_map.json"
-LOCAL_BACKUP = BASE_DIR / "cdr_backup.json"
+IPFS_MAP_COMPACT_EVERY = int(os.getenv("CDR_IPFS_MAP_COMPACT_EVERY", "10000"))
+IPFS_GATEWAYS = os.getenv("IPFS_GATEWAYS", "http://127.0.0.1:8080,https://ipfs.io").split(",")
+IPFS_HEDGE_DELAY = float(os.getenv("IPFS_HEDGE_DELAY", "0.5"))
+IPFS_CACHE_SIZE = int(os.getenv("IPFS_CACHE_SIZE", "10000"))
+IPFS_CACHE_DIR = os.getenv("IPFS_CACHE_DIR", str(BASE_DIR / "ipfs_cache"))  # empty string disables
+IPFS_API_URL = os.getenv("IPFS_API_URL", "http://127.0.0.1:5001")         # Kubo RPC API, used for pinning
+IPFS_PIN_BATCH = int(os.getenv("IPFS_PIN_BATCH", "100"))                  # CIDs per /pin/add call
+IPFS_PIN_INTERVAL = float(os.getenv("IPFS_PIN_INTERVAL", "1.0"))         # max wait before a partial batch is pinned
+VERIFY_CONCURRENCY = int(os.getenv("CDR_VERIFY_CONCURRENCY", "32"))
+BACKUP_DIR = BASE_DIR / "cdr_backup"
+LEGACY_BACKUP = BASE_DIR / "cdr_backup.json"
+MIRROR_DB = BASE_DIR / "cdr_mirror.db"
+DEDUP_DB = BASE_DIR / "cdr_dedup.db"
+DEDUP_CAPACITY = int(os.getenv("CDR_DEDUP_CAPACITY", "1000000"))
+VERIFY_CACHE_DB = BASE_DIR / "verify_cache.db"
+TARIFF_FILE = pathlib.Path(os.getenv("CDR_TARIFF_FILE", str(BASE_DIR / "tariffs.json")))
+FOLLOWER_CHECKPOINT = BASE_DIR / "chain_follower.json"
+FOLLOWER_START_BLOCK = int(os.getenv("CDR_FOLLOWER_START_BLOCK", "0"))
+FOLLOWER_POLL_INTERVAL = float(os.getenv("CDR_FOLLOWER_POLL_INTERVAL", "2.0"))
+
+# ==========================================================
+#  RPC CONFIGURATION
+# ==========================================================
+RPC_URL = os.getenv("CDR_RPC_URL", "http://127.0.0.1:8545")
+RPC_TIMEOUT = float(os.getenv("CDR_RPC_TIMEOUT", "10"))
+RPC_CONCURRENCY = int(os.getenv("CDR_RPC_CONCURRENCY", "64"))      # in-flight calls to the node
+IPFS_CONCURRENCY = int(os.getenv("CDR_IPFS_CONCURRENCY", "64"))    # in-flight gateway fetches
+RECEIPT_TIMEOUT = float(os.getenv("CDR_RECEIPT_TIMEOUT", "120"))
+EXPORT_CHUNK_ROWS = int(os.getenv("CDR_EXPORT_CHUNK_ROWS", "10000"))  # rows per page / Parquet row group
+FEED_QUEUE_SIZE = int(os.getenv("CDR_FEED_QUEUE_SIZE", "1000"))       # per-subscriber backlog before "lagged"
+FEED_REPLAY_LIMIT = int(os.getenv("CDR_FEED_REPLAY_LIMIT", "10000"))  # rows replayed on (re)connect
+FEED_HEARTBEAT = float(os.getenv("CDR_FEED_HEARTBEAT", "15"))
+RECEIPT_POLL_INTERVAL = 0.5
+HEALTH_TIMEOUT = 2.0
+RANGE_PAGE_MAX = int(os.getenv("CDR_RANGE_PAGE_MAX", "500"))            # records per getCDRRange call, upper bound
+RANGE_TARGET_SECONDS = float(os.getenv("CDR_RANGE_TARGET_SECONDS", "1.0"))  # slower calls shrink the page
+VERIFY_PREFETCH = int(os.getenv("CDR_VERIFY_PREFETCH", "2000"))          # bulk verify reads records this many at a time
+COLD_SYNC = os.getenv("CDR_COLD_SYNC", "1") != "0"                       # bulk-load missing records on startup
+
+# ==========================================================
+#  INGEST CONFIGURATION
+# ==========================================================
+INGEST_QUEUE_MAX = int(os.getenv("CDR_INGEST_QUEUE_MAX", "10000"))
+INGEST_BATCH_SIZE = int(os.getenv("CDR_INGEST_BATCH_SIZE", "50"))
+INGEST_FLUSH_INTERVAL = float(os.getenv("CDR_INGEST_FLUSH_INTERVAL", "2.0"))
+INGEST_TICKET_LOOKUP_MAX = 5000  # tickets per POST /ingest/tickets
+GAS_PER_CDR = 500_000
+ANCHOR_GAS = 150_000
+# "records": one VoipCDR record per CDR; "merkle": one anchored root per flushed batch
+ANCHOR_MODE = os.getenv("CDR_ANCHOR_MODE", "records")
+
+# ==========================================================
+#  RESTORE CONFIGURATION
+# ==========================================================
+RESTORE_CHECKPOINT = BASE_DIR / "restore_job.json"
+RESTORE_WINDOW = int(os.getenv("CDR_RESTORE_WINDOW", "16"))            # transactions in flight
+RESTORE_BATCH_SIZE = int(os.getenv("CDR_RESTORE_BATCH_SIZE", "50"))    # CDRs per transaction
+RESTORE_MAX_RETRIES = int(os.getenv("CDR_RESTORE_MAX_RETRIES", "5"))
+
+# ==========================================================
+#  METRICS (GET /metrics, Prometheus text format)
+# ==========================================================
+metrics = Registry()
+STAGE_SECONDS = metrics.histogram(
+    "cdr_stage_seconds", "Time spent per pipeline stage (chain calls, receipt waits, IPFS, file I/O, hashing)",
+    ["stage"],
+)
+HTTP_SECONDS = metrics.histogram(
+    "cdr_http_request_seconds", "API request latency until the response starts", ["method", "route", "status"],
+)
+
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    HTTP_SECONDS.observe(
+        time.perf_counter() - started,
+        method=request.method, route=route.path if route else "unmatched", status=response.status_code,
+    )
+    return response
 
 # ==========================================================
 #  LOCAL BACKUP UTILITIES
 # ==========================================================
-def backup_cdr_locally(cdr):
-    """Append each stored CDR to a local JSON file for persistence."""
+backup_log = BackupLog(BACKUP_DIR)
+
+def backup_cdrs_locally(cdrs: list):
+    """Append stored CDRs to the append-only local backup log."""
     try:
-        records = []
-        if LOCAL_BACKUP.exists():
-            with open(LOCAL_BACKUP, "r") as f:
-                try:
-                    records = json.load(f)
-                except json.JSONDecodeError:
-                    print("⚠️ Corrupted backup file detected — resetting.")
-                    records = []
-
-        # ✅ Safely append serializable version
-        records.append(json.loads(json.dumps(cdr, default=str)))
-
-        with open(LOCAL_BACKUP, "w") as f:
-            json.dump(records, f, indent=2)
-
-        print(f"💾 Local backup saved ({len(records)} total records).")
+        with STAGE_SECONDS.time(stage="backup_write"):
+            backup_log.append_many(cdrs)
+        print(f"💾 Local backup saved ({backup_log.count()} total records).")
     except Exception as e:
         print(f"⚠️ Local backup failed: {e}")
 
+def backup_cdr_locally(cdr):
+    backup_cdrs_locally([cdr])
+
 # ==========================================================
 #  WEB3 / BLOCKCHAIN INITIALIZATION
 # ==========================================================
@@ -68,7 +162,7 @@ def load_address():
     with open(ADDRESS_FILE, "r") as f:
         return f.read().strip()
 
-w3 = Web3(Web3.HTTPProvider("http://127.0.0.1:8545"))
+w3 = Web3(Web3.HTTPProvider(RPC_URL))
 if not w3.is_connected():
     raise Exception("⚠️ Hardhat/Ganache node not connected!")
 
@@ -76,36 +170,286 @@ abi = load_abi()
 address = load_address()
 account = w3.eth.accounts[0]
 contract = w3.eth.contract(address=address, abi=abi)
+codec = cdr_codec.for_abi(abi)  # v1 string records or the packed VoipCDRv2 layout
+nonces = NonceManager(w3, account)  # every sender below takes its nonce from here
+
+# Request handlers use the async client so a slow RPC never holds a worker
+# thread. The background threads (ingest queue, chain follower, restore
+# engine) keep the blocking client above.
+async_w3 = AsyncWeb3(AsyncHTTPProvider(RPC_URL, request_kwargs={"timeout": RPC_TIMEOUT}))
+async_contract = async_w3.eth.contract(address=address, abi=abi)
+rpc_session = None  # keep-alive aiohttp pool, created on startup
+
+# One limit per upstream, so a slow node can't starve IPFS fetches (or vice versa)
+rpc_limit = asyncio.Semaphore(RPC_CONCURRENCY)
+ipfs_limit = asyncio.Semaphore(IPFS_CONCURRENCY)
+
+async def rpc(call):
+    """Await an AsyncWeb3 call under the node's concurrency limit."""
+    async with rpc_limit:
+        with STAGE_SECONDS.time(stage="chain_call"):
+            return await call
+
+# Many records per eth_call; page size adapts to the node's limits
+reader = RangeReader(
+    contract, async_contract, codec, limit=rpc,
+    max_size=RANGE_PAGE_MAX, target_seconds=RANGE_TARGET_SECONDS,
+)
+_record_count = {"value": 0, "at": 0.0}
+
+async def chain_record_count(max_age=2.0) -> int:
+    """recordCount(), cached briefly so page fills don't add an eth_call per request."""
+    if time.monotonic() - _record_count["at"] > max_age:
+        _record_count["value"] = await rpc(async_contract.functions.recordCount().call())
+        _record_count["at"] = time.monotonic()
+    return _record_count["value"]
+
+async def wait_receipt(tx_hash):
+    """Poll for a receipt without holding an RPC slot between polls."""
+    deadline = time.monotonic() + RECEIPT_TIMEOUT
+    with STAGE_SECONDS.time(stage="receipt_wait"):
+        while True:
+            try:
+                return await rpc(async_w3.eth.get_transaction_receipt(tx_hash))
+            except TransactionNotFound:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"transaction {tx_hash.hex()} not mined after {RECEIPT_TIMEOUT:.0f}s")
+                await asyncio.sleep(RECEIPT_POLL_INTERVAL)
+
+def stored_events(receipt):
+    """CDRStored events emitted by a receipt, in record order."""
+    return sorted(
+        contract.events.CDRStored().process_receipt(receipt),
+        key=lambda e: e["args"]["idx"],
+    )
 
 # ==========================================================
-#  IPFS UTILITIES
+#  LOCAL CDR MIRROR (SQLITE)
 # ==========================================================
-def ipfs_get_json(cid: str):
-    """Fetch JSON content from IPFS and handle newline-delimited JSON."""
-    urls = [
-        f"http://127.0.0.1:8080/ipfs/{cid}",
-        f"https://ipfs.io/ipfs/{cid}",
-    ]
-    for url in urls:
-        try:
-            r = requests.get(url, timeout=10)
-            r.raise_for_status()
-            try:
-                return r.json()
-            except Exception:
-                first_line = r.text.splitlines()[0]
-                return json.loads(first_line)
-        except Exception:
-            continue
-    raise HTTPException(status_code=502, detail=f"Unable to fetch CID {cid} from IPFS gateways")
+mirror = CDRMirror(MIRROR_DB)
 
-def pin_ipfs_cid(cid: str):
-    """Pin CID locally so it won’t be garbage-collected."""
+def record_to_row(idx: int, record, ipfs_cid=None, block_number=None):
+    """Map a getCDR() tuple to a mirror row."""
+    return {
+        "idx": idx,
+        "caller": record[0],
+        "callee": record[1],
+        "duration": int(record[2]),
+        "status": record[3],
+        "timestamp": record[4],
+        "hash": record[5],
+        "ipfs_cid": ipfs_cid,
+        "block_number": block_number,
+    }
+
+def event_to_row(event, ipfs_cid=None):
+    """Map a CDRStored event to a mirror row."""
+    return record_to_row(
+        event["args"]["idx"], codec.decode_event(event["args"]["record"]), ipfs_cid, event["blockNumber"],
+    )
+
+# ==========================================================
+#  DEDUP INDEX (CDR HASH → ALREADY WRITTEN?)
+# ==========================================================
+dedup = DedupIndex(DEDUP_DB, capacity=DEDUP_CAPACITY)
+
+def warm_dedup_from_mirror(full=False):
+    """Load mirror rows written since the last warm-up (all of them with full) into the dedup index."""
+    mark = mirror.write_mark()
+    since = None if full else json.loads(dedup.get_meta("mirror_mark", "null"))
+    added = dedup.warm(mirror.iter_hashes(since))
+    dedup.set_meta("mirror_mark", json.dumps(mark))
+    return added
+
+def warm_dedup():
+    """Background startup warm-up, like warm_rating; only rows past the stored mark are read."""
+    try:
+        added = warm_dedup_from_mirror()
+        print(f"🔁 Dedup index warmed from mirror (+{added}, {len(dedup)} known hashes).")
+    except Exception as e:
+        print(f"⚠️ Dedup warm-up failed: {e}")
+
+def warm_dedup_from_chain():
+    """Scan every on-chain record into the dedup index (slow; the mirror is normally enough)."""
+    total = contract.functions.recordCount().call()
+    entries = (
+        (record[5], first + i)
+        for first, records in reader.iter_pages(0, total)
+        for i, record in enumerate(records)
+    )
+    return dedup.warm(entries, chunk_size=1000), total
+
+# ==========================================================
+#  VERIFICATION CACHE ((IDX, ONCHAIN HASH, CID) → RESULT)
+# ==========================================================
+verify_cache = VerificationCache(VERIFY_CACHE_DB)
+
+def cached_verification(idx: int, ipfs_cid: str | None):
+    """Return (cached result or None, mirror row) for a record."""
+    row = mirror.get(idx)
+    if row and ipfs_cid:
+        return verify_cache.get(idx, row["hash"], ipfs_cid), row
+    return None, row
+
+# ==========================================================
+#  RATING ENGINE (TARIFFS + BILLING AGGREGATES)
+# ==========================================================
+rating = RatingEngine(load_tariffs(TARIFF_FILE))
+
+def parse_time_bound(value: str | None, name: str):
+    """ISO date/datetime or epoch seconds → epoch seconds (None stays open)."""
+    if value is None or value == "":
+        return None
     try:
-        subprocess.run(["ipfs", "pin", "add", cid], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        print(f"📌 Pinned CID {cid}")
+        if value.lstrip("-").isdigit():
+            return int(value)
+        return int(pd.Timestamp(value).timestamp())
+    except (ValueError, OverflowError):
+        raise HTTPException(status_code=400, detail=f"Invalid '{name}' time: {value}")
+
+def warm_rating():
+    """Rate the mirrored CDRs once in the background so the first summary request is fast."""
+    try:
+        loaded = rating.refresh(mirror)
+        print(f"💰 Rating engine loaded {loaded} CDRs ({len(rating.names) - 1} tariff(s) from {TARIFF_FILE.name}).")
     except Exception as e:
-        print(f"⚠️ Failed to pin CID {cid}: {e}")
+        print(f"⚠️ Rating engine warm-up failed: {e}")
+
+# ==========================================================
+#  PUSH FEED (NEW CDRS → WEBSOCKET / SSE SUBSCRIBERS)
+# ==========================================================
+feed = CDRFeed(queue_size=FEED_QUEUE_SIZE)
+
+def cdr_view(r: dict, cost) -> dict:
+    """A mirror row in the shape /cdrs and the push feed send to clients."""
+    return {
+        "id": r["idx"],
+        "caller": r["caller"],
+        "callee": r["callee"],
+        "duration": r["duration"],
+        "status": r["status"],
+        "timestamp": r["timestamp"],
+        "hash": r["hash"],
+        "ipfs_cid": r["ipfs_cid"],
+        "verified": verify_cache.verified(r["idx"], r["hash"], r["ipfs_cid"]) if r["ipfs_cid"] else None,
+        "billing_cost": cost
+    }
+
+def cdr_views(rows) -> list:
+    return [cdr_view(r, cost) for r, (_, cost) in zip(rows, rating.cost_rows(rows))]
+
+def publish_rows(rows):
+    """Push freshly mirrored rows to live subscribers (each idx once, whichever path wrote it first)."""
+    feed.publish(rows, cdr_views)
+
+def on_chain_events(events, to_block: int):
+    """Chain follower callback: fold new CDRStored/BatchAnchored events into the mirror."""
+    stored = [e for e in events if e["event"] == "CDRStored"]
+    if stored:
+        rows = [event_to_row(e, cid_index.get(e["args"]["idx"])) for e in stored]
+        mirror.upsert_many(rows)
+        dedup.mark_stored([(r["hash"], r["idx"]) for r in rows])
+        publish_rows(rows)
+        print(f"🔄 Mirror synced {len(stored)} new CDRs (through block {to_block}).")
+    for e in events:
+        if e["event"] == "BatchAnchored":
+            mirror.save_anchor({
+                "batch_id": e["args"]["batchId"],
+                "root": bytes(e["args"]["root"]).hex(),
+                "leaf_count": e["args"]["leafCount"],
+                "tx_hash": e["transactionHash"].hex(),
+                "block_number": e["blockNumber"],
+            })
+    mirror.set_meta("last_synced_block", to_block)
+    if unsettled_batches:
+        reconcile_batches()
+
+def on_chain_reorg(fork_block: int):
+    """Chain follower callback: forget everything derived from blocks that were reorganised away."""
+    removed = mirror.delete_from_block(fork_block)
+    dedup.forget([h for _, h in removed])
+    dropped = verify_cache.invalidate([idx for idx, _ in removed], from_block=fork_block)
+    mirror.set_meta("last_synced_block", fork_block - 1)
+    rating.reset()  # rows above the fork may come back with different contents
+    feed.reorg(fork_block, [idx for idx, _ in removed])
+    print(f"♻️ Reorg at block {fork_block}: dropped {len(removed)} mirrored CDRs and {dropped} cached verifications.")
+
+follower = ChainFollower(
+    w3, contract, ["CDRStored", "BatchAnchored"], on_chain_events, FOLLOWER_CHECKPOINT,
+    start_block=FOLLOWER_START_BLOCK, poll_interval=FOLLOWER_POLL_INTERVAL,
+    on_reorg=on_chain_reorg,
+)
+
+def cold_sync_mirror():
+    """
+    Bulk-load records past the mirror's highest idx with range reads, so a
+    fresh or long-stopped API serves /cdrs before the follower has replayed
+    every block. Rows carry no block number until the follower sees them.
+    """
+    try:
+        total = contract.functions.recordCount().call()
+        start = mirror.max_idx() + 1
+        if start >= total:
+            return
+        started, loaded = time.monotonic(), 0
+        for first, records in reader.iter_pages(start, total):
+            rows = [record_to_row(first + i, r, cid_index.get(first + i)) for i, r in enumerate(records)]
+            mirror.upsert_many(rows)
+            dedup.mark_stored([(r["hash"], r["idx"]) for r in rows])
+            loaded += len(rows)
+            print(f"⏩ Cold sync: {start + loaded}/{total} records (page size {reader.page_size}).")
+        print(f"✅ Cold sync loaded {loaded} CDRs in {time.monotonic() - started:.1f}s.")
+    except Exception as e:
+        print(f"⚠️ Cold sync failed (the chain follower will still catch up): {e}")
+
+async def fill_page_from_chain(rows: list, first: int, limit: int) -> list:
+    """Fill gaps in an unfiltered idx page [first, first + limit) from the chain while the mirror lags."""
+    if len(rows) == limit and rows[-1]["idx"] == first + limit - 1:
+        return rows
+    try:
+        end = min(first + limit, await chain_record_count())
+        have = {r["idx"] for r in rows}
+        missing = [i for i in range(first, end) if i not in have]
+        if not missing:
+            return rows
+        records = await reader.read_async(missing[0], missing[-1] - missing[0] + 1)
+        fresh = [
+            record_to_row(i, record, cid_index.get(i))
+            for i, record in zip(range(missing[0], missing[0] + len(records)), records) if i not in have
+        ]
+        await asyncio.to_thread(mirror.upsert_many, fresh)
+        return sorted(rows + fresh, key=lambda r: r["idx"])[:limit]
+    except Exception as e:
+        print(f"⚠️ Page fill from chain failed: {e}")
+        return rows
+
+# ==========================================================
+#  IPFS UTILITIES
+# ==========================================================
+ipfs_gateway = GatewayClient(
+    IPFS_GATEWAYS,
+    hedge_delay=IPFS_HEDGE_DELAY,
+    cache_size=IPFS_CACHE_SIZE,
+    cache_dir=IPFS_CACHE_DIR or None,
+)
+
+async def ipfs_get_json(cid: str):
+    """Fetch a CDR document by CID (cached; hedged across gateways on a miss)."""
+    try:
+        async with ipfs_limit:
+            with STAGE_SECONDS.time(stage="ipfs_get"):
+                return await ipfs_gateway.get_json(cid)
+    except GatewayError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+
+# Pins go through a background queue, batched into /pin/add calls
+ipfs_node = KuboClient(
+    IPFS_API_URL, pin_batch=IPFS_PIN_BATCH, pin_interval=IPFS_PIN_INTERVAL, stage_histogram=STAGE_SECONDS,
+)
+
+def pin_ipfs_cid(cid: str):
+    """Queue CID to be pinned locally so it won’t be garbage-collected."""
+    ipfs_node.pin_later(cid)
 
 # ==========================================================
 #  MODELS
@@ -119,54 +463,262 @@ class CDRRequest(BaseModel):
     hash: str
     ipfs_cid: str | None = None
 
+    @field_validator("ipfs_cid")
+    @classmethod
+    def check_ipfs_cid(cls, value):
+        if not value:
+            return None
+        if not is_valid_ref(value):
+            raise ValueError("ipfs_cid must be a CIDv0/CIDv1 (base32) or '<cid>#<n>'")
+        return value
+
+class VerifyBatchRequest(BaseModel):
+    start: int | None = Field(None, ge=0, description="First idx of the range (inclusive)")
+    end: int | None = Field(None, ge=0, description="End of the range (exclusive)")
+    indexes: list[int] | None = None
+    concurrency: int = Field(VERIFY_CONCURRENCY, ge=1, le=512)
+
 # ==========================================================
 #  IPFS MAP HANDLING
 # ==========================================================
-def ensure_ipfs_map():
-    """Ensure mapping file exists and migrate old newline format if needed."""
-    if not IPFS_MAP_FILE.exists():
-        with open(IPFS_MAP_FILE, "w") as f:
-            json.dump({}, f)
-        print("🆕 Created new IPFS map file.")
-        return
-
-    try:
-        with open(IPFS_MAP_FILE, "r") as f:
-            json.load(f)
-    except json.JSONDecodeError:
-        print("⚠️ Detected old format — migrating...")
-        output = {}
-        with open(IPFS_MAP_FILE, "r") as f:
-            for line in f:
-                try:
-                    entry = json.loads(line.strip())
-                    output[str(entry["idx"])] = entry["ipfs_cid"]
-                except Exception:
-                    continue
-        with open(IPFS_MAP_FILE, "w") as f:
-            json.dump(output, f, indent=2)
-        print(f"✅ Migration complete. {len(output)} entries repaired.")
+cid_index = CIDIndex(IPFS_MAP_FILE, compact_every=IPFS_MAP_COMPACT_EVERY).load()
 
 def save_ipfs_mapping(idx: int, cid: str | None):
-    """Add or update index → CID mapping safely."""
+    """Add or update index → CID mapping (appended to the map log)."""
     if not cid:
         return
-    ensure_ipfs_map()
-    with open(IPFS_MAP_FILE, "r") as f:
-        data = json.load(f)
-    data[str(idx)] = cid
-    with open(IPFS_MAP_FILE, "w") as f:
-        json.dump(data, f, indent=2)
+    with STAGE_SECONDS.time(stage="map_write"):
+        cid_index.set(idx, cid)
+        mirror.set_cid(idx, cid)
     pin_ipfs_cid(cid)
 
 def get_ipfs_cid_for_idx(idx: int):
-    ensure_ipfs_map()
+    return cid_index.get(idx)
+
+# ==========================================================
+#  BATCHED INGEST (WRITE-BEHIND QUEUE)
+# ==========================================================
+def cdr_batch_payload(batch: list):
+    """CDR dicts → storeCDRBatch input tuples for the deployed record layout."""
+    return [codec.encode(c) for c in batch]
+
+def record_stored_batch(batch: list, receipt):
+    """Save CID mappings and mirror rows for a mined storeCDRBatch; returns one result per CDR."""
+    # Events are emitted in batch order, so the n-th event belongs to the n-th CDR
+    events = stored_events(receipt)
+    tx_hash = receipt.transactionHash.hex()
+    results = []
+    for event, cdr in zip(events, batch):
+        idx = event["args"]["idx"]
+        save_ipfs_mapping(idx, cdr.get("ipfs_cid"))
+        results.append({"idx": idx, "tx_hash": tx_hash, "block_number": receipt.blockNumber})
+    rows = [event_to_row(e, c.get("ipfs_cid")) for e, c in zip(events, batch)]
+    with STAGE_SECONDS.time(stage="mirror_write"):
+        mirror.upsert_many(rows)
+    publish_rows(rows)
+    return results
+
+def record_stored_cdr(cdr: dict, event):
+    """Bookkeeping for a single storeCDR: dedup, CID map, mirror row and local backup."""
+    idx = event["args"]["idx"]
+    dedup.mark_stored([(cdr["hash"], idx)])
+    save_ipfs_mapping(idx, cdr.get("ipfs_cid"))
+    row = event_to_row(event, cdr.get("ipfs_cid"))
+    with STAGE_SECONDS.time(stage="mirror_write"):
+        mirror.upsert_many([row])
+    publish_rows([row])
+    backup_cdr_locally(cdr)
+
+def finish_stored_cdr(batch: list, receipt):
+    """settle/reconcile counterpart of record_stored_cdr for a single storeCDR receipt."""
+    event = stored_events(receipt)[0]
+    record_stored_cdr(batch[0], event)
+    return [{"idx": event["args"]["idx"]}]
+
+# Batches whose transaction was broadcast but whose outcome isn't recorded yet
+# (receipt timeout, or bookkeeping failed after mining). Their CDRs may
+# still land on chain, so their dedup claims stay held until
+# reconcile_batches() sees the receipt or finds the transaction gone.
+unsettled_batches = {}   # tx hash -> (batch, finish)
+unsettled_lock = threading.Lock()
+
+class BatchUnsettled(Exception):
+    """A broadcast batch whose outcome is unknown for now; its dedup claims must not be released."""
+
+def settle_batch(tx, batch: list, finish, name: str):
+    """Wait for a broadcast batch transaction and return finish(batch, receipt)."""
     try:
-        with open(IPFS_MAP_FILE, "r") as f:
-            data = json.load(f)
-            return data.get(str(idx))
-    except Exception:
-        return None
+        with STAGE_SECONDS.time(stage="receipt_wait"):
+            receipt = w3.eth.wait_for_transaction_receipt(tx, timeout=RECEIPT_TIMEOUT)
+    except TimeExhausted:
+        park_batch(tx, batch, finish)
+        raise BatchUnsettled(f"{name} tx {tx.hex()} not mined after {RECEIPT_TIMEOUT:.0f}s; CDRs stay claimed until it settles")
+    if receipt.status != 1:
+        raise RuntimeError(f"{name} reverted in tx {receipt.transactionHash.hex()}")
+    try:
+        return finish(batch, receipt)
+    except Exception as e:
+        park_batch(tx, batch, finish)
+        raise BatchUnsettled(f"{name} tx {tx.hex()} mined but not recorded ({e}); retrying on the next block")
+
+def park_batch(tx, batch: list, finish):
+    with unsettled_lock:
+        unsettled_batches[tx] = (batch, finish)
+
+def reconcile_batches():
+    """Settle parked batches: record them once mined, release their claims if they reverted or were dropped."""
+    with unsettled_lock:
+        parked = list(unsettled_batches.items())
+    for tx, (batch, finish) in parked:
+        try:
+            receipt = w3.eth.get_transaction_receipt(tx)
+        except TransactionNotFound:
+            try:
+                w3.eth.get_transaction(tx)
+                continue  # still waiting in the mempool
+            except TransactionNotFound:
+                receipt = None
+        hashes = [c["hash"] for c in batch]
+        try:
+            if receipt is None or receipt.status != 1:
+                dedup.release(hashes)
+                print(f"⚠️ Batch tx {tx.hex()} {'was dropped' if receipt is None else 'reverted'}; "
+                      f"released {len(batch)} CDRs for resubmission.")
+            else:
+                results = finish(batch, receipt)
+                dedup.mark_stored([(h, r.get("idx")) for h, r in zip(hashes, results)])
+                print(f"✅ Late receipt for tx {tx.hex()}: {len(batch)} CDRs recorded.")
+        except Exception as e:
+            print(f"⚠️ Could not settle batch tx {tx.hex()} yet: {e}")
+            continue
+        with unsettled_lock:
+            unsettled_batches.pop(tx, None)
+
+def finish_cdr_batch(batch: list, receipt):
+    results = record_stored_batch(batch, receipt)
+    backup_cdrs_locally(batch)
+    print(f"📦 Stored batch of {len(batch)} CDRs (#{results[0]['idx']}–#{results[-1]['idx']})")
+    return results
+
+def flush_cdr_batch(batch: list):
+    """Write a group of queued CDRs with a single storeCDRBatch transaction."""
+    with STAGE_SECONDS.time(stage="chain_call"):
+        tx = nonces.transact(
+            contract.functions.storeCDRBatch(cdr_batch_payload(batch)),
+            {"from": account, "gas": GAS_PER_CDR * len(batch)},
+        )
+    return settle_batch(tx, batch, finish_cdr_batch, "storeCDRBatch")
+
+def finish_merkle_batch(batch: list, receipt, root: bytes, proofs: list):
+    batch_id = contract.events.BatchAnchored().process_receipt(receipt)[0]["args"]["batchId"]
+    tx_hash = receipt.transactionHash.hex()
+    mirror.save_anchor({
+        "batch_id": batch_id, "root": root.hex(), "leaf_count": len(batch),
+        "tx_hash": tx_hash, "block_number": receipt.blockNumber,
+    })
+    mirror.save_leaves([
+        {
+            "hash": cdr["hash"], "batch_id": batch_id, "position": i,
+            "proof": json.dumps(proof), "ipfs_cid": cdr.get("ipfs_cid"),
+            "cdr": json.dumps(cdr, default=str),
+        }
+        for i, (cdr, proof) in enumerate(zip(batch, proofs))
+    ])
+    for cdr in batch:
+        if cdr.get("ipfs_cid"):
+            pin_ipfs_cid(cdr["ipfs_cid"])
+    backup_cdrs_locally(batch)
+
+    print(f"🌳 Anchored batch #{batch_id} ({len(batch)} CDRs, root {root.hex()[:16]}…)")
+    return [
+        {"batch_id": batch_id, "leaf_index": i, "merkle_root": root.hex(),
+         "tx_hash": tx_hash, "block_number": receipt.blockNumber}
+        for i in range(len(batch))
+    ]
+
+def flush_merkle_batch(batch: list):
+    """Anchor a group of queued CDRs as a single Merkle root; leaves and proofs stay local."""
+    root, proofs = build_batch([c["hash"] for c in batch])
+    with STAGE_SECONDS.time(stage="chain_call"):
+        tx = nonces.transact(contract.functions.anchorBatch(root, len(batch)), {"from": account, "gas": ANCHOR_GAS})
+    return settle_batch(tx, batch, lambda b, receipt: finish_merkle_batch(b, receipt, root, proofs), "anchorBatch")
+
+def with_dedup(flush_fn):
+    """
+    Mark a flushed batch as stored in the dedup index, or release its claims
+    if it failed. A batch that was broadcast but hasn't settled keeps them.
+    """
+    def flush(batch: list):
+        try:
+            with STAGE_SECONDS.time(stage="batch_flush"):
+                results = flush_fn(batch)
+        except BatchUnsettled:
+            raise
+        except Exception:
+            dedup.release([c["hash"] for c in batch])
+            raise
+        dedup.mark_stored([(c["hash"], r.get("idx")) for c, r in zip(batch, results)])
+        return results
+    return flush
+
+ingest_queue = IngestQueue(
+    with_dedup(flush_merkle_batch if ANCHOR_MODE == "merkle" else flush_cdr_batch),
+    max_size=INGEST_QUEUE_MAX,
+    batch_size=INGEST_BATCH_SIZE,
+    flush_interval=INGEST_FLUSH_INTERVAL,
+)
+
+HEX_HASH = re.compile(r"[0-9a-f]{64}")
+
+def enqueue_or_429(cdrs: list):
+    """Queue the CDRs not seen before; returns (tickets, duplicates)."""
+    if ANCHOR_MODE == "merkle":
+        # build_batch() decodes every hash at flush time; one bad hash would fail the whole batch
+        for c in cdrs:
+            if not HEX_HASH.fullmatch(c["hash"]):
+                raise HTTPException(status_code=400, detail=f"CDR hash {c['hash']!r} is not a 64-char hex sha256")
+    else:
+        for c in cdrs:
+            try:
+                codec.encode(c)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"CDR {c['hash']} not representable on-chain: {e}")
+    claims = dedup.claim_many([c["hash"] for c in cdrs])
+    fresh = [c for c, existing in zip(cdrs, claims) if existing is None]
+    duplicates = [
+        {"hash": c["hash"], "state": existing["state"], "idx": existing["idx"]}
+        for c, existing in zip(cdrs, claims) if existing is not None
+    ]
+    if not fresh:
+        return [], duplicates
+    try:
+        return ingest_queue.submit_many(fresh), duplicates
+    except QueueFull as e:
+        dedup.release([c["hash"] for c in fresh])
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(int(INGEST_FLUSH_INTERVAL) + 1)})
+
+# ==========================================================
+#  RESTORE ENGINE
+# ==========================================================
+def send_restore_batch(batch: list, nonce: int, gas_price: int | None = None):
+    tx = {"from": account, "gas": GAS_PER_CDR * len(batch), "nonce": nonce}
+    if gas_price:
+        tx["gasPrice"] = gas_price  # re-broadcast of a stuck transaction at the same nonce
+    return contract.functions.storeCDRBatch(cdr_batch_payload(batch)).transact(tx)
+
+def confirm_restore_batch(batch: list, receipt):
+    results = record_stored_batch(batch, receipt)
+    dedup.mark_stored([(c["hash"], r["idx"]) for c, r in zip(batch, results)])
+    print(f"✅ Restored {len(batch)} CDRs (#{results[0]['idx']}–#{results[-1]['idx']})")
+
+restore_engine = RestoreEngine(
+    w3, nonces, send_restore_batch, confirm_restore_batch, RESTORE_CHECKPOINT,
+    should_restore=lambda cdr: codec.representable(cdr) and dedup.claim(cdr["hash"]) is None,
+    on_failed=lambda batch: dedup.release([c["hash"] for c in batch]),
+    window=RESTORE_WINDOW,
+    batch_size=RESTORE_BATCH_SIZE,
+    max_retries=RESTORE_MAX_RETRIES,
+)
 
 # ==========================================================
 #  ROUTES
@@ -176,118 +728,563 @@ def root():
     return {"message": "VoIP Blockchain API running ✅"}
 
 @app.get("/health")
-def health_check():
-    """Simple backend status endpoint."""
+async def health_check():
+    """Simple backend status endpoint (bypasses the RPC limit so a busy node can't starve it)."""
     try:
-        connected = w3.is_connected()
+        try:
+            connected = await asyncio.wait_for(async_w3.is_connected(), timeout=HEALTH_TIMEOUT)
+        except asyncio.TimeoutError:
+            connected = False
         contract_ok = contract.address is not None
         return {
             "status": "healthy" if connected and contract_ok else "unhealthy",
             "message": "Backend connected to blockchain" if connected else "Blockchain connection failed",
+            "record_layout": codec.layout,
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Health check failed: {e}")
 
 # ---------- STORE CDR ----------
 @app.post("/store_cdr")
-def store_cdr(cdr: CDRRequest):
+async def store_cdr(cdr: CDRRequest):
     """Store new CDR record on blockchain and record optional IPFS CID."""
     try:
-        tx = contract.functions.storeCDR(
-            cdr.caller, cdr.callee, cdr.duration, cdr.status, cdr.timestamp, cdr.hash
-        ).transact({"from": account, "gas": 500_000})
+        args = codec.encode(cdr.dict())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"CDR not representable on-chain: {e}")
+    existing = await asyncio.to_thread(dedup.claim, cdr.hash)
+    if existing is not None:
+        return {"status": "duplicate", "tx_hash": None, "idx": existing["idx"], "ipfs_cid": cdr.ipfs_cid}
+    tx = None
+    try:
+        tx = await rpc(nonces.transact_async(
+            async_contract.functions.storeCDR(*args), {"from": account, "gas": GAS_PER_CDR}
+        ))
 
-        receipt = w3.eth.wait_for_transaction_receipt(tx)
-        idx = contract.functions.recordCount().call() - 1
-        save_ipfs_mapping(idx, cdr.ipfs_cid)
+        receipt = await wait_receipt(tx)
+        events = stored_events(receipt)
+        if receipt.status != 1 or not events:
+            dedup.release([cdr.hash])
+            return {"status": "failed", "tx_hash": receipt.transactionHash.hex(), "idx": None, "ipfs_cid": cdr.ipfs_cid}
 
-        # ✅ Save local JSON backup
-        backup_cdr_locally(cdr.dict())
+        idx = events[0]["args"]["idx"]
+        # ✅ Mirror, CID map (+ pin) and local JSON backup touch disk; keep them off the event loop
+        await asyncio.to_thread(record_stored_cdr, cdr.dict(), events[0])
 
         return {
-            "status": "success" if receipt.status == 1 else "failed",
+            "status": "success",
             "tx_hash": receipt.transactionHash.hex(),
             "idx": idx,
             "ipfs_cid": cdr.ipfs_cid,
         }
     except Exception as e:
+        if tx is not None:
+            # Broadcast already: it may still be mined, so the claim stays until the follower settles it
+            park_batch(tx, [cdr.dict()], finish_stored_cdr)
+            raise HTTPException(status_code=504, detail=f"CDR not confirmed yet, still claimed: {e}")
+        dedup.release([cdr.hash])
         raise HTTPException(status_code=500, detail=f"Blockchain store failed: {e}")
 
+# ---------- QUEUED (BATCHED) INGEST ----------
+@app.post("/queue_cdr", status_code=202)
+def queue_cdr(cdr: CDRRequest):
+    """Accept a CDR into the write-behind queue and return a pollable ticket."""
+    tickets, duplicates = enqueue_or_429([cdr.dict()])
+    if duplicates:
+        return {"status": "duplicate", "ticket": None, **duplicates[0], "queue_depth": ingest_queue.depth()}
+    return {"status": "queued", "ticket": tickets[0], "queue_depth": ingest_queue.depth()}
+
+@app.post("/queue_cdrs", status_code=202)
+def queue_cdrs(cdrs: list[CDRRequest]):
+    """
+    Accept a group of CDRs at once; all new ones are queued or the call is
+    rejected with 429. CDRs whose hash is already stored or queued are
+    listed under "duplicates" instead of getting a ticket.
+    """
+    if not cdrs:
+        raise HTTPException(status_code=400, detail="Empty CDR batch.")
+    tickets, duplicates = enqueue_or_429([c.dict() for c in cdrs])
+    return {"status": "queued", "tickets": tickets, "duplicates": duplicates, "queue_depth": ingest_queue.depth()}
+
+@app.get("/ingest/{ticket}")
+def ingest_status(ticket: str):
+    """Poll a queued CDR: queued → submitted → confirmed (with idx) or failed."""
+    entry = ingest_queue.status(ticket)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired ingest ticket.")
+    return entry
+
+@app.post("/ingest/tickets")
+def ingest_statuses(tickets: list[str]):
+    """Poll many tickets at once; unknown or expired ones come back as null."""
+    if len(tickets) > INGEST_TICKET_LOOKUP_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {INGEST_TICKET_LOOKUP_MAX} tickets per lookup.")
+    return {"tickets": [ingest_queue.status(t) for t in tickets]}
+
+@app.get("/ingest_stats")
+def ingest_stats():
+    return {**ingest_queue.stats(), "unsettled_batches": len(unsettled_batches)}
+
 # ---------- GET ALL CDRS ----------
+def cdr_filters(caller, callee, status, q, hash_prefix, start, end, min_duration, max_duration) -> dict:
+    """Normalise /cdrs-style query parameters into a CDRMirror filter dict."""
+    return {
+        "caller": caller, "callee": callee, "status": status,
+        "q": q.strip() if q and q.strip() else None,
+        "hash_prefix": hash_prefix.lower().removeprefix("0x") if hash_prefix else None,
+        "start": parse_time_bound(start, "from"), "end": parse_time_bound(end, "to"),
+        "min_duration": min_duration, "max_duration": max_duration,
+    }
+
 @app.get("/cdrs")
-def get_all_cdrs():
-    """Return all stored CDRs with optional IPFS mapping."""
-    RATE_PER_SECOND = 0.05
+async def get_all_cdrs(
+    limit: int = Query(500, ge=1, le=5000),
+    offset: int = Query(0, ge=0),
+    after: int | None = Query(None, ge=-1, description="Cursor: last idx of the previous page (idx sort)"),
+    cursor: str | None = Query(None, description="next_token of the previous page (any sort)"),
+    caller: str | None = None,
+    callee: str | None = None,
+    status: str | None = None,
+    q: str | None = Query(None, description="Exact caller or callee, or hash prefix"),
+    hash_prefix: str | None = Query(None, pattern="^(0x)?[0-9a-fA-F]{1,64}$"),
+    start: str | None = Query(None, alias="from", description="ISO date/datetime or epoch seconds (inclusive)"),
+    end: str | None = Query(None, alias="to", description="ISO date/datetime or epoch seconds (exclusive)"),
+    min_duration: int | None = Query(None, ge=0),
+    max_duration: int | None = Query(None, ge=0),
+    sort: str = Query("idx", description=f"One of: {', '.join(SORT_KEYS)}"),
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    with_total: bool = Query(False, description="Also count every CDR matching the filters (scans the whole match)"),
+):
+    """
+    Return a page of stored CDRs from the local mirror, filtered and sorted
+    via its indexes. "matched" is only counted when asked for (with_total),
+    so deep keyset pages stay O(limit).
+    """
+    if sort not in SORT_KEYS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of: {', '.join(SORT_KEYS)}")
+    filters = cdr_filters(caller, callee, status, q, hash_prefix, start, end, min_duration, max_duration)
+    filtered = any(v is not None for v in filters.values())
+    if cursor is not None:
+        try:
+            page_cursor = decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    else:
+        page_cursor = (None, after) if after is not None else None
+        if after is not None and sort != "idx":
+            raise HTTPException(status_code=400, detail="'after' only applies to sort=idx; use 'cursor'")
+
     try:
-        total = contract.functions.recordCount().call()
-        cdrs = []
-        for i in range(total):
-            try:
-                record = contract.functions.getCDR(i).call()
-                cdrs.append({
-                    "id": i,
-                    "caller": record[0],
-                    "callee": record[1],
-                    "duration": record[2],
-                    "status": record[3],
-                    "timestamp": record[4],
-                    "hash": record[5],
-                    "ipfs_cid": get_ipfs_cid_for_idx(i),
-                    "billing_cost": round(record[2] * RATE_PER_SECOND, 2)
-                })
-            except Exception as err:
-                print(f"[⚠️ ERROR] Could not fetch record {i}: {err}")
-        return {"total": total, "cdrs": cdrs}
+        rows = await asyncio.to_thread(mirror.query, filters, sort, order == "desc", limit, page_cursor, offset)
+        if not filtered and sort == "idx" and order == "asc":
+            rows = await fill_page_from_chain(rows, page_cursor[1] + 1 if page_cursor else offset, limit)
+        cdrs = await asyncio.to_thread(cdr_views, rows)
+        full = len(rows) == limit
+        return {
+            "total": await asyncio.to_thread(mirror.count),
+            "matched": await asyncio.to_thread(mirror.count_matching, filters) if filtered and with_total else None,
+            "limit": limit,
+            "offset": offset,
+            "sort": sort,
+            "order": order,
+            "next_cursor": cdrs[-1]["id"] if full and sort == "idx" else None,
+            "next_token": encode_cursor([rows[-1][SORT_KEYS[sort]], rows[-1]["idx"]]) if full else None,
+            "last_synced_block": mirror.last_synced_block(),
+            "cdrs": cdrs,
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch CDRs: {e}")
 
+# ---------- STREAMING EXPORT ----------
+@app.get("/cdrs/export")
+def export_cdrs(
+    format: str = Query("ndjson", pattern="^(ndjson|csv|parquet)$"),
+    after: int = Query(-1, ge=-1, description="Resume after this idx (last one received)"),
+    resume: str | None = Query(None, description="resume_token from an interrupted NDJSON export"),
+    caller: str | None = None,
+    callee: str | None = None,
+    status: str | None = None,
+    q: str | None = None,
+    hash_prefix: str | None = Query(None, pattern="^(0x)?[0-9a-fA-F]{1,64}$"),
+    start: str | None = Query(None, alias="from"),
+    end: str | None = Query(None, alias="to"),
+    min_duration: int | None = Query(None, ge=0),
+    max_duration: int | None = Query(None, ge=0),
+):
+    """
+    Stream every matching CDR in idx order (same filters as /cdrs) without
+    building the result in memory. Resume with after=<last idx> or, for
+    NDJSON, the latest resume_token line.
+    """
+    if resume is not None:
+        try:
+            token = cdr_export.decode_token(resume)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        format, filters, after = token["format"], token["filters"], token["after"]
+    else:
+        filters = cdr_filters(caller, callee, status, q, hash_prefix, start, end, min_duration, max_duration)
+    if format == "parquet" and cdr_export.pq is None:
+        raise HTTPException(status_code=501, detail="Parquet export needs pyarrow (pip install pyarrow).")
+
+    pages = cdr_export.iter_pages(mirror, filters, after, EXPORT_CHUNK_ROWS)
+    if format == "ndjson":
+        body = cdr_export.ndjson_stream(pages, filters)
+    elif format == "csv":
+        body = cdr_export.csv_stream(pages, header=after < 0)
+    else:
+        body = cdr_export.parquet_stream(pages)
+
+    media_type, extension = cdr_export.FORMATS[format]
+    suffix = f"-after-{after}" if after >= 0 else ""
+    return StreamingResponse(body, media_type=media_type, headers={
+        "Content-Disposition": f'attachment; filename="cdrs{suffix}.{extension}"',
+        "X-Resume-After": str(after),
+    })
+
+# ---------- LIVE PUSH (WEBSOCKET / SSE) ----------
+async def feed_messages(filters: dict, after: int | None):
+    """
+    Messages for one subscriber: rows after `after` replayed from the mirror,
+    then live rows as they are stored. Yields None when a heartbeat is due.
+    Subscribing before the replay means nothing stored in between is missed.
+    """
+    sub = feed.subscribe(filters)
+    try:
+        replayed = set()
+        if after is not None:
+            cursor = after
+            while len(replayed) < FEED_REPLAY_LIMIT:
+                page = min(500, FEED_REPLAY_LIMIT - len(replayed))
+                rows = await asyncio.to_thread(mirror.query, filters, "idx", False, page, (None, cursor))
+                for cdr in await asyncio.to_thread(cdr_views, rows):
+                    replayed.add(cdr["id"])
+                    yield {"type": "cdr", "cdr": cdr}
+                if len(rows) < page:
+                    break
+                cursor = rows[-1]["idx"]
+            else:
+                yield {"type": "replay_truncated", "after": cursor}  # fetch the gap from /cdrs/export
+        yield {"type": "live"}
+
+        while True:
+            try:
+                message = await asyncio.wait_for(sub.queue.get(), timeout=FEED_HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield None
+                continue
+            if message["type"] == "cdr":
+                if message["row"]["idx"] in replayed:
+                    continue
+                yield {"type": "cdr", "cdr": message["cdr"]}
+            else:
+                yield message
+                if message["type"] == "lagged":
+                    return  # client reconnects with after=<last idx seen>
+    finally:
+        sub.close()
+
+@app.websocket("/ws/cdrs")
+async def ws_cdrs(
+    websocket: WebSocket,
+    after: int | None = None,
+    caller: str | None = None,
+    callee: str | None = None,
+    status: str | None = None,
+    q: str | None = None,
+    hash_prefix: str | None = None,
+    start: str | None = Query(None, alias="from"),
+    end: str | None = Query(None, alias="to"),
+    min_duration: int | None = None,
+    max_duration: int | None = None,
+):
+    """Push new CDRs as JSON messages ({"type": "cdr" | "reorg" | "live" | "lagged" | "ping", ...})."""
+    await websocket.accept()
+    try:
+        filters = cdr_filters(caller, callee, status, q, hash_prefix, start, end, min_duration, max_duration)
+    except HTTPException as e:
+        await websocket.close(code=1008, reason=str(e.detail))
+        return
+    try:
+        async for message in feed_messages(filters, after):
+            await websocket.send_json(message or {"type": "ping"})
+        await websocket.close(code=1013, reason="subscriber lagged; reconnect with after=<last idx>")
+    except WebSocketDisconnect:
+        pass
+
+@app.get("/cdrs/stream")
+async def sse_cdrs(
+    after: int | None = Query(None, ge=-1, description="Replay CDRs after this idx first"),
+    last_event_id: str | None = Header(None),
+    caller: str | None = None,
+    callee: str | None = None,
+    status: str | None = None,
+    q: str | None = None,
+    hash_prefix: str | None = Query(None, pattern="^(0x)?[0-9a-fA-F]{1,64}$"),
+    start: str | None = Query(None, alias="from"),
+    end: str | None = Query(None, alias="to"),
+    min_duration: int | None = Query(None, ge=0),
+    max_duration: int | None = Query(None, ge=0),
+):
+    """
+    Server-Sent Events version of /ws/cdrs. Each CDR event carries its idx as
+    the event id, so a reconnecting EventSource resumes via Last-Event-ID.
+    """
+    filters = cdr_filters(caller, callee, status, q, hash_prefix, start, end, min_duration, max_duration)
+    if last_event_id and last_event_id.isdigit():
+        after = int(last_event_id)
+
+    async def events():
+        async for message in feed_messages(filters, after):
+            if message is None:
+                yield ": ping\n\n"
+            elif message["type"] == "cdr":
+                yield f"id: {message['cdr']['id']}\nevent: cdr\ndata: {json.dumps(message['cdr'])}\n\n"
+            else:
+                yield f"event: {message['type']}\ndata: {json.dumps(message)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 # ---------- VERIFY CDR ----------
+def compute_cdr_hash(cdr_data: dict) -> str:
+    """Recompute the CDR hash exactly as the listener does."""
+    caller = str(cdr_data.get("caller", "")).strip()
+    callee = str(cdr_data.get("callee", "")).strip()
+    timestamp = str(cdr_data.get("timestamp", "")).strip()
+    duration = int(cdr_data.get("duration", 0))
+    status = str(cdr_data.get("status", "")).strip()
+
+    cdr_string = f"{caller}{callee}{timestamp}{duration}{status}"
+    with STAGE_SECONDS.time(stage="hash"):
+        return hashlib.sha256(cdr_string.encode()).hexdigest()
+
+def build_verification(record, ipfs_cid: str, cdr_data: dict) -> dict:
+    recomputed_hash = compute_cdr_hash(cdr_data)
+    onchain_hash = record[5]
+    return {
+        "verified": recomputed_hash == onchain_hash,
+        "onchain_hash": onchain_hash,
+        "computed_hash": recomputed_hash,
+        "caller": record[0],
+        "callee": record[1],
+        "duration": record[2],
+        "status": record[3],
+        "timestamp": record[4],
+        "ipfs_cid": ipfs_cid,
+        "ipfs_source": f"http://127.0.0.1:8080/ipfs/{ipfs_cid}",
+    }
+
 @app.get("/verify_cdr/{idx}")
-def verify_cdr(idx: int):
-    """Verify on-chain vs IPFS hashes."""
+async def verify_cdr(idx: int):
+    """Verify on-chain vs IPFS hashes (answered from the verification cache when possible)."""
     try:
-        record = contract.functions.getCDR(idx).call()
         ipfs_cid = get_ipfs_cid_for_idx(idx)
+        cached, row = cached_verification(idx, ipfs_cid)
+        if cached is not None:
+            return cached
+
+        record = codec.decode(await rpc(async_contract.functions.getCDR(idx).call()))
         if not ipfs_cid:
             raise HTTPException(status_code=404, detail="IPFS CID not found for this CDR")
 
-        cdr_data = ipfs_get_json(ipfs_cid)
-        caller = str(cdr_data.get("caller", "")).strip()
-        callee = str(cdr_data.get("callee", "")).strip()
-        timestamp = str(cdr_data.get("timestamp", "")).strip()
-        duration = int(cdr_data.get("duration", 0))
-        status = str(cdr_data.get("status", "")).strip()
+        cdr_data = await ipfs_get_json(ipfs_cid)
+        result = build_verification(record, ipfs_cid, cdr_data)
+        await asyncio.to_thread(
+            verify_cache.put, idx, record[5], ipfs_cid, result, row["block_number"] if row else None
+        )
+        return result
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Verification failed: {e}")
+
+@app.get("/verify_cdr/anchored/{cdr_hash}")
+async def verify_anchored_cdr(cdr_hash: str):
+    """Verify a Merkle-anchored CDR: inclusion proof against the on-chain root, then IPFS vs hash."""
+    leaf = mirror.find_leaf(cdr_hash)
+    if not leaf:
+        raise HTTPException(status_code=404, detail="CDR hash not found in any anchored batch")
+    try:
+        root, leaf_count, anchored_at = await rpc(async_contract.functions.anchors(leaf["batch_id"]).call())
+        proof = json.loads(leaf["proof"])
+        included = verify_proof(leaf_hash(cdr_hash), proof, bytes(root))
 
-        cdr_string = f"{caller}{callee}{timestamp}{duration}{status}"
-        recomputed_hash = hashlib.sha256(cdr_string.encode()).hexdigest()
-        onchain_hash = record[5]
-        verified = recomputed_hash == onchain_hash
+        cdr = json.loads(leaf["cdr"])
+        ipfs_cid = leaf["ipfs_cid"]
+        computed_hash = compute_cdr_hash(await ipfs_get_json(ipfs_cid) if ipfs_cid else cdr)
 
         return {
-            "verified": verified,
-            "onchain_hash": onchain_hash,
-            "computed_hash": recomputed_hash,
-            "caller": record[0],
-            "callee": record[1],
-            "duration": record[2],
-            "status": record[3],
-            "timestamp": record[4],
+            "verified": included and computed_hash == cdr_hash,
+            "included": included,
+            "anchored_hash": cdr_hash,
+            "computed_hash": computed_hash,
+            "batch_id": leaf["batch_id"],
+            "leaf_index": leaf["position"],
+            "leaf_count": leaf_count,
+            "anchored_at": anchored_at,
+            "merkle_root": bytes(root).hex(),
+            "proof": proof,
+            "caller": cdr.get("caller"),
+            "callee": cdr.get("callee"),
+            "duration": cdr.get("duration"),
+            "status": cdr.get("status"),
+            "timestamp": cdr.get("timestamp"),
             "ipfs_cid": ipfs_cid,
-            "ipfs_source": f"http://127.0.0.1:8080/ipfs/{ipfs_cid}",
         }
     except HTTPException:
         raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Verification failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Anchored verification failed: {e}")
+
+# ---------- BULK VERIFICATION ----------
+async def verify_one(idx: int, record=None) -> dict:
+    """Verify a single record for the bulk endpoint; never raises. record: prefetched getCDR tuple."""
+    try:
+        ipfs_cid = get_ipfs_cid_for_idx(idx)
+        if not ipfs_cid:
+            return {"idx": idx, "result": "missing", "reason": "no IPFS CID for this CDR"}
+
+        cached, row = cached_verification(idx, ipfs_cid)
+        if cached is not None:
+            return {
+                "idx": idx,
+                "result": "verified" if cached["verified"] else "mismatch",
+                "onchain_hash": cached["onchain_hash"],
+                "computed_hash": cached["computed_hash"],
+                "ipfs_cid": ipfs_cid,
+                "cached": True,
+            }
+
+        if record is None:
+            # Chain read and IPFS fetch are independent, so run them together
+            record, cdr_data = await asyncio.gather(
+                rpc(async_contract.functions.getCDR(idx).call()),
+                ipfs_get_json(ipfs_cid),
+                return_exceptions=True,
+            )
+            if isinstance(record, Exception):
+                return {"idx": idx, "result": "missing", "reason": f"chain read failed: {record}"}
+            record = codec.decode(record)
+        else:
+            try:
+                cdr_data = await ipfs_get_json(ipfs_cid)
+            except Exception as e:
+                cdr_data = e
+        if isinstance(cdr_data, Exception):
+            return {"idx": idx, "result": "missing", "ipfs_cid": ipfs_cid, "reason": str(cdr_data)}
+
+        check = build_verification(record, ipfs_cid, cdr_data)
+        await asyncio.to_thread(
+            verify_cache.put, idx, record[5], ipfs_cid, check, row["block_number"] if row else None
+        )
+        return {
+            "idx": idx,
+            "result": "verified" if check["verified"] else "mismatch",
+            "onchain_hash": check["onchain_hash"],
+            "computed_hash": check["computed_hash"],
+            "ipfs_cid": ipfs_cid,
+        }
+    except Exception as e:
+        return {"idx": idx, "result": "error", "reason": str(e)}
+
+async def bounded_map(fn, items, limit: int):
+    """Yield fn(item) results as they complete, with at most `limit` in flight."""
+    items = iter(items)
+    pending = set()
+    while True:
+        while len(pending) < limit:
+            try:
+                pending.add(asyncio.ensure_future(fn(next(items))))
+            except StopIteration:
+                break
+        if not pending:
+            return
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            yield task.result()
+
+@app.post("/verify_cdrs")
+async def verify_cdrs(req: VerifyBatchRequest):
+    """
+    Verify many CDRs concurrently. Streams one NDJSON line per record (in
+    completion order) and a final summary line with verified, mismatched
+    and missing counts.
+    """
+    if req.indexes is not None:
+        indexes = req.indexes
+        total = len(indexes)
+    elif req.start is not None and req.end is not None and req.end >= req.start:
+        indexes = range(req.start, req.end)
+        total = len(indexes)
+    else:
+        raise HTTPException(status_code=400, detail="Provide either 'indexes' or a 'start'/'end' range.")
+
+    async def results():
+        counts = {"verified": 0, "mismatch": 0, "missing": 0, "error": 0}
+        started = time.monotonic()
+        # Records not already cached are read with range calls one window ahead
+        windows = [indexes[i:i + VERIFY_PREFETCH] for i in range(0, len(indexes), VERIFY_PREFETCH)]
+        prefetch = lambda window: asyncio.ensure_future(
+            reader.read_indexes_async([i for i in window if i not in verify_cache])
+        )
+        pending = prefetch(windows[0]) if windows else None
+        for n, window in enumerate(windows):
+            records = await pending
+            pending = prefetch(windows[n + 1]) if n + 1 < len(windows) else None
+            async for line in bounded_map(lambda i: verify_one(i, records.get(i)), window, req.concurrency):
+                counts[line["result"]] += 1
+                yield json.dumps(line) + "\n"
+        yield json.dumps({
+            "summary": {
+                "total": total,
+                "verified": counts["verified"],
+                "mismatched": counts["mismatch"],
+                "missing": counts["missing"],
+                "errors": counts["error"],
+                "elapsed_seconds": round(time.monotonic() - started, 3),
+            }
+        }) + "\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
 
 # ---------- BILLING CALCULATION ----------
-RATE_PER_SECOND = 0.05
+@app.get("/billing/summary")
+async def billing_summary(
+    start: str | None = Query(None, alias="from", description="ISO date/datetime or epoch seconds (inclusive)"),
+    end: str | None = Query(None, alias="to", description="ISO date/datetime or epoch seconds (exclusive)"),
+    group_by: str | None = Query(None, description=f"One of: {', '.join(GROUP_BY)}"),
+    limit: int = Query(1000, ge=1, le=100000),
+):
+    """Billed totals over every mirrored CDR in a time range, optionally grouped."""
+    if group_by is not None and group_by not in GROUP_BY:
+        raise HTTPException(status_code=400, detail=f"group_by must be one of: {', '.join(GROUP_BY)}")
+    start_ts = parse_time_bound(start, "from")
+    end_ts = parse_time_bound(end, "to")
+    try:
+        started = time.perf_counter()
+        await asyncio.to_thread(rating.refresh, mirror)
+        summary = await asyncio.to_thread(rating.summary, start_ts, end_ts, group_by, limit)
+        return {
+            "from": start_ts,
+            "to": end_ts,
+            "group_by": group_by,
+            **summary,
+            "last_synced_block": mirror.last_synced_block(),
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Billing summary failed: {e}")
+
+@app.get("/billing/tariffs")
+def billing_tariffs():
+    """Tariff table in use (longest callee prefix wins; unmatched calls use the default rate)."""
+    return rating.describe()
 
 @app.get("/billing/{idx}")
-def calculate_billing(idx: int):
+async def calculate_billing(idx: int):
     """Calculate call cost only if verified."""
     try:
-        verify_result = verify_cdr(idx)
+        verify_result = await verify_cdr(idx)
         if not verify_result.get("verified"):
             raise HTTPException(
                 status_code=400,
@@ -301,7 +1298,14 @@ def calculate_billing(idx: int):
         except (TypeError, ValueError):
             raise HTTPException(status_code=400, detail=f"Invalid duration format: {duration_raw}")
 
-        cost = round(duration * RATE_PER_SECOND, 2)
+        quote = rating.quote({
+            "idx": idx,
+            "caller": verify_result.get("caller", ""),
+            "callee": verify_result.get("callee", ""),
+            "duration": duration,
+            "status": verify_result.get("status", ""),
+            "timestamp": verify_result.get("timestamp", ""),
+        })
 
         return {
             "idx": idx,
@@ -312,9 +1316,10 @@ def calculate_billing(idx: int):
             "status": str(verify_result.get("status", "")),
             "hash": verify_result.get("onchain_hash"),
             "verified": True,
-            "rate_per_second": RATE_PER_SECOND,
-            "billing_cost": cost,
-            "currency": "USD",
+            "tariff": quote["tariff"],
+            "rate_per_second": quote["rate_per_second"],
+            "billing_cost": quote["cost"],
+            "currency": rating.currency,
         }
 
     except HTTPException as e:
@@ -325,56 +1330,187 @@ def calculate_billing(idx: int):
         )
 
 # ---------- RESTORE FROM BACKUP ----------
-@app.post("/restore_cdrs")
-def restore_cdrs():
-    """Re-upload all locally backed-up CDRs to blockchain."""
-    if not LOCAL_BACKUP.exists():
-        raise HTTPException(status_code=404, detail="No local backup file found.")
+@app.post("/restore_cdrs", status_code=202)
+def restore_cdrs(resume: bool = Query(True, description="Continue an unfinished job from its checkpoint")):
+    """
+    Start a background job that re-uploads backed-up CDRs missing on chain
+    (known hashes are skipped). Poll GET /restore_cdrs/{job_id} for progress.
+    """
+    if backup_log.count() == 0:
+        raise HTTPException(status_code=404, detail="Local backup is empty.")
     try:
-        with open(LOCAL_BACKUP, "r") as f:
-            data = json.load(f)
-        if not data:
-            raise HTTPException(status_code=400, detail="Backup file is empty.")
+        job = restore_engine.start(backup_log.iter_records, backup_log.count(), resume=resume)
+    except RestoreBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"status": "started", "job_id": job["job_id"], "resumed_from": job["resumed_from"],
+            "status_url": f"/restore_cdrs/{job['job_id']}"}
 
-        restored = []
-        for cdr in data:
-            try:
-                tx = contract.functions.storeCDR(
-                    cdr["caller"], cdr["callee"], int(cdr["duration"]),
-                    cdr["status"], cdr["timestamp"], cdr["hash"]
-                ).transact({"from": account, "gas": 500_000})
-                receipt = w3.eth.wait_for_transaction_receipt(tx)
-                idx = contract.functions.recordCount().call() - 1
-                save_ipfs_mapping(idx, cdr.get("ipfs_cid"))
-                restored.append({"idx": idx, "status": "restored"})
-                print(f"✅ Restored CDR #{idx}")
-                time.sleep(0.2)
-            except Exception as e:
-                print(f"⚠️ Failed to restore record: {e}")
-        return {"restored_count": len(restored), "records": restored}
+@app.get("/restore_cdrs/{job_id}")
+def restore_status(job_id: str):
+    """Progress of a restore job: counts, next backup position, rate and ETA."""
+    job = restore_engine.status(job_id)
+    if job is None:
+        checkpoint = restore_engine.load_checkpoint()
+        if checkpoint and checkpoint.get("job_id") == job_id:
+            return checkpoint
+        raise HTTPException(status_code=404, detail="Unknown restore job.")
+    return job
+
+@app.post("/restore_cdrs/{job_id}/cancel")
+def cancel_restore(job_id: str):
+    """Stop sending new transactions; in-flight ones are still collected. Resume with POST /restore_cdrs."""
+    if restore_engine.status(job_id) is None:
+        raise HTTPException(status_code=404, detail="Unknown restore job.")
+    restore_engine.cancel()
+    return {"status": "cancelling", "job_id": job_id}
+
+# ---------- DEDUP INDEX ----------
+@app.post("/dedup/check")
+def dedup_check(hashes: list[str]):
+    """Tell a client which CDR hashes are already stored or queued, so it can skip them."""
+    known = dedup.lookup_many(hashes)
+    return {"known": known, "unknown": [h for h in hashes if h not in known]}
+
+@app.post("/dedup/warm")
+def dedup_warm(source: str = Query("mirror", pattern="^(mirror|chain)$")):
+    """Reload known hashes from the local mirror, or rescan the whole chain."""
+    try:
+        if source == "chain":
+            added, scanned = warm_dedup_from_chain()
+        else:
+            added, scanned = warm_dedup_from_mirror(full=True), mirror.count()
+        return {"source": source, "scanned": scanned, "added": added, "size": len(dedup)}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Restore failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Dedup warm-up failed: {e}")
+
+@app.get("/dedup_stats")
+def dedup_stats():
+    return dedup.stats()
+
+# ---------- VERIFICATION CACHE STATS ----------
+@app.get("/verify_cache_stats")
+def verify_cache_stats():
+    """Hit/miss counters for cached verification results."""
+    return verify_cache.stats()
+
+# ---------- PUSH FEED STATS ----------
+@app.get("/feed_stats")
+def feed_stats():
+    """Published/duplicate counters and live subscriber count for the push feed."""
+    return feed.stats()
+
+# ---------- METRICS ----------
+@metrics.collector
+def pipeline_metrics():
+    """Queue depths, cache hit counters and lag, read from the components at scrape time."""
+    ingest, pins, gateway = ingest_queue.stats(), ipfs_node.stats(), ipfs_gateway.stats()
+    verify, fed, ranges = verify_cache.stats(), feed.stats(), reader.stats()
+    return [
+        ("cdr_ingest_queue_depth", "gauge", "CDRs waiting in the write-behind queue", ingest["queue_depth"]),
+        ("cdr_ingest_queue_capacity", "gauge", "Write-behind queue capacity", ingest["queue_capacity"]),
+        ("cdr_ingest_pending_tickets", "gauge", "Accepted CDRs not yet confirmed or failed", ingest["pending_tickets"]),
+        ("cdr_ingest_oldest_pending_seconds", "gauge", "Age of the oldest unconfirmed CDR", ingest["oldest_pending_seconds"]),
+        ("cdr_ipfs_pin_backlog", "gauge", "CIDs waiting to be pinned", pins["pin_backlog"]),
+        ("cdr_ipfs_pin_oldest_seconds", "gauge", "Age of the oldest CID waiting to be pinned", pins["oldest_pin_age_seconds"]),
+        ("cdr_ipfs_pinned_total", "counter", "CIDs pinned", pins["pinned"]),
+        ("cdr_ipfs_pin_failures_total", "counter", "Failed /pin/add calls", pins["pin_failures"]),
+        ("cdr_ipfs_cache_lookups_total", "counter", "IPFS document lookups by result", [
+            ({"result": "memory_hit"}, gateway["memory_hits"]),
+            ({"result": "disk_hit"}, gateway["disk_hits"]),
+            ({"result": "miss"}, gateway["misses"]),
+        ]),
+        ("cdr_ipfs_cache_hit_ratio", "gauge", "IPFS cache hit rate since start", gateway["hit_rate"]),
+        ("cdr_ipfs_gateway_errors_total", "counter", "CIDs no gateway could return", gateway["errors"]),
+        ("cdr_ipfs_gateway_rejected_total", "counter", "Gateway answers that did not hash to the CID", gateway["rejected"]),
+        ("cdr_verify_cache_lookups_total", "counter", "Verification cache lookups by result", [
+            ({"result": "hit"}, verify["hits"]), ({"result": "miss"}, verify["misses"]),
+        ]),
+        ("cdr_verify_cache_hit_ratio", "gauge", "Verification cache hit rate since start", verify["hit_rate"]),
+        ("cdr_dedup_duplicates_total", "counter", "CDRs rejected as already stored or queued", dedup.counters["duplicates"]),
+        ("cdr_dedup_lookups_total", "counter", "Dedup checks by where they were answered", [
+            ({"source": "bloom"}, dedup.counters["bloom_negatives"]),
+            ({"source": "store"}, dedup.counters["store_lookups"]),
+        ]),
+        ("cdr_feed_subscribers", "gauge", "Live WebSocket/SSE subscribers", fed["subscribers"]),
+        ("cdr_feed_published_total", "counter", "CDRs pushed to the feed", fed["published"]),
+        ("cdr_range_page_size", "gauge", "Current getCDRRange page size", ranges["page_size"]),
+        ("cdr_range_calls_total", "counter", "getCDRRange / getCDR read calls", ranges["calls"]),
+        ("cdr_range_failures_total", "counter", "Failed range reads", ranges["failures"]),
+        ("cdr_mirror_rows", "gauge", "Records in the local mirror", mirror.count()),
+    ]
+
+@metrics.collector
+def follower_metrics():
+    head = w3.eth.block_number
+    return [
+        ("cdr_chain_head_block", "gauge", "Latest block on the node", head),
+        ("cdr_follower_block", "gauge", "Last block processed by the chain follower", follower.last_block),
+        ("cdr_follower_lag_blocks", "gauge", "Blocks the mirror is behind the chain head", max(head - follower.last_block, 0)),
+        ("cdr_follower_reorgs_total", "counter", "Reorgs handled by the chain follower", follower.reorgs),
+    ]
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """Prometheus scrape endpoint: stage latency histograms, queue depths, cache hit rates and lag."""
+    return Response(metrics.render(), media_type=CONTENT_TYPE)
+
+# ---------- RANGE READER STATS ----------
+@app.get("/range_reader_stats")
+def range_reader_stats():
+    """getCDRRange calls, records read, failures and the current adaptive page size."""
+    return reader.stats()
+
+# ---------- IPFS CACHE STATS ----------
+@app.get("/ipfs_stats")
+def ipfs_stats():
+    """Hit/miss counters for the IPFS document cache and the local pin queue backlog."""
+    return {**ipfs_gateway.stats(), "pins": ipfs_node.stats()}
 
 # ---------- DEBUG MAP ----------
 @app.get("/debug_map")
 def debug_map():
     """Show current index → CID mapping."""
-    ensure_ipfs_map()
-    with open(IPFS_MAP_FILE, "r") as f:
-        return json.load(f)
+    return cid_index.as_dict()
 
 # ==========================================================
-#  AUTO MIGRATE OLD MAP FILE ON STARTUP
+#  STARTUP / SHUTDOWN HOOKS
 # ==========================================================
 @app.on_event("startup")
-def startup_event():
-    ensure_ipfs_map()
-    print("✅ API startup complete — IPFS map validated.")
+async def startup_event():
+    global rpc_session
+    rpc_session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=RPC_CONCURRENCY, keepalive_timeout=60),
+        timeout=aiohttp.ClientTimeout(total=RPC_TIMEOUT),
+    )
+    await async_w3.provider.cache_async_session(rpc_session)
+    feed.attach(asyncio.get_running_loop())
 
-    if LOCAL_BACKUP.exists():
-        try:
-            with open(LOCAL_BACKUP, "r") as f:
-                data = json.load(f)
-                print(f"🧩 Local backup loaded ({len(data)} stored CDRs).")
-        except Exception:
-            print("⚠️ Could not read backup file.")
+    ingest_queue.start()
+    ipfs_node.start()
+    follower.start()
+    print(f"✅ API startup complete — IPFS map loaded ({len(cid_index)} entries).")
+
+    imported = backup_log.import_legacy(LEGACY_BACKUP)
+    if imported:
+        print(f"📥 Migrated {imported} CDRs from {LEGACY_BACKUP.name} into the backup log.")
+    print(f"🧩 Local backup ready ({backup_log.count()} stored CDRs in {len(backup_log.segments())} segment(s)).")
+
+    asyncio.get_running_loop().run_in_executor(None, warm_dedup)
+    asyncio.get_running_loop().run_in_executor(None, warm_rating)
+    if COLD_SYNC:
+        asyncio.get_running_loop().run_in_executor(None, cold_sync_mirror)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await asyncio.to_thread(ingest_queue.stop)
+    await asyncio.to_thread(follower.stop)
+    await asyncio.to_thread(restore_engine.close)
+    await asyncio.to_thread(ipfs_node.stop)
+    backup_log.close()
+    dedup.close()
+    verify_cache.close()
+    mirror.close()
+    await ipfs_gateway.aclose()
+    if rpc_session is not None:
+        await rpc_session.close()
+    print("🛑 Ingest queue drained.")
@@ -0,0 +1,366 @@
+"""
+Historical backfill of an existing Master.csv (python cdr_listener.py backfill).
+
+The file is memory-mapped and cut into byte ranges that end on a newline.
+Worker processes parse and hash the ranges (cdr_parser's bulk path) while
+the main process, in file order:
+
+  1. drops CDRs the backend already has stored (POST /dedup/check), under
+     their hash and, unless --columns is legacy-split, also under the hash
+     the old comma-splitting listener gave the same line, so lines it
+     already anchored are not submitted a second time under a new hash,
+  2. packs each submit batch into one IPFS archive chunk ("<cid>#<n>" refs),
+  3. hands the batch to the write-behind queue (POST /queue_cdrs), backing
+     off on 429 and never going faster than --rate CDRs per second,
+  4. polls the tickets (POST /ingest/tickets), resubmitting CDRs whose
+     batch failed or that an API restart dropped from its in-memory queue,
+  5. checkpoints the end of every range whose CDRs are all confirmed.
+
+A restart resumes at the checkpoint; CDRs past it that did get stored are
+filtered out again by the dedup check. The backfill stops at the file size
+it saw when it started; newer lines belong to the live listener. A quoted
+field containing a newline must not straddle a range boundary (Asterisk
+does not write those).
+"""
+import argparse
+import io
+import json
+import mmap
+import os
+import pathlib
+import signal
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import requests
+
+from cdr_archive import make_ref, pack_chunk
+from cdr_parser import LEGACY_SPLIT, CDRParser
+from ingest_tickets import LOOKUP_SIZE, PendingTickets
+from ipfs_client import IPFSError, KuboClient
+
+BASE_DIR = pathlib.Path(__file__).resolve().parent
+CHECKPOINT = os.getenv("CDR_BACKFILL_CHECKPOINT", str(BASE_DIR / "cdr_backfill_offset.json"))
+API_BASE = os.getenv("CDR_API_BASE", "http://127.0.0.1:8000")
+DEDUP_CHECK_SIZE = 5000
+PROGRESS_INTERVAL = 5.0
+MAX_ATTEMPTS = 8  # per API call, for 5xx and connection errors (429 is waited out)
+FLUSH_FAILURES = 5  # failed backend flushes before a CDR is given up
+TICKET_POLL_INTERVAL = 2.0
+
+_parser = None
+_legacy = None
+
+
+class BackfillError(Exception):
+    """Raised when the backend keeps failing or answers in a way the backfill can't handle."""
+
+
+# ------------------ Worker processes ------------------
+def _init_worker(spec, legacy_dedup):
+    global _parser, _legacy
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C is handled by the main process
+    _parser = CDRParser.from_spec(spec)
+    _legacy = CDRParser.from_spec(LEGACY_SPLIT) if legacy_dedup and not _parser.legacy_split else None
+
+
+def parse_range(path: str, start: int, end: int):
+    """
+    Parse and hash bytes [start, end) of the file; runs in a worker process.
+    Returns (start, end, cdrs, rejected, aliases), aliases mapping a CDR's
+    hash to the old listener's hash for the same line where they differ.
+    """
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        data = mm[start:end]
+    if _legacy is None:
+        cdrs, rejected = _parser.parse_bulk(data)
+        return start, end, cdrs, rejected, {}
+
+    # Line by line, so each CDR can be paired with its legacy-split hash
+    cdrs, rejected, aliases = [], 0, {}
+    for line in io.StringIO(data.decode("utf-8", errors="replace"), newline=None):
+        if not line.strip():
+            continue
+        cdr = _parser.parse_line(line)
+        if cdr is None:
+            rejected += 1
+            continue
+        cdrs.append(cdr)
+        old = _legacy.parse_line(line)
+        if old is not None and old["hash"] != cdr["hash"]:
+            aliases[cdr["hash"]] = old["hash"]
+    return start, end, cdrs, rejected, aliases
+
+
+def split_ranges(path: str, start: int, end: int, range_size: int):
+    """Byte ranges [a, b) covering [start, end), each ending just after a newline (or at end)."""
+    ranges = []
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        position = start
+        while position < end:
+            cut = min(position + range_size, end)
+            if cut < end:
+                newline = mm.find(b"\n", cut - 1, end)
+                cut = end if newline < 0 else newline + 1
+            ranges.append((position, cut))
+            position = cut
+    return ranges
+
+
+# ------------------ Checkpoint ------------------
+def load_checkpoint(path: str, inode: int):
+    try:
+        with open(CHECKPOINT) as f:
+            state = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if state.get("path") != path or state.get("inode") != inode:
+        return None
+    return state
+
+
+def save_checkpoint(state: dict):
+    tmp = CHECKPOINT + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, CHECKPOINT)
+
+
+# ------------------ Backend ------------------
+class Backend:
+    def __init__(self, api_base: str, ipfs_node, rate: float):
+        self.api_base = api_base.rstrip("/")
+        self.session = requests.Session()
+        self.ipfs_node = ipfs_node
+        self.rate = rate
+        self._next_slot = time.monotonic()
+
+    def unknown(self, cdrs: list, aliases=None) -> list:
+        """
+        CDRs the backend hasn't stored under their hash, or stored or queued
+        under their alias (legacy) hash; duplicates in the list are dropped
+        too. A CDR only queued under its own hash is submitted again so its
+        ticket can be followed until it is stored.
+        """
+        aliases = aliases or {}
+        seen, fresh = set(), []
+        for cdr in cdrs:
+            if cdr["hash"] not in seen:
+                seen.add(cdr["hash"])
+                fresh.append(cdr)
+        out = []
+        for i in range(0, len(fresh), DEDUP_CHECK_SIZE):
+            group = fresh[i:i + DEDUP_CHECK_SIZE]
+            hashes = [c["hash"] for c in group]
+            hashes += [aliases[h] for h in hashes if h in aliases]
+            r = self._post("/dedup/check", hashes)
+            known = r.json()["known"]
+            out.extend(
+                c for c in group
+                if known.get(c["hash"], {}).get("state") != "stored" and aliases.get(c["hash"]) not in known
+            )
+        return out
+
+    def attach_ipfs(self, batch: list):
+        """One archive chunk per batch; every CDR gets its "<cid>#<n>" reference."""
+        delay = 0.5
+        while True:
+            try:
+                cid = self.ipfs_node.add_bytes(pack_chunk(batch), name="cdrs.chunk")
+                break
+            except IPFSError as e:
+                print(f"[IPFS ERROR] Could not upload chunk, retrying in {delay:.1f}s: {e}")
+                time.sleep(delay)
+                delay = min(delay * 2, 30)
+        self.ipfs_node.pin_later(cid)
+        return [{**cdr, "ipfs_cid": make_ref(cid, n)} for n, cdr in enumerate(batch)]
+
+    def throttle(self, n: int):
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        if self._next_slot > now:
+            time.sleep(self._next_slot - now)
+        self._next_slot = max(self._next_slot, now) + n / self.rate
+
+    def submit(self, batch: list) -> dict:
+        """
+        Queue a batch; a 400 (a CDR the chain can't take) is bisected so only
+        the bad CDRs are dropped. "responses" holds the (cdrs, body) pairs
+        the batch was accepted as, for PendingTickets.
+        """
+        self.throttle(len(batch))
+        r = self._post("/queue_cdrs", batch, ok=(202, 400))
+        if r.status_code == 202:
+            body = r.json()
+            return {"queued": len(body["tickets"]), "duplicates": len(body["duplicates"]), "rejected": 0,
+                    "responses": [(batch, body)]}
+        if len(batch) == 1:
+            print(f"[❌ REJECTED] {batch[0]['hash']}: {r.json().get('detail')}")
+            return {"queued": 0, "duplicates": 0, "rejected": 1, "responses": []}
+        half = len(batch) // 2
+        left, right = self.submit(batch[:half]), self.submit(batch[half:])
+        return {k: left[k] + right[k] for k in left}
+
+    def poll(self, pending) -> dict:
+        """Refresh ticket states and resubmit CDRs whose batch failed or was lost; returns submit() counts."""
+        tickets = pending.tickets()
+        for i in range(0, len(tickets), LOOKUP_SIZE):
+            chunk = tickets[i:i + LOOKUP_SIZE]
+            r = self._post("/ingest/tickets", chunk)
+            pending.update(dict(zip(chunk, r.json()["tickets"])))
+        retry, given_up = pending.due()
+        for cdr in given_up:
+            print(f"[❌ FAILED] {cdr['hash']}: backend flush failed {FLUSH_FAILURES} times")
+        result = {"queued": 0, "duplicates": 0, "rejected": len(given_up), "responses": []}
+        if retry:
+            print(f"[🔁 RESUBMIT] {len(retry)} CDRs lost or failed in the backend queue")
+            result = self.submit(retry)
+            result["rejected"] += len(given_up)
+            pending.track(result["responses"])
+        return result
+
+    def _post(self, route: str, payload, ok=(200,)):
+        """POST with backoff: 429 is waited out, 5xx and connection errors get MAX_ATTEMPTS, anything else fails."""
+        delay, failures = 0.5, 0
+        while True:
+            try:
+                r = self.session.post(self.api_base + route, json=payload, timeout=60)
+                if r.status_code in ok:
+                    return r
+                if r.status_code == 429:
+                    delay = float(r.headers.get("Retry-After", delay))
+                    print(f"[⏳ BACKPRESSURE] Backend queue full, retrying in {delay:.1f}s")
+                elif r.status_code < 500:
+                    raise BackfillError(f"{route} {r.status_code}: {r.text[:200]}")
+                else:
+                    failures += 1
+                    print(f"[❌ API ERROR] {route} {r.status_code}: {r.text[:200]}")
+            except requests.RequestException as e:
+                failures += 1
+                print(f"[API Push Error] {route}: {e}")
+            if failures >= MAX_ATTEMPTS:
+                raise BackfillError(f"{route} still failing after {MAX_ATTEMPTS} attempts")
+            time.sleep(delay)
+            delay = min(delay * 2, 30)
+
+
+# ------------------ Main ------------------
+def run(args):
+    path = os.path.abspath(args.file)
+    st = os.stat(path)
+    state = None if args.restart else load_checkpoint(path, st.st_ino)
+    if state is None:
+        state = {"path": path, "inode": st.st_ino, "end": st.st_size, "offset": 0,
+                 "parsed": 0, "rejected": 0, "skipped": 0, "queued": 0, "chain_rejected": 0}
+    end = state["end"]
+    if state["offset"] >= end:
+        print(f"[BACKFILL] {path} already backfilled up to byte {end}.")
+        return state
+    print(f"[BACKFILL] {path}: bytes {state['offset']:,} → {end:,} "
+          f"({'resuming' if state['offset'] else 'starting'}, {args.workers} workers)")
+
+    ipfs_node = None if args.no_ipfs else KuboClient(args.ipfs_api).start()
+    backend = Backend(args.api, ipfs_node, args.rate)
+    ranges = split_ranges(path, state["offset"], end, args.range_mb << 20)
+    columns = CDRParser.from_spec(args.columns).spec  # a bad --columns fails here, not in every worker
+    started, last_report, done_bytes = time.monotonic(), 0.0, 0
+    pending = PendingTickets(max_failures=FLUSH_FAILURES)
+    next_poll = time.monotonic() + TICKET_POLL_INTERVAL
+
+    def poll():
+        result = backend.poll(pending)
+        state["chain_rejected"] += result["rejected"]
+        offset = pending.committable()
+        if offset is not None:
+            state["offset"] = offset
+            save_checkpoint(state)
+
+    initargs = (columns, not args.no_legacy_dedup)
+    with ProcessPoolExecutor(args.workers, initializer=_init_worker, initargs=initargs) as pool:
+        # Keep a bounded window of ranges in flight; results are consumed in file order
+        window = args.workers * 2
+        futures = [pool.submit(parse_range, path, a, b) for a, b in ranges[:window]]
+        for i in range(len(ranges)):
+            start, stop, cdrs, rejected, aliases = futures[i].result()
+            futures[i] = None
+            if i + window < len(ranges):
+                futures.append(pool.submit(parse_range, path, *ranges[i + window]))
+
+            fresh = backend.unknown(cdrs, aliases)
+            state["parsed"] += len(cdrs)
+            state["rejected"] += rejected
+            state["skipped"] += len(cdrs) - len(fresh)
+            responses = []
+            for j in range(0, len(fresh), args.batch_size):
+                batch = fresh[j:j + args.batch_size]
+                if ipfs_node:
+                    batch = backend.attach_ipfs(batch)
+                result = backend.submit(batch)
+                state["queued"] += result["queued"]
+                state["skipped"] += result["duplicates"]
+                state["chain_rejected"] += result["rejected"]
+                responses += result["responses"]
+            pending.add(stop, responses)
+            done_bytes += stop - start
+
+            # Wait for the backend while too much is unconfirmed, so a crash never costs more than that
+            while len(pending) >= args.max_unconfirmed or time.monotonic() >= next_poll:
+                poll()
+                next_poll = time.monotonic() + TICKET_POLL_INTERVAL
+                if len(pending) >= args.max_unconfirmed:
+                    time.sleep(TICKET_POLL_INTERVAL)
+
+            now = time.monotonic()
+            if now - last_report >= PROGRESS_INTERVAL or i == len(ranges) - 1:
+                last_report = now
+                elapsed = now - started
+                speed = done_bytes / elapsed if elapsed else 0
+                eta = (end - stop) / speed if speed else 0
+                print(f"[📊 BACKFILL] {stop / end:6.1%} | parsed={state['parsed']:,} queued={state['queued']:,} "
+                      f"skipped={state['skipped']:,} bad_lines={state['rejected']:,} | "
+                      f"{speed / 2**20:.1f} MiB/s, ETA {eta:,.0f}s")
+
+    while len(pending) or state["offset"] < end:
+        if len(pending):
+            print(f"[⏳ BACKFILL] Waiting for {len(pending):,} queued CDRs to be confirmed...")
+        poll()
+        if len(pending):
+            time.sleep(TICKET_POLL_INTERVAL)
+
+    if ipfs_node:
+        ipfs_node.stop()
+    print(f"[✅ BACKFILL] Done: {state['queued']:,} CDRs queued, {state['skipped']:,} already known, "
+          f"{state['chain_rejected']:,} rejected by the API.")
+    return state
+
+
+def main(argv=None):
+    from cdr_listener import CDR_COLUMNS, CDR_FILE, IPFS_API_URL
+    parser = argparse.ArgumentParser(prog="cdr_listener.py backfill", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--file", default=CDR_FILE)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--range-mb", type=int, default=16, help="bytes per parse task, in MiB")
+    parser.add_argument("--batch-size", type=int, default=500, help="CDRs per /queue_cdrs call and IPFS chunk")
+    parser.add_argument("--rate", type=float, default=0, help="max CDRs per second submitted (0 = unlimited)")
+    parser.add_argument("--max-unconfirmed", type=int, default=20_000,
+                        help="queued CDRs not confirmed yet before parsing pauses")
+    parser.add_argument("--columns", default=CDR_COLUMNS, help="asterisk, legacy-split, legacy or caller=1,callee=2,...")
+    parser.add_argument("--api", default=API_BASE)
+    parser.add_argument("--ipfs-api", default=IPFS_API_URL)
+    parser.add_argument("--no-ipfs", action="store_true", help="submit without IPFS documents")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and start from byte 0")
+    parser.add_argument("--no-legacy-dedup", action="store_true",
+                        help="only dedup on the --columns hash (faster; for files the old listener never read)")
+    args = parser.parse_args(argv)
+    try:
+        run(args)
+    except KeyboardInterrupt:
+        print("\n[EXIT] Backfill interrupted; rerun to resume from the checkpoint.")
+    except BackfillError as e:
+        print(f"[❌ BACKFILL] Stopped: {e}. Rerun to resume from the checkpoint.")
+        sys.exit(1)
@@ -0,0 +1,225 @@
+"""
+Append-only, crash-safe local CDR backup.
+
+Records are written as one JSON object per line into numbered segment
+files (segment-000001.jsonl, ...). Appends never rewrite earlier data:
+every append is flushed to the OS, fsync'ed in groups (and by a
+background timer once fsync_interval passes with records still unsynced,
+so the tail of a burst doesn't wait for the next append), segments rotate
+at a size limit, and a small index.json records how many records each sealed
+segment holds so counts never require reading the data back.
+
+A torn last line left by a crash is trimmed on open instead of
+discarding the whole backup.
+"""
+import json
+import os
+import pathlib
+import threading
+import time
+
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".jsonl"
+
+
+class BackupLog:
+    def __init__(self, directory, segment_max_bytes=64 * 1024 * 1024,
+                 fsync_every=100, fsync_interval=1.0):
+        self.dir = pathlib.Path(directory)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.index_file = self.dir / "index.json"
+        self.segment_max_bytes = segment_max_bytes
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+
+        self._lock = threading.Lock()
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._index = self._load_index()
+        self._open_active()
+
+        self._stop = threading.Event()
+        self._syncer = threading.Thread(target=self._sync_loop, name="backup-fsync", daemon=True)
+        self._syncer.start()
+
+    # ---------- Index ----------
+    def _load_index(self):
+        try:
+            with open(self.index_file, "r") as f:
+                index = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            index = {"segments": []}
+
+        # Rebuild entries for segments the index doesn't know about (e.g. crash after rotation)
+        known = {s["name"] for s in index["segments"]}
+        for path in self._segment_paths():
+            if path.name not in known:
+                index["segments"].append({"name": path.name, "records": self._count_lines(path), "sealed": False})
+        index["segments"].sort(key=lambda s: s["name"])
+        for segment in index["segments"][:-1]:
+            segment["sealed"] = True
+        return index
+
+    def _save_index(self):
+        tmp = self.index_file.with_suffix(".json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(self._index, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.index_file)
+
+    def _segment_paths(self):
+        return sorted(self.dir.glob(f"{SEGMENT_PREFIX}*{SEGMENT_SUFFIX}"))
+
+    @staticmethod
+    def _count_lines(path):
+        with open(path, "rb") as f:
+            return sum(1 for line in f if line.endswith(b"\n"))
+
+    # ---------- Active segment ----------
+    def _open_active(self):
+        if not self._index["segments"] or self._index["segments"][-1].get("sealed"):
+            number = len(self._index["segments"]) + 1
+            self._index["segments"].append(
+                {"name": f"{SEGMENT_PREFIX}{number:06d}{SEGMENT_SUFFIX}", "records": 0, "sealed": False}
+            )
+            self._save_index()
+
+        self._active = self._index["segments"][-1]
+        path = self.dir / self._active["name"]
+        self._repair_tail(path)
+        self._active["records"] = self._count_lines(path) if path.exists() else 0
+        self._fh = open(path, "ab")
+
+    @staticmethod
+    def _repair_tail(path):
+        """Drop a partially written last line left behind by a crash."""
+        if not path.exists():
+            return
+        with open(path, "rb+") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size == 0:
+                return
+            f.seek(max(size - 1, 0))
+            if f.read(1) == b"\n":
+                return
+            # Walk back to the last complete line
+            pos = size
+            chunk = 4096
+            while pos > 0:
+                start = max(pos - chunk, 0)
+                f.seek(start)
+                data = f.read(pos - start)
+                nl = data.rfind(b"\n")
+                if nl != -1:
+                    f.truncate(start + nl + 1)
+                    print(f"⚠️ Trimmed torn record at end of {path.name}.")
+                    return
+                pos = start
+            f.truncate(0)
+
+    def _rotate(self):
+        self._sync_locked()
+        self._fh.close()
+        self._active["sealed"] = True
+        self._open_active()
+        print(f"🗂️ Backup rotated to {self._active['name']}.")
+
+    # ---------- Writes ----------
+    def append(self, record: dict):
+        self.append_many([record])
+
+    def append_many(self, records):
+        lines = b"".join(
+            json.dumps(r, default=str, separators=(",", ":")).encode() + b"\n" for r in records
+        )
+        with self._lock:
+            self._fh.write(lines)
+            self._active["records"] += len(records)
+            self._unsynced += len(records)
+            self._fh.flush()
+            if (self._unsynced >= self.fsync_every
+                    or time.monotonic() - self._last_sync >= self.fsync_interval):
+                self._sync_locked()
+            if self._fh.tell() >= self.segment_max_bytes:
+                self._rotate()
+
+    def sync(self):
+        with self._lock:
+            self._sync_locked()
+
+    def _sync_loop(self):
+        """fsync records left over from a burst once fsync_interval has passed."""
+        while not self._stop.wait(self.fsync_interval / 2):
+            with self._lock:
+                if self._unsynced and time.monotonic() - self._last_sync >= self.fsync_interval:
+                    self._sync_locked()
+
+    def _sync_locked(self):
+        if self._unsynced == 0:
+            return
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._save_index()
+
+    def close(self):
+        self._stop.set()
+        self._syncer.join()
+        with self._lock:
+            self._sync_locked()
+            self._fh.close()
+
+    # ---------- Reads ----------
+    def count(self) -> int:
+        with self._lock:
+            return sum(s["records"] for s in self._index["segments"])
+
+    def segments(self):
+        with self._lock:
+            return [dict(s) for s in self._index["segments"]]
+
+    def iter_records(self, skip: int = 0):
+        """Stream every backed-up record in write order, optionally skipping the first `skip`."""
+        with self._lock:
+            self._fh.flush()
+            segments = [dict(s) for s in self._index["segments"]]
+
+        for segment in segments:
+            if skip >= segment["records"] and segment.get("sealed"):
+                skip -= segment["records"]
+                continue
+            path = self.dir / segment["name"]
+            if not path.exists():
+                continue
+            with open(path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # still being written
+                    if skip:
+                        skip -= 1
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        print(f"⚠️ Skipping unreadable backup line in {segment['name']}.")
+
+    # ---------- Migration ----------
+    def import_legacy(self, legacy_file) -> int:
+        """One-time import of the old single-array cdr_backup.json into the log."""
+        legacy_file = pathlib.Path(legacy_file)
+        if not legacy_file.exists() or self.count() > 0:
+            return 0
+        try:
+            with open(legacy_file, "r") as f:
+                records = json.load(f)
+        except json.JSONDecodeError:
+            print(f"⚠️ Legacy backup {legacy_file.name} is corrupted — left in place, not imported.")
+            return 0
+
+        self.append_many(records)
+        self.sync()
+        legacy_file.rename(legacy_file.with_suffix(".json.migrated"))
+        return len(records)
@@ -0,0 +1,134 @@
+"""
+Benchmark the v1 (string) and v2 (packed) on-chain CDR layouts.
+
+Offline (always): ABI-decode time for getCDR results and bytes per record
+in calldata / return data, using synthetic CDRs.
+
+With --rpc: compiles and deploys VoipCDR and VoipCDRv2 on a dev node
+(Hardhat/Ganache), stores the same CDRs through storeCDRBatch and reports
+gas per CDR from the receipts and the getCDR round-trip time.
+
+    python bench_cdr_layout.py --records 2000
+    python bench_cdr_layout.py --records 500 --rpc http://127.0.0.1:8545
+"""
+import argparse
+import hashlib
+import pathlib
+import random
+import time
+
+from eth_abi import decode, encode
+
+from cdr_codec import STATUSES, V1Codec, V2Codec
+
+CONTRACTS_DIR = pathlib.Path(__file__).resolve().parent.parent / "voip_contract_project" / "contracts"
+SOLC_VERSION = "0.8.28"
+
+V1_RECORD = ["string", "string", "uint256", "string", "string", "string"]
+V2_RECORD = ["bytes32", "bytes16", "bytes16", "uint64", "uint32", "uint8"]
+
+
+def synthetic_cdrs(n: int, seed: int = 7):
+    rng = random.Random(seed)
+    start = 1_735_689_600
+    cdrs = []
+    for _ in range(n):
+        cdr = {
+            "caller": str(rng.randint(1000, 1999)),
+            "callee": "0044" + str(rng.randint(10**9, 10**10 - 1)),
+            "duration": rng.randint(0, 3600),
+            "status": rng.choice(STATUSES[1:]),
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(start + rng.randint(0, 86400 * 90))),
+        }
+        cdr["hash"] = hashlib.sha256(
+            f"{cdr['caller']}{cdr['callee']}{cdr['timestamp']}{cdr['duration']}{cdr['status']}".encode()
+        ).hexdigest()
+        cdrs.append(cdr)
+    return cdrs
+
+
+def bench_decode(cdrs, repeat: int = 3):
+    """Time ABI decode + codec decode of getCDR return data for both layouts."""
+    results = {}
+    for name, codec, types in (("v1", V1Codec(), V1_RECORD), ("v2", V2Codec(), V2_RECORD)):
+        blobs = [encode(types, codec.encode(c)) for c in cdrs]
+        best = float("inf")
+        for _ in range(repeat):
+            started = time.perf_counter()
+            decoded = [codec.decode(decode(types, b)) for b in blobs]
+            best = min(best, time.perf_counter() - started)
+        assert [d[5] for d in decoded] == [c["hash"] for c in cdrs], f"{name} hash round-trip failed"
+        results[name] = {
+            "return_bytes_per_cdr": sum(map(len, blobs)) / len(blobs),
+            "decode_us_per_cdr": best / len(blobs) * 1e6,
+        }
+    return results
+
+
+def compile_contracts():
+    import solcx
+    if SOLC_VERSION not in [str(v) for v in solcx.get_installed_solc_versions()]:
+        solcx.install_solc(SOLC_VERSION)
+    compiled = solcx.compile_files(
+        [CONTRACTS_DIR / "VoipCDR.sol", CONTRACTS_DIR / "VoipCDRv2.sol"],
+        output_values=["abi", "bin"], solc_version=SOLC_VERSION, optimize=True,
+    )
+    return {key.split(":")[-1]: value for key, value in compiled.items()}
+
+
+def bench_chain(cdrs, rpc_url: str, batch_size: int):
+    """Deploy both layouts, store the CDRs in batches and measure gas and read latency."""
+    from web3 import Web3
+    w3 = Web3(Web3.HTTPProvider(rpc_url))
+    if not w3.is_connected():
+        raise SystemExit(f"❌ Could not connect to {rpc_url}")
+    account = w3.eth.accounts[0]
+    compiled = compile_contracts()
+
+    results = {}
+    for name, contract_name, codec in (("v1", "VoipCDR", V1Codec()), ("v2", "VoipCDRv2", V2Codec())):
+        interface = compiled[contract_name]
+        factory = w3.eth.contract(abi=interface["abi"], bytecode=interface["bin"])
+        receipt = w3.eth.wait_for_transaction_receipt(factory.constructor().transact({"from": account}))
+        contract = w3.eth.contract(address=receipt.contractAddress, abi=interface["abi"])
+
+        gas = 0
+        for i in range(0, len(cdrs), batch_size):
+            payload = [codec.encode(c) for c in cdrs[i:i + batch_size]]
+            tx = contract.functions.storeCDRBatch(payload).transact({"from": account, "gas": 30_000_000})
+            gas += w3.eth.wait_for_transaction_receipt(tx).gasUsed
+
+        sample = range(min(len(cdrs), 200))
+        started = time.perf_counter()
+        for idx in sample:
+            assert codec.decode(contract.functions.getCDR(idx).call())[5] == cdrs[idx]["hash"]
+        elapsed = time.perf_counter() - started
+        results[name] = {
+            "gas_per_cdr": gas / len(cdrs),
+            "getcdr_ms": elapsed / len(sample) * 1000,
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--rpc", help="dev node URL; omit for the offline decode benchmark only")
+    args = parser.parse_args()
+
+    cdrs = synthetic_cdrs(args.records)
+    decode_results = bench_decode(cdrs)
+    chain_results = bench_chain(cdrs, args.rpc, args.batch_size) if args.rpc else {}
+
+    print(f"📊 {args.records} synthetic CDRs")
+    print(f"{'layout':<8}{'return B/CDR':>14}{'decode µs/CDR':>15}{'gas/CDR':>12}{'getCDR ms':>11}")
+    for name in ("v1", "v2"):
+        d, c = decode_results[name], chain_results.get(name, {})
+        gas = f"{c['gas_per_cdr']:,.0f}" if c else "-"
+        call = f"{c['getcdr_ms']:.2f}" if c else "-"
+        print(f"{name:<8}{d['return_bytes_per_cdr']:>14.0f}{d['decode_us_per_cdr']:>15.1f}{gas:>12}{call:>11}")
+
+
+if __name__ == "__main__":
+    main()
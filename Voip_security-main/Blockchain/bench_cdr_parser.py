@@ -0,0 +1,141 @@
+"""
+Throughput benchmark for Asterisk Master.csv parsing (lines per second).
+
+Writes a synthetic Master.csv in cdr_csv's quoted format (a third of the
+clid values contain a comma, as "Name, Team" <ext> does) and parses it with:
+
+    split      the old listener parse_cdr (line.split(",")), for reference
+    line       CDRParser.parse_line, one csv.reader per line
+    stream     iter_rows + from_row, one csv.reader over the whole file
+    chunk      CDRParser.parse_chunk on 8 MiB blocks
+    bulk       CDRParser.parse_bulk (pandas C parser) on 8 MiB blocks
+
+"wrong" counts lines whose caller/callee/timestamp/billsec came out
+different from what was written.
+
+    python bench_cdr_parser.py --lines 1000000
+    python bench_cdr_parser.py --file /var/log/asterisk/cdr-csv/Master.csv
+"""
+import argparse
+import csv
+import hashlib
+import os
+import random
+import tempfile
+import time
+
+from cdr_parser import CDRParser, iter_rows
+
+BLOCK_SIZE = 8 << 20
+
+
+def write_master_csv(path, n: int, seed: int = 7):
+    """Synthetic cdr_csv lines; returns the expected (caller, callee, start, billsec) per line."""
+    rng = random.Random(seed)
+    expected = []
+    start = 1_735_689_600
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_ALL, lineterminator="\n")
+        for i in range(n):
+            src, dst = str(rng.randint(1000, 1999)), "0044" + str(rng.randint(10**9, 10**10 - 1))
+            t = start + rng.randint(0, 86400 * 90)
+            ringing, billsec = rng.randint(0, 30), rng.randint(0, 3600)
+            clid = f'"Agent {i % 97}, Support" <{src}>' if i % 3 == 0 else f'"{src}" <{src}>'
+            stamp = lambda s: time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(s))
+            writer.writerow([
+                "", src, dst, "from-internal", clid, f"PJSIP/{src}-{i:08x}", f"PJSIP/trunk-{i:08x}",
+                "Dial", f"PJSIP/{dst}@trunk,60,tT", stamp(t), stamp(t + ringing),
+                stamp(t + ringing + billsec), str(ringing + billsec), str(billsec),
+                rng.choice(["ANSWERED", "NO ANSWER", "BUSY", "FAILED"]), "DOCUMENTATION", f"{t}.{i}", "",
+            ])
+            expected.append((src, dst, stamp(t), billsec))
+    return expected
+
+
+def legacy_parse(line):
+    """parse_cdr as it was in cdr_listener.py before cdr_parser existed."""
+    fields = line.strip().split(",")
+    if len(fields) < 15:
+        return None
+    caller = fields[1].strip('"')
+    callee = fields[2].strip('"')
+    duration_field = fields[13].strip('"')
+    duration = int(duration_field) if duration_field.isdigit() else 0
+    status = fields[12].strip('"')
+    timestamp = fields[9].strip('"')
+    cdr_hash = hashlib.sha256(f"{caller}{callee}{timestamp}{duration}{status}".encode()).hexdigest()
+    return {"caller": caller, "callee": callee, "duration": duration, "status": status,
+            "timestamp": timestamp, "hash": cdr_hash}
+
+
+def read_blocks(path):
+    """Blocks of whole lines (the cut is moved back to the last newline)."""
+    with open(path, "rb") as f:
+        rest = b""
+        while True:
+            block = f.read(BLOCK_SIZE)
+            if not block:
+                if rest:
+                    yield rest
+                return
+            block = rest + block
+            cut = block.rfind(b"\n") + 1
+            rest = block[cut:]
+            yield block[:cut]
+
+
+def run(name, path, parser):
+    if name == "split":
+        with open(path, encoding="utf-8") as f:
+            return [legacy_parse(line) for line in f]
+    if name == "line":
+        with open(path, encoding="utf-8", newline="") as f:
+            return [parser.parse_line(line) for line in f]
+    if name == "stream":
+        with open(path, encoding="utf-8", newline="") as f:
+            return [parser.from_row(row) for row, _ in iter_rows((line, None) for line in f)]
+    method = parser.parse_chunk if name == "chunk" else parser.parse_bulk
+    cdrs = []
+    for block in read_blocks(path):
+        cdrs.extend(method(block)[0])
+    return cdrs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, default=500_000)
+    parser.add_argument("--file", help="parse an existing Master.csv instead of a synthetic one")
+    parser.add_argument("--methods", default="split,line,stream,chunk,bulk")
+    args = parser.parse_args()
+
+    tmp = None
+    if args.file:
+        path, expected = args.file, None
+    else:
+        tmp = tempfile.NamedTemporaryFile(suffix=".csv", delete=False)
+        tmp.close()
+        path = tmp.name
+        expected = write_master_csv(path, args.lines)
+
+    try:
+        size = os.path.getsize(path)
+        print(f"📊 {path} ({size / 2**20:.1f} MiB)")
+        print(f"{'method':<8}{'lines/s':>14}{'MiB/s':>9}{'parsed':>11}{'wrong':>9}")
+        cdr_parser = CDRParser()
+        for name in args.methods.split(","):
+            started = time.perf_counter()
+            cdrs = run(name, path, cdr_parser)
+            elapsed = time.perf_counter() - started
+            wrong = "-"
+            if expected is not None:
+                got = [(c["caller"], c["callee"], c["timestamp"], c["duration"]) if c else None for c in cdrs]
+                wrong = sum(g != e for g, e in zip(got, expected)) + abs(len(got) - len(expected))
+            lines = len(expected) if expected is not None else len(cdrs)
+            print(f"{name:<8}{lines / elapsed:>14,.0f}{size / 2**20 / elapsed:>9.1f}{len(cdrs):>11,}{wrong:>9}")
+    finally:
+        if tmp:
+            os.unlink(path)
+
+
+if __name__ == "__main__":
+    main()
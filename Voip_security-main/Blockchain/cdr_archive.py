@@ -0,0 +1,78 @@
+"""
+Packed CDR archive chunks for IPFS.
+
+Instead of one small JSON object per call, the listener can pack many CDR
+documents into one compressed chunk and add that. A CDR is then referenced
+as "<chunk cid>#<n>", and that string is used wherever a plain CID was
+stored before (ipfs_cid in the map, the mirror and Merkle leaves).
+
+Chunk layout (little-endian):
+
+    b"CDRARCH1"                  magic
+    uint32 count                 records in the chunk
+    uint32 offsets[count + 1]    record n is payload[offsets[n]:offsets[n + 1]]
+    zlib(payload)                json.dumps(cdr) of each record, concatenated
+
+Each record is serialised exactly like a standalone document, and the
+offset index lets a reader decode one record without parsing the rest.
+Verifiers fetch the whole chunk once and cache it, so checking a chunk's
+worth of CDRs costs one gateway round trip.
+"""
+import json
+import struct
+import zlib
+
+MAGIC = b"CDRARCH1"
+_COUNT = struct.Struct("<I")
+
+
+def make_ref(cid: str, n: int) -> str:
+    return f"{cid}#{n}"
+
+
+def parse_ref(ref: str):
+    """'cid#n' → (cid, n); a plain CID → (cid, None)."""
+    cid, sep, n = ref.partition("#")
+    return (cid, int(n)) if sep else (cid, None)
+
+
+def is_chunk(raw: bytes) -> bool:
+    return raw[:len(MAGIC)] == MAGIC
+
+
+def pack_chunk(docs, level: int = 6) -> bytes:
+    """CDR dicts → chunk bytes; record n of the chunk is docs[n]."""
+    parts = [json.dumps(doc).encode() for doc in docs]
+    offsets = [0]
+    for part in parts:
+        offsets.append(offsets[-1] + len(part))
+    index = struct.pack(f"<{len(offsets)}I", *offsets)
+    return MAGIC + _COUNT.pack(len(parts)) + index + zlib.compress(b"".join(parts), level)
+
+
+class Chunk:
+    """A decoded chunk; holds the decompressed payload and the offset index."""
+
+    def __init__(self, raw: bytes):
+        if not is_chunk(raw):
+            raise ValueError("not a CDR archive chunk")
+        (count,) = _COUNT.unpack_from(raw, len(MAGIC))
+        start = len(MAGIC) + _COUNT.size
+        end = start + 4 * (count + 1)
+        if len(raw) < end:
+            raise ValueError("corrupt CDR archive chunk index")
+        self.offsets = struct.unpack_from(f"<{count + 1}I", raw, start)
+        self.payload = zlib.decompress(raw[end:])
+        if len(self.offsets) != count + 1 or self.offsets[-1] != len(self.payload):
+            raise ValueError("corrupt CDR archive chunk index")
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def record(self, n: int) -> dict:
+        if not 0 <= n < len(self):
+            raise IndexError(f"record {n} out of range for a chunk of {len(self)}")
+        return json.loads(self.payload[self.offsets[n]:self.offsets[n + 1]])
+
+    def records(self):
+        return (self.record(n) for n in range(len(self)))
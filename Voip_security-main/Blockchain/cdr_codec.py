@@ -0,0 +1,140 @@
+"""
+Codecs between CDR dicts and the on-chain VoipCDR record layouts.
+
+v1 (VoipCDR.sol) keeps every field as a dynamic string plus a redundant id,
+about nine storage slots per record. v2 (VoipCDRv2.sol) packs a record into
+three slots:
+
+    slot 0  bytes32 hash                      sha256 of the CDR string
+    slot 1  bytes16 caller | bytes16 callee   ASCII, zero-padded
+    slot 2  uint64 timestamp | uint32 duration | uint8 status
+
+The CDR hash is computed over the original strings, so v2 only accepts a
+CDR whose fields decode back to exactly the same strings (party up to 16
+ASCII bytes, "%Y-%m-%d %H:%M:%S" UTC timestamp, a known disposition).
+Anything else raises ValueError instead of being stored lossily.
+
+Both codecs decode to the v1 getCDR() order — (caller, callee, duration,
+status, timestamp, hash) — so the API's JSON responses keep their shape.
+"""
+import calendar
+import time
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+PARTY_BYTES = 16
+# Asterisk dispositions; the index is the on-chain status code
+STATUSES = ("UNKNOWN", "ANSWERED", "NO ANSWER", "BUSY", "FAILED", "CONGESTION")
+V2_FIELDS = ("hash", "caller", "callee", "timestamp", "duration", "status")
+
+
+def detect_layout(abi) -> str:
+    """'v2' if the ABI's getCDR returns a bytes32 hash, else 'v1'."""
+    for entry in abi:
+        if entry.get("type") == "function" and entry.get("name") == "getCDR":
+            if any(o["type"] == "bytes32" for o in entry.get("outputs", [])):
+                return "v2"
+    return "v1"
+
+
+def for_abi(abi):
+    return V2Codec() if detect_layout(abi) == "v2" else V1Codec()
+
+
+class V1Codec:
+    layout = "v1"
+
+    def encode(self, cdr: dict) -> tuple:
+        """CDR dict → storeCDR arguments / CDRInput tuple."""
+        return (cdr["caller"], cdr["callee"], int(cdr["duration"]), cdr["status"], cdr["timestamp"], cdr["hash"])
+
+    def decode(self, record) -> tuple:
+        return tuple(record)
+
+    def decode_event(self, r) -> tuple:
+        return (r["caller"], r["callee"], r["duration"], r["status"], r["timestamp"], r["hash"])
+
+    def decode_range_item(self, item) -> tuple:
+        """One Record struct from getCDRRange (v1 structs lead with the redundant id)."""
+        return tuple(item[1:])
+
+    def representable(self, cdr: dict) -> bool:
+        return True
+
+
+class V2Codec(V1Codec):
+    layout = "v2"
+
+    # ---------- Fields ----------
+    @staticmethod
+    def encode_party(value: str) -> bytes:
+        text = str(value)
+        if not text.isascii() or "\0" in text or len(text) > PARTY_BYTES:
+            raise ValueError(f"party {value!r} does not fit bytes{PARTY_BYTES} (max {PARTY_BYTES} ASCII characters)")
+        return text.encode("ascii").ljust(PARTY_BYTES, b"\0")
+
+    @staticmethod
+    def decode_party(raw: bytes) -> str:
+        return bytes(raw).rstrip(b"\0").decode("ascii")
+
+    @staticmethod
+    def encode_timestamp(value: str) -> int:
+        try:
+            seconds = calendar.timegm(time.strptime(str(value), TIMESTAMP_FORMAT))
+        except ValueError:
+            raise ValueError(f"timestamp {value!r} is not '{TIMESTAMP_FORMAT}'")
+        if V2Codec.decode_timestamp(seconds) != value or not 0 <= seconds < 2 ** 64:
+            raise ValueError(f"timestamp {value!r} does not round-trip")
+        return seconds
+
+    @staticmethod
+    def decode_timestamp(seconds: int) -> str:
+        return time.strftime(TIMESTAMP_FORMAT, time.gmtime(int(seconds)))
+
+    @staticmethod
+    def encode_hash(value: str) -> bytes:
+        raw = bytes.fromhex(str(value).removeprefix("0x"))
+        if len(raw) != 32:
+            raise ValueError(f"hash {value!r} is not 32 bytes")
+        return raw
+
+    # ---------- Records ----------
+    def encode(self, cdr: dict) -> tuple:
+        """CDR dict → (hash, caller, callee, timestamp, duration, status) for storeCDR / RecordV2."""
+        duration = int(cdr["duration"])
+        if not 0 <= duration < 2 ** 32:
+            raise ValueError(f"duration {duration} out of uint32 range")
+        if cdr["status"] not in STATUSES:
+            raise ValueError(f"status {cdr['status']!r} is not one of {', '.join(STATUSES)}")
+        return (
+            self.encode_hash(cdr["hash"]),
+            self.encode_party(cdr["caller"]),
+            self.encode_party(cdr["callee"]),
+            self.encode_timestamp(cdr["timestamp"]),
+            duration,
+            STATUSES.index(cdr["status"]),
+        )
+
+    def decode(self, record) -> tuple:
+        """getCDR() result in v2 order → v1 order with the original strings."""
+        hash_, caller, callee, timestamp, duration, status = record
+        return (
+            self.decode_party(caller),
+            self.decode_party(callee),
+            int(duration),
+            STATUSES[status] if status < len(STATUSES) else STATUSES[0],
+            self.decode_timestamp(timestamp),
+            bytes(hash_).hex(),
+        )
+
+    def decode_event(self, r) -> tuple:
+        return self.decode([r[k] for k in V2_FIELDS])
+
+    def decode_range_item(self, item) -> tuple:
+        return self.decode(item)
+
+    def representable(self, cdr: dict) -> bool:
+        try:
+            self.encode(cdr)
+            return True
+        except (ValueError, KeyError, TypeError):
+            return False
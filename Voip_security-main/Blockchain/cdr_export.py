@@ -0,0 +1,141 @@
+"""
+Streaming CDR export from the local mirror.
+
+Rows are read in idx order with keyset pages of `chunk_size`, and each page
+is encoded and handed to the response before the next one is read, so
+memory stays at one page whatever the ledger size. Every format carries
+idx, so an interrupted export is resumed by passing the last idx received
+(`after`) or a resume token; NDJSON also emits a token after every page.
+"""
+import base64
+import csv
+import io
+import json
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional
+    pa = pq = None
+
+EXPORT_COLUMNS = ("idx", "caller", "callee", "duration", "status", "timestamp", "hash", "ipfs_cid", "block_number")
+FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+def encode_token(fmt: str, filters: dict, after: int) -> str:
+    payload = {"format": fmt, "filters": filters, "after": after}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+
+
+def decode_token(token: str) -> dict:
+    """Inverse of encode_token; raises ValueError for a malformed token."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        if payload["format"] not in FORMATS or not isinstance(payload["filters"], dict):
+            raise ValueError
+        payload["after"] = int(payload["after"])
+    except Exception:
+        raise ValueError(f"invalid resume token: {token}")
+    return payload
+
+
+def iter_pages(mirror, filters: dict, after: int = -1, chunk_size: int = 10_000):
+    """Yield lists of mirror rows matching filters, in idx order, starting after `after`."""
+    while True:
+        rows = mirror.query(filters, "idx", False, chunk_size, (None, after))
+        if not rows:
+            return
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        after = rows[-1]["idx"]
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object that buffers until drained (lets ParquetWriter stream)."""
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+# ---------- Formats ----------
+def ndjson_stream(pages, filters: dict):
+    """One JSON object per CDR, a resume token line after every page and a final summary line."""
+    rows_out, last_idx = 0, None
+    for rows in pages:
+        buf = io.StringIO()
+        for r in rows:
+            buf.write(json.dumps({c: r[c] for c in EXPORT_COLUMNS}))
+            buf.write("\n")
+        rows_out += len(rows)
+        last_idx = rows[-1]["idx"]
+        buf.write(json.dumps({"resume_token": encode_token("ndjson", filters, last_idx), "rows": rows_out}))
+        buf.write("\n")
+        yield buf.getvalue()
+    yield json.dumps({"summary": {"rows": rows_out, "last_idx": last_idx, "complete": True}}) + "\n"
+
+
+def csv_stream(pages, header=True):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    for rows in pages:
+        writer.writerows([r[c] for c in EXPORT_COLUMNS] for r in rows)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def parquet_schema():
+    return pa.schema([
+        ("idx", pa.int64()),
+        ("caller", pa.string()),
+        ("callee", pa.string()),
+        ("duration", pa.int64()),
+        ("status", pa.string()),
+        ("timestamp", pa.string()),
+        ("start_time", pa.timestamp("s", tz="UTC")),  # parsed timestamp, null when unparseable
+        ("hash", pa.string()),
+        ("ipfs_cid", pa.string()),
+        ("block_number", pa.int64()),
+    ])
+
+
+def parquet_stream(pages, compression="zstd"):
+    """One Parquet row group per page, flushed as soon as it is written."""
+    schema = parquet_schema()
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression=compression)
+    try:
+        for rows in pages:
+            columns = {c: [r[c] for r in rows] for c in EXPORT_COLUMNS}
+            columns["start_time"] = [r["ts"] if r["ts"] >= 0 else None for r in rows]
+            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()  # footer
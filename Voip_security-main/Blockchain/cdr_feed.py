@@ -0,0 +1,137 @@
+"""
+Push feed of newly stored CDRs for WebSocket / SSE subscribers.
+
+Every path that writes mirror rows (chain follower, ingest flushes,
+store_cdr, restores) publishes them here once they are in the mirror.
+A record reaches the feed from more than one path (our own receipt, then
+the follower seeing the same event), so recently published indexes are
+remembered and each record is pushed once.
+
+Publishers run on worker threads; subscribers are asyncio queues on the
+server's event loop, fed through call_soon_threadsafe. A subscriber that
+falls more than `queue_size` messages behind is cut off with a "lagged"
+message instead of buffering without bound — it reconnects with the last
+idx it saw and catches up from the mirror.
+"""
+import asyncio
+import threading
+from collections import OrderedDict
+
+from cdr_mirror import timestamp_to_epoch
+
+
+def row_matches(row: dict, filters: dict) -> bool:
+    """In-memory equivalent of CDRMirror's filters, for one pushed row."""
+    for column in ("caller", "callee", "status"):
+        if filters.get(column) is not None and row[column] != filters[column]:
+            return False
+    if filters.get("hash_prefix") and not row["hash"].startswith(filters["hash_prefix"]):
+        return False
+    q = filters.get("q")
+    if q and row["caller"] != q and row["callee"] != q and not row["hash"].startswith(q.lower()):
+        return False
+    if filters.get("start") is not None or filters.get("end") is not None:
+        ts = timestamp_to_epoch(row["timestamp"])
+        if filters.get("start") is not None and ts < filters["start"]:
+            return False
+        if filters.get("end") is not None and not 0 <= ts < filters["end"]:
+            return False
+    if filters.get("min_duration") is not None and row["duration"] < filters["min_duration"]:
+        return False
+    if filters.get("max_duration") is not None and row["duration"] > filters["max_duration"]:
+        return False
+    return True
+
+
+class Subscription:
+    def __init__(self, feed, filters: dict, queue_size: int):
+        self.feed = feed
+        self.filters = filters
+        self.queue = asyncio.Queue()  # bounded by hand so the "lagged" marker always fits
+        self.queue_size = queue_size
+        self.lagged = False
+
+    def _offer(self, messages):
+        """Runs on the event loop."""
+        for message in messages:
+            if self.lagged:
+                return
+            if message["type"] == "cdr" and not row_matches(message["row"], self.filters):
+                continue
+            if self.queue.qsize() >= self.queue_size:
+                # Keep what is queued: the client resumes after the last idx it actually received
+                self.lagged = True
+                message = {"type": "lagged"}
+            self.queue.put_nowait(message)
+
+    def close(self):
+        self.feed.unsubscribe(self)
+
+
+class CDRFeed:
+    def __init__(self, queue_size=1000, history=10000):
+        self.queue_size = queue_size
+        self.history = history
+        self.loop = None
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._published = OrderedDict()   # idx -> None, most recent last
+        self.counters = {"published": 0, "duplicates": 0, "reorgs": 0, "lagged": 0}
+
+    def attach(self, loop):
+        """Bind to the server's event loop (call from startup)."""
+        self.loop = loop
+
+    # ---------- Subscribers ----------
+    def subscribe(self, filters: dict) -> Subscription:
+        sub = Subscription(self, filters, self.queue_size)
+        with self._lock:
+            self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            self._subscribers.discard(sub)
+            if sub.lagged:
+                self.counters["lagged"] += 1
+
+    # ---------- Publishing (any thread) ----------
+    def publish(self, rows, to_message):
+        """
+        Push mirror rows not published before. to_message(rows) turns the new
+        rows into client payloads (called once, not per subscriber).
+        """
+        with self._lock:
+            fresh = []
+            for row in rows:
+                if row["idx"] in self._published:
+                    self.counters["duplicates"] += 1
+                    continue
+                self._published[row["idx"]] = None
+                fresh.append(row)
+            while len(self._published) > self.history:
+                self._published.popitem(last=False)
+            self.counters["published"] += len(fresh)
+            subscribers = list(self._subscribers)
+        if not fresh or not subscribers or self.loop is None:
+            return
+        messages = [{"type": "cdr", "row": row, "cdr": cdr} for row, cdr in zip(fresh, to_message(fresh))]
+        for sub in subscribers:
+            self.loop.call_soon_threadsafe(sub._offer, messages)
+
+    def reorg(self, fork_block: int, removed_idxs):
+        """Tell subscribers to drop records that were reorganised away (they may be re-published)."""
+        with self._lock:
+            for idx in removed_idxs:
+                self._published.pop(idx, None)
+            self.counters["reorgs"] += 1
+            subscribers = list(self._subscribers)
+        if self.loop is None:
+            return
+        message = {"type": "reorg", "fork_block": fork_block, "removed": list(removed_idxs)}
+        for sub in subscribers:
+            self.loop.call_soon_threadsafe(sub._offer, [message])
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self.counters, "subscribers": len(self._subscribers)}
@@ -1,108 +1,432 @@
-import time
+import os
+import csv
 import json
-import hashlib
+import sys
+import time
+import queue
+import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from file_tailer import ResumableTailer
+from ipfs_client import KuboClient, IPFSError
+from cdr_archive import make_ref, pack_chunk
+from cdr_parser import CDRParser
+from ingest_tickets import LOOKUP_SIZE, PendingTickets
+from metrics import Registry, serve as serve_metrics
 
 CDR_FILE = "/var/log/asterisk/cdr-csv/Master.csv"
-API_URL = "http://127.0.0.1:8000/store_cdr"
+TAIL_CHECKPOINT = os.getenv(
+    "CDR_TAIL_CHECKPOINT",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cdr_listener_offset.json"),
+)
+DEAD_LETTER_FILE = os.getenv(
+    "CDR_DEAD_LETTER_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cdr_listener_dead_letter.jsonl"),
+)
+TAIL_FROM_START = os.getenv("CDR_TAIL_FROM_START", "0") == "1"  # only used when no checkpoint exists
+# Asterisk column mapping: "asterisk" (default), "legacy-split" (the old comma split, same
+# hashes as records stored before), "legacy" (csv rows, status from column 12)
+# or e.g. "caller=1,callee=2,timestamp=9,duration=13,status=14"
+CDR_COLUMNS = os.getenv("CDR_COLUMNS", "asterisk")
+API_BATCH_URL = "http://127.0.0.1:8000/queue_cdrs"
+API_TICKETS_URL = "http://127.0.0.1:8000/ingest/tickets"
+
+# Kubo HTTP API (works with 0.30.0+)
+IPFS_API_URL = os.getenv("IPFS_API_URL", "http://127.0.0.1:5001")
+
+# Pipeline tuning
+IPFS_WORKERS = int(os.getenv("CDR_IPFS_WORKERS", "8"))
+QUEUE_SIZE = int(os.getenv("CDR_PIPELINE_QUEUE_SIZE", "1000"))
+SUBMIT_BATCH_SIZE = int(os.getenv("CDR_SUBMIT_BATCH_SIZE", "50"))
+SUBMIT_FLUSH_INTERVAL = float(os.getenv("CDR_SUBMIT_FLUSH_INTERVAL", "1.0"))
+STATS_INTERVAL = float(os.getenv("CDR_STATS_INTERVAL", "30"))
+METRICS_PORT = int(os.getenv("CDR_METRICS_PORT", "9108"))  # Prometheus exporter; 0 disables
+IPFS_RETRIES = 3
+TICKET_POLL_INTERVAL = float(os.getenv("CDR_TICKET_POLL_INTERVAL", "2.0"))
+MAX_UNCONFIRMED = int(os.getenv("CDR_MAX_UNCONFIRMED", "5000"))  # queued CDRs not confirmed yet before reading pauses
+FLUSH_FAILURES = 5  # failed backend flushes before a CDR is dead-lettered
+
+# Archive mode: pack CDRs into one IPFS object per chunk, referenced as "<cid>#<n>"
+ARCHIVE_MODE = os.getenv("CDR_ARCHIVE_MODE", "0") == "1"
+ARCHIVE_CHUNK_RECORDS = int(os.getenv("CDR_ARCHIVE_CHUNK_RECORDS", "1000"))
+ARCHIVE_CHUNK_SECONDS = float(os.getenv("CDR_ARCHIVE_CHUNK_SECONDS", "60"))  # max wait before a partial chunk is added
+
+# ------------------ Metrics ------------------
+metrics = Registry()
+STAGE_SECONDS = metrics.histogram(
+    "cdr_listener_stage_seconds", "Time spent per listener stage (parse+hash, IPFS add, submit, checkpoint)",
+    ["stage"],
+)
+
+# One pooled session per upstream, shared by all workers
+ipfs_node = KuboClient(IPFS_API_URL, pool_size=IPFS_WORKERS, stage_histogram=STAGE_SECONDS)
+api_session = requests.Session()
+
+# ------------------ Stats ------------------
+stats = {
+    "lines_read": 0,
+    "cdrs_parsed": 0,
+    "parse_errors": 0,
+    "ipfs_uploaded": 0,
+    "ipfs_errors": 0,
+    "ipfs_chunks": 0,
+    "cdrs_submitted": 0,
+    "cdrs_confirmed": 0,
+    "cdrs_resubmitted": 0,
+    "unconfirmed": 0,
+    "submit_errors": 0,
+    "dead_lettered": 0,
+    "read_offset": 0,
+    "last_submit_at": 0.0,
+}
+stats_lock = threading.Lock()
+
+
+def bump(key, n=1):
+    with stats_lock:
+        stats[key] += n
+
+
+def listener_stats(queues=None):
+    """Snapshot of counters plus lag (bytes behind EOF and items waiting per stage)."""
+    with stats_lock:
+        snapshot = dict(stats)
+    try:
+        snapshot["bytes_behind"] = max(os.path.getsize(CDR_FILE) - snapshot["read_offset"], 0)
+    except OSError:
+        snapshot["bytes_behind"] = None
+    for name, q in (queues or {}).items():
+        snapshot[f"{name}_queue_depth"] = q.qsize()
+    return snapshot
 
-# Try IPFS HTTP API (works with 0.30.0+)
-IPFS_API_URL = "http://127.0.0.1:5001/api/v0/add"
-USE_HTTP_IPFS = True
 
 # ------------------ IPFS Functions ------------------
 def ipfs_add_json(data):
     """Uploads JSON to IPFS and returns the CID."""
     try:
-        files = {"file": ("cdr.json", json.dumps(data))}
-        response = requests.post(IPFS_API_URL, files=files)
-        response.raise_for_status()
-        cid = response.json()["Hash"]
+        cid = ipfs_node.add_json(data)
         print(f"[IPFS ✅] Uploaded to IPFS CID: {cid}")
         return cid
-    except Exception as e:
+    except (IPFSError, KeyError, ValueError) as e:
         print(f"[IPFS ERROR] Could not upload: {e}")
         return None
 
 
+def ipfs_add_chunk(cdrs):
+    """Packs CDRs into one archive chunk, uploads it and returns the chunk CID."""
+    try:
+        cid = ipfs_node.add_bytes(pack_chunk(cdrs), name="cdrs.chunk")
+        bump("ipfs_chunks")
+        print(f"[IPFS ✅] Uploaded chunk of {len(cdrs)} CDRs: {cid}")
+        return cid
+    except (IPFSError, KeyError, ValueError) as e:
+        print(f"[IPFS ERROR] Could not upload chunk: {e}")
+        return None
+
+
+class ChunkRef:
+    """Future-like handle resolving to "<chunk cid>#<n>", so submit_stage treats chunks like single uploads."""
+
+    def __init__(self, future, n):
+        self.future = future
+        self.n = n
+
+    def result(self):
+        cid = self.future.result()
+        return make_ref(cid, self.n) if cid else None
+
+
 # ------------------ CDR Parsing ------------------
+cdr_parser = CDRParser.from_spec(CDR_COLUMNS)
+
+
 def parse_cdr(line):
     """Parse Asterisk CSV CDR line."""
-    fields = line.strip().split(",")
-    if len(fields) < 15:
-        return None
-
     try:
-        caller = fields[1].strip('"')
-        callee = fields[2].strip('"')
-        duration_field = fields[13].strip('"')
-        duration = int(duration_field) if duration_field.isdigit() else 0
-        status = fields[12].strip('"')
-        timestamp = fields[9].strip('"')  # call start time
-
-        # Compute unique CDR hash
-        cdr_str = f"{caller}{callee}{timestamp}{duration}{status}"
-        cdr_hash = hashlib.sha256(cdr_str.encode()).hexdigest()
-
-        return {
-            "caller": caller,
-            "callee": callee,
-            "duration": duration,
-            "status": status,
-            "timestamp": timestamp,
-            "hash": cdr_hash
-        }
+        return cdr_parser.parse_line(line)
     except Exception as e:
         print(f"[CDR Parse Error] {e}")
         return None
 
 
 # ------------------ Backend Push ------------------
-def send_to_backend(cdr):
-    """Uploads to IPFS first, then sends to FastAPI backend."""
+def dead_letter(cdrs, reason):
+    """Append CDRs that can't be delivered to the dead-letter file (fsynced, so the offset may move past them)."""
+    with open(DEAD_LETTER_FILE, "a") as f:
+        for cdr in cdrs:
+            f.write(json.dumps({"reason": reason, "at": time.time(), "cdr": cdr}) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    bump("dead_lettered", len(cdrs))
+    print(f"[⚠️ DEAD LETTER] {len(cdrs)} CDR(s) written to {DEAD_LETTER_FILE}: {reason}")
+
+
+def send_batch_to_backend(cdrs):
+    """
+    Hand a batch to the backend's write-behind queue and return the
+    (cdrs, response body) pairs it was accepted as. 429, 5xx and connection
+    errors are retried with backoff; any other rejection (400: a CDR the
+    chain can't encode, 422: a field that fails validation) is split in
+    halves so only the offending CDRs end up dead-lettered.
+    """
+    delay = 0.5
+    while True:
+        try:
+            with STAGE_SECONDS.time(stage="submit"):
+                r = api_session.post(API_BATCH_URL, json=cdrs, timeout=30)
+        except requests.RequestException as e:
+            r = None
+            bump("submit_errors")
+            print(f"[API Push Error] {e}")
+
+        if r is not None and r.status_code == 202:
+            bump("cdrs_submitted", len(cdrs))
+            with stats_lock:
+                stats["last_submit_at"] = time.time()
+            body = r.json()
+            print(f"[✅ QUEUED] {len(cdrs)} CDRs | queue depth: {body.get('queue_depth')}")
+            return [(cdrs, body)]
+        if r is not None and r.status_code == 429:
+            delay = float(r.headers.get("Retry-After", delay))
+            print(f"[⏳ BACKPRESSURE] Backend queue full, retrying in {delay:.1f}s")
+        elif r is not None and r.status_code < 500:
+            bump("submit_errors")
+            if len(cdrs) == 1:
+                dead_letter(cdrs, f"API {r.status_code}: {r.text[:500]}")
+                return []
+            print(f"[❌ API ERROR] {r.status_code} for a batch of {len(cdrs)}, splitting it")
+            half = len(cdrs) // 2
+            return send_batch_to_backend(cdrs[:half]) + send_batch_to_backend(cdrs[half:])
+        elif r is not None:
+            bump("submit_errors")
+            print(f"[❌ API ERROR] {r.status_code}: {r.text[:200]}")
+        time.sleep(delay)
+        delay = min(delay * 2, 30)
+
+
+def poll_tickets(pending):
+    """Refresh ticket states, resubmit lost or failed CDRs and dead-letter those that keep failing."""
+    tickets, before = pending.tickets(), len(pending)
     try:
-        cid = ipfs_add_json(cdr)
-        if not cid:
-            print("[❌] Skipping CDR (IPFS upload failed)")
-            return
-
-        cdr["ipfs_cid"] = cid
-        r = requests.post(API_URL, json=cdr)
-        if r.status_code == 200:
-            print(f"[✅ STORED] {cdr['caller']} -> {cdr['callee']} | Tx: {r.json().get('tx_hash')}")
-        else:
-            print(f"[❌ API ERROR] {r.status_code}: {r.text}")
-    except Exception as e:
-        print(f"[API Push Error] {e}")
+        for i in range(0, len(tickets), LOOKUP_SIZE):
+            chunk = tickets[i:i + LOOKUP_SIZE]
+            r = api_session.post(API_TICKETS_URL, json=chunk, timeout=30)
+            r.raise_for_status()
+            pending.update(dict(zip(chunk, r.json()["tickets"])))
+    except (requests.RequestException, ValueError, KeyError) as e:
+        print(f"[API Poll Error] {e}")
+        return
+
+    retry, given_up = pending.due()
+    if given_up:
+        dead_letter(given_up, f"backend flush failed {FLUSH_FAILURES} times")
+    if retry:
+        bump("cdrs_resubmitted", len(retry))
+        print(f"[🔁 RESUBMIT] {len(retry)} CDRs lost or failed in the backend queue")
+        pending.track(send_batch_to_backend(retry))
+    bump("cdrs_confirmed", before - len(pending) - len(given_up))
+    with stats_lock:
+        stats["unconfirmed"] = len(pending)
+
 
+# ------------------ Pipeline Stages ------------------
+# Every item carries the tailer position just past its line. The submitter
+# commits that position only once every CDR up to it is confirmed on chain
+# (its ticket resolved, or the backend reports the hash already stored) or
+# is in the dead-letter file. A 202 alone is not enough: the write-behind
+# queue is in memory, so a restart of either process resumes from the last
+# CDR that is actually stored.
+def read_stage(tailer, lines_q):
+    for line, position in tailer.lines():
+        bump("lines_read")
+        with stats_lock:
+            stats["read_offset"] = position[1]
+        lines_q.put((line, position))
 
-# ------------------ Tail File ------------------
-def tail_file(filename):
-    """Continuously watch a file for new lines."""
-    with open(filename, "r") as f:
-        f.seek(0, 2)  # Jump to end
+
+def parse_stage(lines_q, cdrs_q):
+    """One streaming csv reader over the queue, so quoted fields may even span lines."""
+    def queued_lines():
         while True:
-            line = f.readline()
-            if not line:
-                time.sleep(1)
-                continue
-            yield line
+            yield lines_q.get()
+
+    while True:
+        try:
+            for row, position in cdr_parser.rows(queued_lines()):
+                started = time.perf_counter()
+                cdr = cdr_parser.from_row(row)
+                STAGE_SECONDS.observe(time.perf_counter() - started, stage="parse_hash")
+                if cdr:
+                    bump("cdrs_parsed")
+                    cdrs_q.put((cdr, position))
+                else:
+                    bump("parse_errors")
+        except csv.Error as e:
+            # e.g. an unterminated quote ran past field_size_limit; start a fresh reader
+            bump("parse_errors")
+            print(f"[CDR Parse Error] {e}")
+
+
+def upload_with_retry(cdr, add=ipfs_add_json):
+    delay = 0.5
+    for attempt in range(IPFS_RETRIES):
+        cid = add(cdr)
+        if cid:
+            return cid
+        if attempt < IPFS_RETRIES - 1:
+            time.sleep(delay)
+            delay *= 2
+    return None
+
+
+def upload_stage(cdrs_q, uploads_q, pool):
+    """Fan IPFS adds out to the worker pool; futures are queued in arrival order."""
+    while True:
+        cdr, position = cdrs_q.get()
+        uploads_q.put((cdr, position, pool.submit(upload_with_retry, dict(cdr))))
+
+
+def archive_stage(cdrs_q, uploads_q, pool):
+    """Pack CDRs into chunks of ARCHIVE_CHUNK_RECORDS (or ARCHIVE_CHUNK_SECONDS) and add each chunk once."""
+    chunk = []
+    deadline = None
+    while True:
+        timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+        try:
+            cdr, position = cdrs_q.get(timeout=timeout)
+            chunk.append((cdr, position))
+            deadline = deadline or time.monotonic() + ARCHIVE_CHUNK_SECONDS
+        except queue.Empty:
+            pass
+
+        if chunk and (len(chunk) >= ARCHIVE_CHUNK_RECORDS or time.monotonic() >= deadline):
+            future = pool.submit(upload_with_retry, [dict(c) for c, _ in chunk], ipfs_add_chunk)
+            for n, (cdr, position) in enumerate(chunk):
+                uploads_q.put((cdr, position, ChunkRef(future, n)))
+            chunk = []
+            deadline = None
+
+
+def submit_stage(uploads_q, tailer):
+    batch = []
+    failed = []   # IPFS gave up on these; dead-lettered before the offset moves past them
+    pending = PendingTickets(max_failures=FLUSH_FAILURES)
+    last_position = None
+    deadline = None
+    next_poll = time.monotonic() + TICKET_POLL_INTERVAL
+    while True:
+        timeout = TICKET_POLL_INTERVAL if deadline is None else max(deadline - time.monotonic(), 0)
+        timeout = min(timeout, max(next_poll - time.monotonic(), 0))
+        try:
+            if len(pending) >= MAX_UNCONFIRMED:
+                raise queue.Empty  # let the backend catch up before reading more
+            cdr, position, future = uploads_q.get(timeout=timeout)
+            last_position = position
+            with STAGE_SECONDS.time(stage="upload_wait"):
+                cid = future.result()
+            if cid:
+                bump("ipfs_uploaded")
+                cdr["ipfs_cid"] = cid
+                batch.append(cdr)
+            else:
+                bump("ipfs_errors")
+                failed.append(cdr)
+            deadline = deadline or time.monotonic() + SUBMIT_FLUSH_INTERVAL
+        except queue.Empty:
+            if len(pending) >= MAX_UNCONFIRMED:
+                time.sleep(max(next_poll - time.monotonic(), 0))
+
+        if deadline is not None and (len(batch) >= SUBMIT_BATCH_SIZE or time.monotonic() >= deadline):
+            pending.add(last_position, send_batch_to_backend(batch) if batch else [])
+            if failed:
+                dead_letter(failed, "IPFS upload failed after retries")
+            batch = []
+            failed = []
+            deadline = None
+
+        if time.monotonic() >= next_poll:
+            if len(pending):
+                poll_tickets(pending)
+            position = pending.committable()
+            if position is not None:
+                with STAGE_SECONDS.time(stage="checkpoint"):
+                    tailer.commit(position)
+            next_poll = time.monotonic() + TICKET_POLL_INTERVAL
+
+
+def stats_stage(queues):
+    while True:
+        time.sleep(STATS_INTERVAL)
+        s = listener_stats(queues)
+        print(f"[📊 LAG] {s['bytes_behind']} bytes behind EOF | "
+              f"queues: lines={s['lines_queue_depth']} cdrs={s['cdrs_queue_depth']} "
+              f"uploads={s['uploads_queue_depth']} | submitted={s['cdrs_submitted']} "
+              f"unconfirmed={s['unconfirmed']}")
+
+
+def register_metrics(queues):
+    """Expose the stats counters, queue depths and lag on the metrics registry."""
+    counters = ("lines_read", "cdrs_parsed", "parse_errors", "ipfs_uploaded", "ipfs_errors",
+                "ipfs_chunks", "cdrs_submitted", "cdrs_confirmed", "cdrs_resubmitted", "submit_errors",
+                "dead_lettered")
+
+    @metrics.collector
+    def pipeline_metrics():
+        s = listener_stats(queues)
+        families = [(f"cdr_listener_{name}_total", "counter", name.replace("_", " "), s[name]) for name in counters]
+        families += [
+            ("cdr_listener_queue_depth", "gauge", "Items waiting per pipeline stage",
+             [({"queue": name}, q.qsize()) for name, q in queues.items()]),
+            ("cdr_listener_unconfirmed", "gauge", "CDRs queued in the backend but not confirmed yet", s["unconfirmed"]),
+            ("cdr_listener_bytes_behind", "gauge", "Bytes of Master.csv not read yet", s["bytes_behind"]),
+            ("cdr_listener_read_offset_bytes", "gauge", "Read position in Master.csv", s["read_offset"]),
+            ("cdr_listener_seconds_since_submit", "gauge", "Seconds since a batch was last accepted by the API",
+             time.time() - s["last_submit_at"] if s["last_submit_at"] else None),
+        ]
+        return families
 
 
 # ------------------ Main ------------------
 def main():
-    print("[LISTENER] Watching for new CDRs...")
+    print("[LISTENER] Watching for new CDRs..."
+          + (f" (archive mode, {ARCHIVE_CHUNK_RECORDS} CDRs / {ARCHIVE_CHUNK_SECONDS:g}s per chunk)" if ARCHIVE_MODE else ""))
+
+    lines_q = queue.Queue(maxsize=QUEUE_SIZE)
+    cdrs_q = queue.Queue(maxsize=QUEUE_SIZE)
+    uploads_q = queue.Queue(maxsize=IPFS_WORKERS * 4)
+    queues = {"lines": lines_q, "cdrs": cdrs_q, "uploads": uploads_q}
+    pool = ThreadPoolExecutor(max_workers=IPFS_WORKERS, thread_name_prefix="ipfs-add")
+    tailer = ResumableTailer(CDR_FILE, TAIL_CHECKPOINT, start_at_end=not TAIL_FROM_START)
+    register_metrics(queues)
+    if METRICS_PORT:
+        serve_metrics(metrics, METRICS_PORT)
+        print(f"[METRICS] Prometheus metrics on :{METRICS_PORT}/metrics")
+
+    stages = [
+        threading.Thread(target=read_stage, args=(tailer, lines_q), name="reader"),
+        threading.Thread(target=parse_stage, args=(lines_q, cdrs_q), name="parser"),
+        threading.Thread(target=archive_stage if ARCHIVE_MODE else upload_stage,
+                         args=(cdrs_q, uploads_q, pool), name="uploader"),
+        threading.Thread(target=submit_stage, args=(uploads_q, tailer), name="submitter"),
+        threading.Thread(target=stats_stage, args=(queues,), name="stats"),
+    ]
+    for t in stages:
+        t.daemon = True
+        t.start()
 
     try:
-        for line in tail_file(CDR_FILE):
-            cdr = parse_cdr(line)
-            if cdr:
-                send_to_backend(cdr)
+        while all(t.is_alive() for t in stages):
+            time.sleep(1)
+        print("[FATAL ERROR] A pipeline stage stopped unexpectedly.")
     except KeyboardInterrupt:
         print("\n[EXIT] Listener stopped manually.")
-    except Exception as e:
-        print(f"[FATAL ERROR] {e}")
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
 
 
 if __name__ == "__main__":
-    main()
+    if sys.argv[1:2] == ["backfill"]:
+        import backfill
+        backfill.main(sys.argv[2:])
+    else:
+        main()
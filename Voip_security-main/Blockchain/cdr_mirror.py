@@ -0,0 +1,362 @@
+"""
+Local SQLite mirror of the on-chain VoipCDR records.
+
+The chain stays the source of truth; this store is an index over it so the
+API can serve /cdrs pages without one getCDR RPC per record. Rows are keyed
+by the contract index and only ever appended or overwritten.
+
+Rows do not arrive in idx order (cold sync, /cdrs page fill and the event
+follower all write at different positions), so every inserted row gets a
+write sequence number, `seq`, and so does an update that changes a call's
+billed fields (caller, callee, duration, status, timestamp). Consumers
+that load "what's new" (dedup warm-up, rating) track a seq watermark
+rather than the last idx.
+
+Filtered queries (caller, callee, status, time range, duration range, hash
+prefix) are served by secondary indexes. The record's timestamp string is
+also stored as epoch seconds (`ts`, -1 when it can't be parsed) so time
+ranges are integer index seeks; every secondary index implicitly ends in
+idx, which makes (sort key, idx) keyset pagination index-ordered too.
+"""
+import base64
+import calendar
+import json
+import sqlite3
+import threading
+import time
+
+COLUMNS = ("idx", "caller", "callee", "duration", "status", "timestamp", "hash", "ipfs_cid", "block_number", "ts")
+SORT_KEYS = {"idx": "idx", "timestamp": "ts", "duration": "duration", "caller": "caller", "callee": "callee"}
+TIMESTAMP_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cdrs (
+    idx          INTEGER PRIMARY KEY,
+    caller       TEXT NOT NULL,
+    callee       TEXT NOT NULL,
+    duration     INTEGER NOT NULL,
+    status       TEXT NOT NULL,
+    timestamp    TEXT NOT NULL,
+    hash         TEXT NOT NULL,
+    ipfs_cid     TEXT,
+    block_number INTEGER,
+    ts           INTEGER NOT NULL DEFAULT -1,
+    seq          INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS anchors (
+    batch_id     INTEGER PRIMARY KEY,
+    root         TEXT NOT NULL,
+    leaf_count   INTEGER NOT NULL,
+    tx_hash      TEXT,
+    block_number INTEGER
+);
+CREATE TABLE IF NOT EXISTS anchored_leaves (
+    hash     TEXT PRIMARY KEY,
+    batch_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    proof    TEXT NOT NULL,
+    ipfs_cid TEXT,
+    cdr      TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS cdrs_caller_ts ON cdrs (caller, ts);
+CREATE INDEX IF NOT EXISTS cdrs_callee_ts ON cdrs (callee, ts);
+CREATE INDEX IF NOT EXISTS cdrs_status_ts ON cdrs (status, ts);
+CREATE INDEX IF NOT EXISTS cdrs_ts ON cdrs (ts);
+CREATE INDEX IF NOT EXISTS cdrs_duration ON cdrs (duration);
+CREATE INDEX IF NOT EXISTS cdrs_hash ON cdrs (hash);
+CREATE INDEX IF NOT EXISTS cdrs_block ON cdrs (block_number);
+CREATE INDEX IF NOT EXISTS cdrs_seq ON cdrs (seq);
+"""
+
+UPSERT = f"""
+INSERT INTO cdrs ({', '.join(COLUMNS)}, seq) VALUES ({', '.join('?' * len(COLUMNS))}, ?)
+ON CONFLICT(idx) DO UPDATE SET
+    caller = excluded.caller,
+    callee = excluded.callee,
+    duration = excluded.duration,
+    status = excluded.status,
+    timestamp = excluded.timestamp,
+    hash = excluded.hash,
+    ipfs_cid = COALESCE(excluded.ipfs_cid, cdrs.ipfs_cid),
+    block_number = COALESCE(excluded.block_number, cdrs.block_number),
+    ts = excluded.ts,
+    seq = CASE
+        WHEN (cdrs.caller, cdrs.callee, cdrs.duration, cdrs.status, cdrs.timestamp)
+             IS (excluded.caller, excluded.callee, excluded.duration, excluded.status, excluded.timestamp)
+        THEN cdrs.seq ELSE excluded.seq
+    END
+"""
+
+
+def timestamp_to_epoch(value) -> int:
+    """Epoch seconds (UTC) for a CDR timestamp string or number; -1 if it can't be parsed."""
+    text = str(value).strip()
+    if text.isdigit():
+        return int(text)
+    for fmt in TIMESTAMP_FORMATS:
+        try:
+            return calendar.timegm(time.strptime(text, fmt))
+        except ValueError:
+            continue
+    return -1
+
+
+def encode_cursor(values) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(values)).encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str):
+    """Inverse of encode_cursor; raises ValueError for a malformed token."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except Exception:
+        raise ValueError(f"invalid cursor: {token}")
+    if not isinstance(values, list) or len(values) != 2:
+        raise ValueError(f"invalid cursor: {token}")
+    return values
+
+
+def prefix_range(prefix: str):
+    """[low, high) bounds matching every string that starts with prefix (index-friendly LIKE 'p%')."""
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class CDRMirror:
+    def __init__(self, path):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+        self._conn.executescript(INDEXES)
+        self._conn.execute("PRAGMA optimize")
+        self._conn.commit()
+        self._seq = self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM cdrs").fetchone()[0]
+
+    def _migrate(self):
+        """Add and backfill the `ts` and `seq` columns on mirrors created before they existed."""
+        columns = {r[1] for r in self._conn.execute("PRAGMA table_info(cdrs)")}
+        if "seq" not in columns:
+            self._conn.execute("ALTER TABLE cdrs ADD COLUMN seq INTEGER NOT NULL DEFAULT 0")
+            self._conn.execute("UPDATE cdrs SET seq = idx + 1")
+            self._conn.commit()
+        if "ts" in columns:
+            return
+        self._conn.execute("ALTER TABLE cdrs ADD COLUMN ts INTEGER NOT NULL DEFAULT -1")
+        # Same rules as timestamp_to_epoch, in SQL so large mirrors backfill quickly
+        self._conn.execute(
+            """UPDATE cdrs SET ts = CASE
+                   WHEN timestamp <> '' AND timestamp NOT GLOB '*[^0-9]*' THEN CAST(timestamp AS INTEGER)
+                   ELSE COALESCE(CAST(strftime('%s', timestamp) AS INTEGER), -1)
+               END"""
+        )
+        self._conn.commit()
+
+    # ---------- Writes ----------
+    def upsert_many(self, rows):
+        """
+        Insert or update full CDR rows (dicts with the COLUMNS keys). A NULL
+        ipfs_cid or block_number never overwrites a value already known.
+        New rows, and updates that change a billed field, get the next write
+        sequence numbers; other updates (CID, block number) keep theirs.
+        """
+        rows = [tuple(r.get(c) for c in COLUMNS[:-1]) + (timestamp_to_epoch(r.get("timestamp")),) for r in rows]
+        if not rows:
+            return
+        with self._lock:
+            first = self._seq + 1
+            self._seq += len(rows)
+            self._conn.executemany(UPSERT, [row + (first + i,) for i, row in enumerate(rows)])
+            self._conn.commit()
+
+    def set_cid(self, idx: int, cid: str):
+        with self._lock:
+            self._conn.execute("UPDATE cdrs SET ipfs_cid = ? WHERE idx = ?", (cid, idx))
+            self._conn.commit()
+
+    def save_anchor(self, anchor: dict):
+        """Record a Merkle batch root (from our own flush or from a chain event)."""
+        with self._lock:
+            self._conn.execute(
+                """INSERT INTO anchors (batch_id, root, leaf_count, tx_hash, block_number)
+                   VALUES (:batch_id, :root, :leaf_count, :tx_hash, :block_number)
+                   ON CONFLICT(batch_id) DO UPDATE SET
+                       root = excluded.root,
+                       leaf_count = excluded.leaf_count,
+                       tx_hash = COALESCE(excluded.tx_hash, anchors.tx_hash),
+                       block_number = COALESCE(excluded.block_number, anchors.block_number)""",
+                anchor,
+            )
+            self._conn.commit()
+
+    def save_leaves(self, leaves):
+        """Store anchored CDRs with their inclusion proofs (proof/cdr as JSON text)."""
+        with self._lock:
+            self._conn.executemany(
+                """INSERT OR REPLACE INTO anchored_leaves (hash, batch_id, position, proof, ipfs_cid, cdr)
+                   VALUES (:hash, :batch_id, :position, :proof, :ipfs_cid, :cdr)""",
+                leaves,
+            )
+            self._conn.commit()
+
+    def set_meta(self, key: str, value):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+            self._conn.commit()
+
+    def delete_from_block(self, block: int):
+        """Drop rows and anchors that came from block >= `block` (chain reorg); returns removed (idx, hash)."""
+        with self._lock:
+            removed = self._conn.execute(
+                "SELECT idx, hash FROM cdrs WHERE block_number >= ?", (block,)
+            ).fetchall()
+            self._conn.execute("DELETE FROM cdrs WHERE block_number >= ?", (block,))
+            self._conn.execute("DELETE FROM anchors WHERE block_number >= ?", (block,))
+            self._conn.commit()
+        return [(r[0], r[1]) for r in removed]
+
+    # ---------- Reads ----------
+    def get_meta(self, key: str, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else default
+
+    def last_synced_block(self):
+        value = self.get_meta("last_synced_block")
+        return int(value) if value is not None else None
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cdrs").fetchone()[0]
+
+    def max_idx(self) -> int:
+        """Highest mirrored contract index, -1 when empty."""
+        with self._lock:
+            value = self._conn.execute("SELECT MAX(idx) FROM cdrs").fetchone()[0]
+        return -1 if value is None else value
+
+    def get(self, idx: int):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM cdrs WHERE idx = ?", (idx,)).fetchone()
+        return dict(row) if row else None
+
+    def written_after(self, seq: int, limit: int):
+        """Up to `limit` rows inserted after write sequence number `seq`, in write order."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM cdrs WHERE seq > ? ORDER BY seq LIMIT ?", (seq, limit)
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def query(self, filters: dict, sort: str = "idx", descending: bool = False,
+              limit: int = 500, cursor=None, offset: int = 0):
+        """
+        Rows matching `filters`, ordered by (sort, idx). Supported filters:
+        caller, callee, status, q (caller, callee or hash prefix), hash_prefix,
+        start/end (epoch seconds, end exclusive), min_duration, max_duration.
+        `cursor` is the (sort value, idx) of the last row of the previous
+        page; without it `offset` is used.
+        """
+        column = SORT_KEYS[sort]
+        where, params = self._where(filters)
+        direction = "DESC" if descending else "ASC"
+        if cursor is not None:
+            value, idx = cursor
+            op = "<" if descending else ">"
+            if column == "idx":
+                where.append(f"idx {op} ?")
+                params.append(idx)
+            else:
+                where.append(f"({column}, idx) {op} (?, ?)")
+                params.extend([value, idx])
+        sql = "SELECT * FROM cdrs"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY {column} {direction}" + ("" if column == "idx" else f", idx {direction}")
+        sql += " LIMIT ?"
+        params.append(limit)
+        if cursor is None and offset:
+            sql += " OFFSET ?"
+            params.append(offset)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [dict(r) for r in rows]
+
+    def count_matching(self, filters: dict) -> int:
+        where, params = self._where(filters)
+        sql = "SELECT COUNT(*) FROM cdrs" + (" WHERE " + " AND ".join(where) if where else "")
+        with self._lock:
+            return self._conn.execute(sql, params).fetchone()[0]
+
+    @staticmethod
+    def _where(filters: dict):
+        where, params = [], []
+        for column in ("caller", "callee", "status"):
+            if filters.get(column) is not None:
+                where.append(f"{column} = ?")
+                params.append(filters[column])
+        if filters.get("hash_prefix"):
+            where.append("hash >= ? AND hash < ?")
+            params.extend(prefix_range(filters["hash_prefix"]))
+        if filters.get("q"):
+            q = filters["q"]
+            where.append("(caller = ? OR callee = ? OR (hash >= ? AND hash < ?))")
+            params.extend([q, q, *prefix_range(q.lower())])
+        if filters.get("start") is not None:
+            where.append("ts >= ?")
+            params.append(filters["start"])
+        if filters.get("end") is not None:
+            where.append("ts >= 0 AND ts < ?")
+            params.append(filters["end"])
+        if filters.get("min_duration") is not None:
+            where.append("duration >= ?")
+            params.append(filters["min_duration"])
+        if filters.get("max_duration") is not None:
+            where.append("duration <= ?")
+            params.append(filters["max_duration"])
+        return where, params
+
+    def write_mark(self) -> dict:
+        """Current write position: newest cdrs seq and anchored_leaves rowid (see iter_hashes)."""
+        with self._lock:
+            leaves = self._conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM anchored_leaves").fetchone()[0]
+            return {"cdrs": self._seq, "leaves": leaves}
+
+    def iter_hashes(self, since: dict | None = None, chunk_size: int = 10_000):
+        """
+        Yield (hash, idx) for mirrored records, then (hash, None) for anchored
+        leaves; with `since` (an earlier write_mark()) only rows written after it.
+        """
+        since = since or {"cdrs": 0, "leaves": 0}
+        queries = (
+            ("SELECT seq, hash, idx FROM cdrs WHERE seq > ? ORDER BY seq LIMIT ?", since["cdrs"]),
+            ("SELECT rowid, hash, NULL FROM anchored_leaves WHERE rowid > ? ORDER BY rowid LIMIT ?", since["leaves"]),
+        )
+        for sql, last in queries:
+            while True:
+                with self._lock:
+                    rows = self._conn.execute(sql, (last, chunk_size)).fetchall()
+                if not rows:
+                    break
+                for _, h, idx in rows:
+                    yield h, idx
+                last = rows[-1][0]
+
+    def find_leaf(self, cdr_hash: str):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM anchored_leaves WHERE hash = ?", (cdr_hash,)).fetchone()
+        return dict(row) if row else None
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
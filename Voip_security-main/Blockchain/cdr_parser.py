@@ -0,0 +1,200 @@
+"""
+Asterisk Master.csv parsing shared by the listener, Onchain and backfills.
+
+Lines go through the csv module, so quoted fields that contain commas
+(e.g. clid "Alice, Ops" <1001>) or quotes don't shift the columns. The
+column positions are configurable; the defaults are Asterisk's cdr_csv
+order:
+
+    0 accountcode  1 src  2 dst  3 dcontext  4 clid  5 channel
+    6 dstchannel  7 lastapp  8 lastdata  9 start  10 answer  11 end
+    12 duration  13 billsec  14 disposition  15 amaflags ...
+
+The old listener split lines with line.split(","), so any field holding a
+comma (clid "Alice, Ops" <1001>, Dial args "PJSIP/1002,20") shifted every
+column after it, and it took `status` from column 12. Two ways back:
+
+    legacy        LEGACY_COLUMNS (status from column 12) on csv-parsed rows;
+                  only matches old hashes for lines without commas in fields
+    legacy-split  the old comma split itself, byte for byte, so the hashes
+                  are exactly those of records stored before this module
+
+Use CDRParser.from_spec() to build a parser from one of these names (or
+"asterisk", or an explicit column list).
+
+The CDR hash is sha256(f"{caller}{callee}{timestamp}{duration}{status}"),
+unchanged.
+
+parse_chunk() is the streaming path (csv module, one pass over a block of
+lines). parse_bulk() reads the same block with pandas' C parser, about
+1.2x faster at 100k lines and 1.4x at 1M in bench_cdr_parser.py, and
+falls back to parse_chunk() for ragged or short rows, or when pandas is
+missing.
+"""
+import csv
+import hashlib
+import io
+from operator import itemgetter
+
+try:
+    import pandas as pd
+except ImportError:  # optional: bulk path only
+    pd = None
+
+FIELDS = ("caller", "callee", "timestamp", "duration", "status")
+ASTERISK_COLUMNS = {"caller": 1, "callee": 2, "timestamp": 9, "duration": 13, "status": 14}
+LEGACY_COLUMNS = {**ASTERISK_COLUMNS, "status": 12}
+PRESETS = {"asterisk": ASTERISK_COLUMNS, "legacy": LEGACY_COLUMNS}
+LEGACY_SPLIT = "legacy-split"
+LEGACY_SPLIT_MIN_FIELDS = 15  # the old parser's length check
+
+
+def column_map(spec: str | None) -> dict:
+    """'asterisk', 'legacy' or 'caller=1,callee=2,timestamp=9,duration=13,status=14' → column map."""
+    if not spec:
+        return dict(ASTERISK_COLUMNS)
+    if spec in PRESETS:
+        return dict(PRESETS[spec])
+    columns = dict(ASTERISK_COLUMNS)
+    for part in spec.split(","):
+        name, _, value = part.partition("=")
+        name = name.strip()
+        if name not in FIELDS or not value.strip().isdigit():
+            raise ValueError(f"bad column mapping {part!r} (expected one of {', '.join(FIELDS)} = column number)")
+        columns[name] = int(value)
+    return columns
+
+
+def cdr_hash(caller, callee, timestamp, duration, status) -> str:
+    return hashlib.sha256(f"{caller}{callee}{timestamp}{duration}{status}".encode()).hexdigest()
+
+
+def iter_rows(lines):
+    """
+    (line, position) pairs → (row, position) through one streaming csv
+    reader. A quoted field spanning lines yields one row, with the
+    position of its last line.
+    """
+    position = None
+
+    def feed():
+        nonlocal position
+        for line, position in lines:
+            yield line
+
+    for row in csv.reader(feed()):
+        if row:
+            yield row, position
+
+
+class CDRParser:
+    def __init__(self, columns=None, legacy_split=False):
+        """legacy_split: split lines on every comma and strip quotes, as the old listener did."""
+        self.columns = dict(columns or ASTERISK_COLUMNS)
+        self.legacy_split = legacy_split
+        self.min_fields = max(self.columns.values()) + 1
+        if legacy_split:
+            self.min_fields = max(self.min_fields, LEGACY_SPLIT_MIN_FIELDS)
+        self._pick = itemgetter(*(self.columns[f] for f in FIELDS))
+
+    @classmethod
+    def from_spec(cls, spec: str | None):
+        """'asterisk', 'legacy', 'legacy-split' or an explicit column list (see column_map)."""
+        if spec == LEGACY_SPLIT:
+            return cls(LEGACY_COLUMNS, legacy_split=True)
+        return cls(column_map(spec))
+
+    @property
+    def spec(self) -> str:
+        """The from_spec() name that rebuilds this parser (e.g. in a worker process)."""
+        if self.legacy_split:
+            return LEGACY_SPLIT
+        return ",".join(f"{name}={self.columns[name]}" for name in FIELDS)
+
+    def rows(self, lines):
+        """(line, position) pairs → (row, position): iter_rows(), or the old comma split in legacy-split mode."""
+        if not self.legacy_split:
+            return iter_rows(lines)
+        return ((line.strip().split(","), position) for line, position in lines if line.strip())
+
+    def from_row(self, row):
+        """One row (list of strings) → CDR dict, or None if it is too short."""
+        if len(row) < self.min_fields:
+            return None
+        caller, callee, timestamp, duration, status = self._pick(row)
+        if self.legacy_split:
+            caller, callee, timestamp, duration, status = (v.strip('"') for v in (caller, callee, timestamp, duration, status))
+        duration = int(duration) if duration.isdigit() else 0
+        return {
+            "caller": caller,
+            "callee": callee,
+            "duration": duration,
+            "status": status,
+            "timestamp": timestamp,
+            "hash": cdr_hash(caller, callee, timestamp, duration, status),
+        }
+
+    def parse_line(self, line: str):
+        if self.legacy_split:
+            return self.from_row(line.strip().split(",")) if line.strip() else None
+        for row in csv.reader([line]):
+            return self.from_row(row)
+        return None
+
+    def parse_chunk(self, data) -> tuple:
+        """
+        A whole block of complete lines (str or UTF-8 bytes) in one pass →
+        (cdrs, rejected) where rejected counts non-empty rows that were too short.
+        """
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            data = bytes(data).decode("utf-8", errors="replace")
+        cdrs, rejected = [], 0
+        from_row = self.from_row
+        if self.legacy_split:
+            rows = (line.strip().split(",") for line in io.StringIO(data, newline=None) if line.strip())
+        else:
+            rows = csv.reader(io.StringIO(data, newline=""))
+        for row in rows:
+            if not row:
+                continue
+            cdr = from_row(row)
+            if cdr is None:
+                rejected += 1
+            else:
+                cdrs.append(cdr)
+        return cdrs, rejected
+
+    def parse_bulk(self, data) -> tuple:
+        """Vectorised parse_chunk() for large blocks; same (cdrs, rejected) result."""
+        if pd is None or self.legacy_split:
+            return self.parse_chunk(data)
+        if isinstance(data, str):
+            data = data.encode()
+        wanted = [self.columns[f] for f in FIELDS]
+        last = self.min_fields - 1
+        try:
+            # Only the last wanted column maps "" to NaN: pandas pads short rows with "",
+            # so an empty last field may be a short row and the block takes the exact path
+            frame = pd.read_csv(
+                io.BytesIO(bytes(data)), header=None, usecols=sorted(set(wanted)), dtype=str,
+                keep_default_na=False, na_values={last: [""]}, encoding_errors="replace",
+            )
+        except pd.errors.EmptyDataError:
+            return [], 0
+        except (pd.errors.ParserError, ValueError):
+            return self.parse_chunk(data)  # ragged rows (more fields than the first line)
+        if frame[last].isna().any():
+            return self.parse_chunk(data)
+        callers, callees, timestamps, durations, statuses = (frame[c].tolist() for c in wanted)
+        cdrs = []
+        for caller, callee, timestamp, duration, status in zip(callers, callees, timestamps, durations, statuses):
+            duration = int(duration) if duration.isdigit() else 0
+            cdrs.append({
+                "caller": caller,
+                "callee": callee,
+                "duration": duration,
+                "status": status,
+                "timestamp": timestamp,
+                "hash": cdr_hash(caller, callee, timestamp, duration, status),
+            })
+        return cdrs, 0
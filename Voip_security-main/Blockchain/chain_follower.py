@@ -0,0 +1,155 @@
+"""
+Incremental contract event follower.
+
+Reads contract events by block range with eth_getLogs, hands the decoded
+events to a callback and checkpoints the last fully processed block on
+disk, so a restart resumes where it stopped and each poll only costs the
+blocks (and events) that are new since the previous one.
+
+The hashes of the last few processed blocks are kept with the checkpoint.
+If the block we stopped at no longer has the hash we saw, the chain has
+reorganised: we walk back to the newest block that still matches, tell
+`on_reorg(fork_block)` to drop everything derived from blocks >= fork_block,
+and replay from there.
+"""
+import json
+import os
+import pathlib
+import threading
+import time
+
+from eth_utils import event_abi_to_log_topic
+from web3.exceptions import BlockNotFound
+
+
+class ChainFollower:
+    def __init__(self, w3, contract, event_names, handler, checkpoint_file,
+                 start_block=0, max_range=2000, poll_interval=2.0, confirmations=0,
+                 on_reorg=None, reorg_depth=64):
+        """
+        handler(events, to_block) is called once per block range with the
+        decoded events (web3 AttributeDicts, in log order). The checkpoint
+        only advances after the handler returns, so a crash replays the
+        range instead of skipping it — handlers must be idempotent.
+        """
+        self.w3 = w3
+        self.contract = contract
+        self.handler = handler
+        self.checkpoint_file = pathlib.Path(checkpoint_file)
+        self.start_block = start_block
+        self.max_range = max_range
+        self.poll_interval = poll_interval
+        self.confirmations = confirmations
+        self.on_reorg = on_reorg
+        self.reorg_depth = reorg_depth
+
+        self._events = {}
+        for entry in contract.abi:
+            if entry.get("type") == "event" and entry.get("name") in event_names:
+                topic = "0x" + event_abi_to_log_topic(entry).hex()
+                self._events[topic] = getattr(contract.events, entry["name"])()
+        missing = set(event_names) - {e.event_name for e in self._events.values()}
+        if missing:
+            raise ValueError(f"Events not found in contract ABI: {', '.join(sorted(missing))}")
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.reorgs = 0
+        self.last_block, self.recent = self._load_checkpoint()
+
+    # ---------- Checkpoint ----------
+    def _load_checkpoint(self):
+        """Return (last_block, [[block, hash], ...]) — recent hashes oldest first."""
+        try:
+            with open(self.checkpoint_file, "r") as f:
+                data = json.load(f)
+            return int(data["last_block"]), [list(r) for r in data.get("recent", [])]
+        except FileNotFoundError:
+            return self.start_block - 1, []
+        except Exception as e:
+            print(f"⚠️ Unreadable follower checkpoint ({e}) — starting from block {self.start_block}.")
+            return self.start_block - 1, []
+
+    def _save_checkpoint(self, block: int):
+        tmp = self.checkpoint_file.with_suffix(self.checkpoint_file.suffix + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump({"last_block": block, "recent": self.recent, "updated_at": time.time()}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.checkpoint_file)
+
+    # ---------- Reorg detection ----------
+    def _block_hash(self, number: int):
+        try:
+            return self.w3.eth.get_block(number)["hash"].hex()
+        except BlockNotFound:
+            return None  # chain is now shorter than this block
+
+    def _check_reorg(self):
+        """Rewind last_block to the fork point if the blocks we processed were replaced."""
+        if not self.recent or self._block_hash(self.recent[-1][0]) == self.recent[-1][1]:
+            return
+        while self.recent and self._block_hash(self.recent[-1][0]) != self.recent[-1][1]:
+            self.recent.pop()
+        # Deeper than we remember: replay everything our oldest record covered
+        fork_block = self.recent[-1][0] + 1 if self.recent else max(self.last_block - self.reorg_depth, self.start_block)
+        print(f"⚠️ Chain reorg detected — rewinding follower to block {fork_block}.")
+        self.reorgs += 1
+        if self.on_reorg:
+            self.on_reorg(fork_block)
+        self.last_block = fork_block - 1
+        self._save_checkpoint(self.last_block)
+
+    # ---------- Polling ----------
+    def poll_once(self) -> int:
+        """Process every block up to the (confirmed) head; returns events handled."""
+        with self._lock:
+            self._check_reorg()
+            head = self.w3.eth.block_number - self.confirmations
+            handled = 0
+            from_block = self.last_block + 1
+            while from_block <= head:
+                to_block = min(from_block + self.max_range - 1, head)
+                logs = self.w3.eth.get_logs({
+                    "address": self.contract.address,
+                    "fromBlock": from_block,
+                    "toBlock": to_block,
+                    "topics": [list(self._events)],
+                })
+                events = [self.decode(log) for log in logs]
+                self.handler(events, to_block)
+                self.recent = (self.recent + [[to_block, self._block_hash(to_block)]])[-self.reorg_depth:]
+                self._save_checkpoint(to_block)
+                self.last_block = to_block
+                handled += len(events)
+                from_block = to_block + 1
+            return handled
+
+    def decode(self, log):
+        topic = log["topics"][0]
+        topic = topic.hex() if isinstance(topic, (bytes, bytearray)) else topic
+        if not topic.startswith("0x"):
+            topic = "0x" + topic
+        return self._events[topic].process_log(log)
+
+    # ---------- Worker lifecycle ----------
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="chain-follower", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.poll_once()
+            except Exception as e:
+                print(f"⚠️ Chain follower poll failed: {e}")
+            self._stop.wait(self.poll_interval)
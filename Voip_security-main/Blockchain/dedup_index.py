@@ -0,0 +1,222 @@
+"""
+Hash-keyed dedup index for CDR ingest.
+
+Every write path (store_cdr, the ingest queue, restore) claims a CDR's
+hash before sending a transaction. Hashes live in a small SQLite table so
+they survive restarts; an in-memory Bloom filter sits in front of it so
+the common case — a genuinely new CDR — is answered without touching disk.
+
+A hash is either "pending" (claimed, transaction not confirmed yet) or
+"stored" (seen on chain or anchored). Pending claims are released when a
+write fails and cleared on startup, since the in-process queue they
+belonged to is gone by then.
+"""
+import hashlib
+import math
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS seen (
+    hash       TEXT PRIMARY KEY,
+    state      TEXT NOT NULL,
+    idx        INTEGER,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, fp_rate: float = 0.001):
+        self.capacity = max(capacity, 1)
+        self.fp_rate = fp_rate
+        self.num_bits = max(int(-self.capacity * math.log(fp_rate) / (math.log(2) ** 2)), 8)
+        self.num_hashes = max(int(round(self.num_bits / self.capacity * math.log(2))), 1)
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        # Kirsch–Mitzenmacher double hashing from one 128-bit digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
+
+    def add(self, key: str):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class DedupIndex:
+    def __init__(self, path, capacity=1_000_000, fp_rate=0.001):
+        self.path = str(path)
+        self.fp_rate = fp_rate
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+        self.counters = {"bloom_negatives": 0, "store_lookups": 0, "duplicates": 0, "claims": 0}
+
+        cleared = self._conn.execute("DELETE FROM seen WHERE state = 'pending'").rowcount
+        self._conn.commit()
+        if cleared:
+            print(f"🧹 Dedup index dropped {cleared} stale pending claims.")
+        self._rebuild_bloom(max(capacity, self._size() * 2))
+
+    # ---------- Bloom front ----------
+    def _size(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM seen").fetchone()[0]
+
+    def _rebuild_bloom(self, capacity: int):
+        bloom = BloomFilter(capacity, self.fp_rate)
+        for (h,) in self._conn.execute("SELECT hash FROM seen"):
+            bloom.add(h)
+        self._bloom = bloom
+
+    def _bloom_add(self, h: str):
+        if self._bloom.count >= self._bloom.capacity:
+            self._rebuild_bloom(self._bloom.capacity * 2)  # keep the false-positive rate bounded
+        self._bloom.add(h)
+
+    def _lookup(self, h: str):
+        """Return the stored row for a hash, or None; the Bloom filter skips SQLite for new hashes."""
+        if h not in self._bloom:
+            self.counters["bloom_negatives"] += 1
+            return None
+        self.counters["store_lookups"] += 1
+        row = self._conn.execute("SELECT state, idx FROM seen WHERE hash = ?", (h,)).fetchone()
+        return {"state": row[0], "idx": row[1]} if row else None
+
+    # ---------- Claims ----------
+    def claim(self, cdr_hash: str):
+        """
+        Reserve a hash for writing. Returns None if it is new (and now
+        pending), or the existing {"state", "idx"} entry if it is a duplicate.
+        """
+        return self.claim_many([cdr_hash])[0]
+
+    def claim_many(self, hashes):
+        """claim() for a group, in order; repeats inside the group count as duplicates."""
+        results = []
+        now = time.time()
+        with self._lock:
+            for h in hashes:
+                h = h.lower()
+                existing = self._lookup(h)
+                if existing is not None:
+                    self.counters["duplicates"] += 1
+                    results.append(existing)
+                    continue
+                self._conn.execute(
+                    "INSERT INTO seen (hash, state, idx, updated_at) VALUES (?, 'pending', NULL, ?)", (h, now)
+                )
+                self._bloom_add(h)
+                self.counters["claims"] += 1
+                results.append(None)
+            self._conn.commit()
+        return results
+
+    def release(self, hashes):
+        """Drop pending claims after a failed write so the CDR can be retried."""
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM seen WHERE hash = ? AND state = 'pending'", [(h.lower(),) for h in hashes]
+            )
+            self._conn.commit()
+
+    def mark_stored(self, entries):
+        """Record (hash, idx) pairs as written; idx may be None (e.g. Merkle-anchored CDRs)."""
+        now = time.time()
+        with self._lock:
+            for h, idx in entries:
+                h = h.lower()
+                self._conn.execute(
+                    """INSERT INTO seen (hash, state, idx, updated_at) VALUES (?, 'stored', ?, ?)
+                       ON CONFLICT(hash) DO UPDATE SET
+                           state = 'stored',
+                           idx = COALESCE(excluded.idx, seen.idx),
+                           updated_at = excluded.updated_at""",
+                    (h, idx, now),
+                )
+                if h not in self._bloom:
+                    self._bloom_add(h)
+            self._conn.commit()
+
+    def forget(self, hashes):
+        """Remove hashes entirely (their transactions were dropped by a reorg)."""
+        with self._lock:
+            self._conn.executemany("DELETE FROM seen WHERE hash = ?", [(h.lower(),) for h in hashes])
+            self._conn.commit()
+
+    # ---------- Queries ----------
+    def lookup(self, cdr_hash: str):
+        with self._lock:
+            return self._lookup(cdr_hash.lower())
+
+    def lookup_many(self, hashes) -> dict:
+        """Map each already-known hash to its entry; unknown hashes are omitted."""
+        found = {}
+        with self._lock:
+            for h in hashes:
+                entry = self._lookup(h.lower())
+                if entry is not None:
+                    found[h] = entry
+        return found
+
+    def is_stored(self, cdr_hash: str) -> bool:
+        entry = self.lookup(cdr_hash)
+        return entry is not None and entry["state"] == "stored"
+
+    # ---------- Warm-up / stats ----------
+    def warm(self, entries, chunk_size=10_000) -> int:
+        """Bulk-load (hash, idx) pairs known to be on chain, e.g. from the mirror."""
+        before = len(self)
+        chunk = []
+        for entry in entries:
+            chunk.append(entry)
+            if len(chunk) >= chunk_size:
+                self.mark_stored(chunk)
+                chunk = []
+        self.mark_stored(chunk)
+        return len(self) - before
+
+    def get_meta(self, key: str, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key: str, value):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._size()
+
+    def stats(self) -> dict:
+        with self._lock:
+            states = dict(self._conn.execute("SELECT state, COUNT(*) FROM seen GROUP BY state").fetchall())
+        return {
+            **self.counters,
+            "stored": states.get("stored", 0),
+            "pending": states.get("pending", 0),
+            "bloom_bits": self._bloom.num_bits,
+            "bloom_hashes": self._bloom.num_hashes,
+            "bloom_capacity": self._bloom.capacity,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,203 @@
+"""
+Resumable, rotation-aware tailer for Asterisk's Master.csv.
+
+The consumer commits the byte offset of the last line it has fully
+handled; (inode, offset) is persisted atomically so a restart resumes
+exactly there instead of jumping to EOF. Rotation (new inode at the same
+path) and truncation (file shorter than our offset) are detected, and a
+file rotated away while we were down is found again by inode so its tail
+is not lost. New data is waited for with inotify on Linux, falling back
+to short sleeps elsewhere.
+"""
+import ctypes
+import ctypes.util
+import json
+import os
+import pathlib
+import select
+import time
+
+# inotify(7) flags
+IN_MODIFY = 0x00000002
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+
+class _Inotify:
+    """Minimal inotify watcher on a directory, via libc (no extra dependency)."""
+
+    def __init__(self, directory):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        wd = libc.inotify_add_watch(self.fd, str(directory).encode(), IN_MODIFY | IN_CREATE | IN_MOVED_TO)
+        if wd < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+
+    def wait(self, timeout):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if ready:
+            try:
+                while os.read(self.fd, 65536):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        os.close(self.fd)
+
+
+class ResumableTailer:
+    def __init__(self, path, checkpoint_file, start_at_end=True, max_wait=1.0, poll_interval=0.2):
+        """
+        start_at_end only applies when there is no checkpoint yet: True keeps
+        the old "only new CDRs" behaviour, False imports the whole file.
+        """
+        self.path = pathlib.Path(path)
+        self.checkpoint_file = pathlib.Path(checkpoint_file)
+        self.start_at_end = start_at_end
+        self.max_wait = max_wait
+        self.poll_interval = poll_interval
+
+        self._fh = None
+        self._inode = None
+        self._offset = 0
+        self._notifier = None
+        try:
+            self._notifier = _Inotify(self.path.parent)
+        except (OSError, AttributeError, TypeError):
+            self._notifier = None  # not Linux, or inotify unavailable: poll instead
+
+    # ---------- Checkpoint ----------
+    def _load_checkpoint(self):
+        try:
+            with open(self.checkpoint_file, "r") as f:
+                data = json.load(f)
+            return int(data["inode"]), int(data["offset"])
+        except (FileNotFoundError, KeyError, ValueError, json.JSONDecodeError):
+            return None
+
+    def commit(self, position):
+        """Persist a position returned by lines() once everything before it is durable downstream."""
+        inode, offset = position
+        tmp = self.checkpoint_file.with_suffix(self.checkpoint_file.suffix + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump({"path": str(self.path), "inode": inode, "offset": offset, "updated_at": time.time()}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.checkpoint_file)
+
+    # ---------- File handling ----------
+    def _open(self, path, offset):
+        if self._fh:
+            self._fh.close()
+        self._fh = open(path, "rb")
+        self._inode = os.fstat(self._fh.fileno()).st_ino
+        self._fh.seek(offset)
+        self._offset = offset
+
+    def _find_by_inode(self, inode):
+        """Look for a rotated copy (Master.csv.1, ...) of the file we were reading."""
+        for candidate in self.path.parent.iterdir():
+            try:
+                if candidate.is_file() and candidate.stat().st_ino == inode:
+                    return candidate
+            except OSError:
+                continue
+        return None
+
+    def _resume(self):
+        checkpoint = self._load_checkpoint()
+        current = os.stat(self.path)
+
+        if checkpoint is None:
+            self._open(self.path, current.st_size if self.start_at_end else 0)
+            print(f"[TAILER] No checkpoint — starting at {'EOF' if self.start_at_end else 'beginning'} of {self.path}")
+            return
+
+        inode, offset = checkpoint
+        if inode == current.st_ino:
+            if offset > current.st_size:
+                print(f"[TAILER] {self.path} was truncated while stopped — restarting at 0")
+                offset = 0
+            self._open(self.path, offset)
+            print(f"[TAILER] Resuming {self.path} at byte {offset}")
+            return
+
+        rotated = self._find_by_inode(inode)
+        if rotated is not None:
+            print(f"[TAILER] {self.path} rotated while stopped — draining {rotated.name} from byte {offset}")
+            self._open(rotated, offset)
+        else:
+            print(f"[TAILER] Checkpointed file is gone — starting {self.path} from the beginning")
+            self._open(self.path, 0)
+
+    def _file_change(self):
+        """At EOF: "rotated", "truncated" or None."""
+        try:
+            current = os.stat(self.path)
+        except FileNotFoundError:
+            return None  # mid-rotation; the new file will show up shortly
+        if current.st_ino != self._inode:
+            return "rotated"
+        if current.st_size < self._offset:
+            return "truncated"
+        return None
+
+    def _wait(self):
+        if self._notifier:
+            self._notifier.wait(self.max_wait)
+        else:
+            time.sleep(self.poll_interval)
+
+    # ---------- Reading ----------
+    def lines(self):
+        """
+        Yield (line, position) forever. `position` is (inode, offset just past
+        the line) and is what commit() expects. Partial lines are held back
+        until their newline arrives.
+        """
+        self._resume()
+        pending = b""
+        while True:
+            chunk = self._fh.readline()
+            if chunk:
+                if not chunk.endswith(b"\n"):
+                    pending += chunk
+                    self._offset += len(chunk)
+                    continue
+                line = pending + chunk
+                pending = b""
+                self._offset += len(chunk)
+                yield line.decode("utf-8", errors="replace"), (self._inode, self._offset)
+                continue
+
+            # EOF: either more data is coming, or the file was rotated/truncated
+            change = self._file_change()
+            if change == "rotated":
+                if pending:
+                    # The old file ended without a newline; its last line is complete now
+                    yield pending.decode("utf-8", errors="replace"), (self._inode, self._offset)
+                    pending = b""
+                print(f"[TAILER] Rotation detected — following new {self.path}")
+                self._open(self.path, 0)
+                continue
+            if change == "truncated":
+                print(f"[TAILER] Truncation detected — restarting {self.path} at 0")
+                pending = b""
+                self._open(self.path, 0)
+                continue
+            self._wait()
+
+    def offset(self):
+        return self._offset
+
+    def close(self):
+        if self._fh:
+            self._fh.close()
+        if self._notifier:
+            self._notifier.close()
@@ -0,0 +1,161 @@
+"""
+Write-behind ingest queue for the VoIP CDR API.
+
+CDRs are accepted into a bounded in-process queue and flushed to the chain
+as a group once `batch_size` records are waiting or `flush_interval` seconds
+have passed since the first one arrived. Every accepted CDR gets a ticket
+that can be polled until its batch transaction is confirmed.
+"""
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+class QueueFull(Exception):
+    """Raised when the ingest queue cannot accept more CDRs (backpressure)."""
+
+
+class IngestQueue:
+    def __init__(self, flush_fn, max_size=10_000, batch_size=50,
+                 flush_interval=2.0, max_tickets=100_000):
+        """
+        flush_fn(batch) receives a list of CDR dicts and must return one
+        result dict per CDR (e.g. {"idx": ..., "tx_hash": ...}) in the same
+        order, or raise to mark the whole batch as failed.
+        """
+        self.flush_fn = flush_fn
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_tickets = max_tickets
+
+        self._queue = queue.Queue(maxsize=max_size)
+        self._tickets = OrderedDict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # ---------- Producer side ----------
+    def submit(self, cdr: dict) -> str:
+        """Enqueue one CDR and return its ticket, or raise QueueFull."""
+        return self.submit_many([cdr])[0]
+
+    def submit_many(self, cdrs: list) -> list:
+        """Enqueue a group of CDRs atomically: either all are accepted or none."""
+        with self._lock:
+            free = self._queue.maxsize - self._queue.qsize()
+            if len(cdrs) > free:
+                raise QueueFull(f"ingest queue full ({self._queue.qsize()}/{self._queue.maxsize})")
+
+            tickets = []
+            for cdr in cdrs:
+                ticket = uuid.uuid4().hex
+                self._tickets[ticket] = {"ticket": ticket, "status": "queued", "queued_at": time.time()}
+                self._queue.put_nowait((ticket, cdr))
+                tickets.append(ticket)
+            self._trim_tickets()
+        return tickets
+
+    def status(self, ticket: str):
+        with self._lock:
+            entry = self._tickets.get(ticket)
+            return dict(entry) if entry else None
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = [t["queued_at"] for t in self._tickets.values() if t["status"] in ("queued", "submitted")]
+        return {
+            "queue_depth": self._queue.qsize(),
+            "queue_capacity": self._queue.maxsize,
+            "pending_tickets": len(pending),
+            "oldest_pending_seconds": round(time.time() - min(pending), 3) if pending else 0.0,
+            "batch_size": self.batch_size,
+            "flush_interval": self.flush_interval,
+        }
+
+    # ---------- Worker lifecycle ----------
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="cdr-ingest", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=30.0):
+        """Stop the worker after flushing whatever is still queued."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    # ---------- Worker ----------
+    def _run(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = self._collect()
+            if batch:
+                self._flush(batch)
+
+    def _collect(self):
+        try:
+            first = self._queue.get(timeout=0.5)
+        except queue.Empty:
+            return []
+
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stop.is_set():
+                # Drain without waiting once the deadline passed or we are shutting down
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except queue.Empty:
+                    break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch):
+        tickets = [t for t, _ in batch]
+        cdrs = [c for _, c in batch]
+        self._update(tickets, {"status": "submitted", "batch_size": len(batch)})
+
+        try:
+            results = self.flush_fn(cdrs)
+        except Exception as e:
+            print(f"⚠️ Batch of {len(batch)} CDRs failed: {e}")
+            self._update(tickets, {"status": "failed", "error": str(e), "finished_at": time.time()})
+            return
+
+        with self._lock:
+            for ticket, result in zip(tickets, results):
+                entry = self._tickets.get(ticket)
+                if entry is not None:
+                    entry.update(result)
+                    entry["status"] = result.get("status", "confirmed")
+                    entry["finished_at"] = time.time()
+
+    def _update(self, tickets, fields):
+        with self._lock:
+            for ticket in tickets:
+                entry = self._tickets.get(ticket)
+                if entry is not None:
+                    entry.update(fields)
+
+    def _trim_tickets(self):
+        """Forget the oldest finished tickets once the table is full."""
+        excess = len(self._tickets) - self.max_tickets
+        if excess <= 0:
+            return
+        for ticket in list(self._tickets):
+            if excess <= 0:
+                break
+            if self._tickets[ticket]["status"] in ("confirmed", "failed"):
+                del self._tickets[ticket]
+                excess -= 1
@@ -0,0 +1,118 @@
+"""
+Client-side tracking of CDRs handed to the backend's write-behind queue.
+
+A 202 from /queue_cdrs only means the CDRs are in the API's in-memory
+queue; they are safe once their ticket is confirmed. PendingTickets keeps
+every submitted CDR until then, grouped under the checkpoint mark (tailer
+position, file offset) that becomes safe to commit once the group and
+every group before it resolved.
+
+A CDR resolves when its ticket confirms or the backend reports its hash
+as already stored. A failed ticket, a ticket the API no longer knows (it
+restarted, or the ticket expired) and a "pending" duplicate claimed by
+someone else all make the CDR due for resubmission; after `max_failures`
+failed flushes it is given up so the caller can dead-letter it.
+"""
+from collections import deque
+
+LOOKUP_SIZE = 5000  # tickets per POST /ingest/tickets
+WAITING = ("queued", "submitted")
+
+
+class PendingTickets:
+    def __init__(self, max_failures=5):
+        self.max_failures = max_failures
+        self._groups = deque()   # [mark, hashes] in submit order
+        self._cdrs = {}          # hash -> cdr, unresolved only
+        self._ticket = {}        # hash -> ticket, or None when due for resubmission
+        self._hash_of = {}       # ticket -> hash
+        self._failures = {}
+
+    def __len__(self):
+        return len(self._cdrs)
+
+    # ---------- Submit side ----------
+    def add(self, mark, responses):
+        """Record a flushed group: `responses` are the (cdrs, /queue_cdrs body) pairs it was sent as."""
+        self._groups.append((mark, self.track(responses)))
+
+    def track(self, responses) -> set:
+        """Pair tickets with their CDRs; returns the hashes still waiting on something."""
+        waiting = set()
+        for cdrs, body in responses:
+            by_hash = {c["hash"]: c for c in cdrs}
+            fresh = list(cdrs)
+            for d in body["duplicates"]:
+                # The first occurrence of a hash in a request takes the claim, repeats come back as duplicates
+                del fresh[max(i for i, c in enumerate(fresh) if c["hash"] == d["hash"])]
+            for cdr, ticket in zip(fresh, body["tickets"]):
+                self._set_ticket(cdr, ticket)
+                waiting.add(cdr["hash"])
+            for d in body["duplicates"]:
+                h = d["hash"]
+                if d["state"] == "stored":
+                    self._resolve(h)
+                    continue
+                if h not in self._ticket:
+                    # Claimed by a flush we can't follow (another client, or ours from before an API restart)
+                    self._cdrs[h] = by_hash[h]
+                    self._ticket[h] = None
+                waiting.add(h)
+        return waiting
+
+    def _set_ticket(self, cdr, ticket):
+        h = cdr["hash"]
+        old = self._ticket.get(h)
+        if old is not None:
+            self._hash_of.pop(old, None)
+        self._cdrs[h] = cdr
+        self._ticket[h] = ticket
+        self._hash_of[ticket] = h
+
+    # ---------- Poll side ----------
+    def tickets(self) -> list:
+        return list(self._hash_of)
+
+    def update(self, entries: dict):
+        """Apply ticket entries from POST /ingest/tickets ({ticket: entry, or None when unknown})."""
+        for ticket, entry in entries.items():
+            h = self._hash_of.get(ticket)
+            if h is None:
+                continue
+            status = entry["status"] if entry else None
+            if status in WAITING:
+                continue
+            if status == "failed":
+                self._failures[h] = self._failures.get(h, 0) + 1
+            elif status is not None:
+                self._resolve(h)
+                continue
+            del self._hash_of[ticket]
+            self._ticket[h] = None
+
+    def due(self):
+        """(CDRs to resubmit, CDRs given up after max_failures); the given-up ones count as resolved."""
+        retry, given_up = [], []
+        for h, ticket in list(self._ticket.items()):
+            if ticket is not None:
+                continue
+            if self._failures.get(h, 0) >= self.max_failures:
+                given_up.append(self._cdrs[h])
+                self._resolve(h)
+            else:
+                retry.append(self._cdrs[h])
+        return retry, given_up
+
+    def committable(self):
+        """Mark of the last group that fully resolved with everything before it, or None."""
+        mark = None
+        while self._groups and not any(h in self._cdrs for h in self._groups[0][1]):
+            mark = self._groups.popleft()[0]
+        return mark
+
+    def _resolve(self, h):
+        self._cdrs.pop(h, None)
+        self._failures.pop(h, None)
+        ticket = self._ticket.pop(h, None)
+        if ticket is not None:
+            self._hash_of.pop(ticket, None)
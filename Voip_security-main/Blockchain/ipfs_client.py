@@ -0,0 +1,200 @@
+"""
+Kubo (go-ipfs) HTTP API client with a batched background pin queue.
+
+Talks to the node's RPC API (default http://127.0.0.1:5001/api/v0) over one
+pooled requests.Session instead of spawning `ipfs add` / `ipfs pin add`
+processes. Documents are added straight from memory.
+
+Pins are not made in the request path: pin_later() puts the CID on a queue
+and a worker thread pins everything waiting in one /pin/add call (the API
+takes many `arg`s), after `pin_batch` CIDs or `pin_interval` seconds. A
+batch that fails is retried CID by CID so one unreachable CID doesn't hold
+the rest back; failing CIDs are retried with backoff up to `max_attempts`.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class IPFSError(Exception):
+    """Raised when the Kubo API rejects or fails a request."""
+
+
+class KuboClient:
+    def __init__(self, api_url="http://127.0.0.1:5001", timeout=30.0, pool_size=8,
+                 pin_batch=100, pin_interval=1.0, pin_timeout=120.0, max_attempts=5,
+                 max_pending=100_000, stage_histogram=None):
+        """stage_histogram: optional metrics.Histogram with a "stage" label, e.g. stage="ipfs_add"."""
+        self.api_url = api_url.rstrip("/").removesuffix("/api/v0") + "/api/v0"
+        self.timeout = timeout
+        self.pin_batch = pin_batch
+        self.pin_interval = pin_interval
+        self.pin_timeout = pin_timeout
+        self.max_attempts = max_attempts
+        self.max_pending = max_pending
+        self.stage_histogram = stage_histogram
+
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+
+        self._pending = OrderedDict()   # cid -> (attempts, not_before, queued_at)
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+        self.counters = {"added": 0, "pinned": 0, "pin_batches": 0, "pin_failures": 0,
+                         "pins_dropped": 0, "pins_given_up": 0}
+
+    def _post(self, command: str, params=None, files=None, timeout=None):
+        started = time.perf_counter()
+        try:
+            r = self.session.post(f"{self.api_url}/{command}", params=params, files=files,
+                                  timeout=timeout or self.timeout)
+        except requests.RequestException as e:
+            raise IPFSError(f"{command}: {e}")
+        finally:
+            if self.stage_histogram is not None:
+                self.stage_histogram.observe(time.perf_counter() - started, stage="ipfs_" + command.replace("/", "_"))
+        if r.status_code != 200:
+            raise IPFSError(f"{command}: HTTP {r.status_code} {r.text.strip()[:200]}")
+        return r
+
+    # ---------- Adding ----------
+    def add_bytes(self, data: bytes, name="cdr.json", pin=True) -> str:
+        """Add an in-memory document and return its CID."""
+        r = self._post("add", params={"pin": str(pin).lower(), "quieter": "true"},
+                       files={"file": (name, data)})
+        self.counters["added"] += 1
+        return r.json()["Hash"]
+
+    def add_json(self, doc, pin=True) -> str:
+        """Add a JSON document serialised as json.dumps(doc) (the format CIDs were created with so far)."""
+        return self.add_bytes(json.dumps(doc).encode(), pin=pin)
+
+    # ---------- Pinning ----------
+    def pin(self, cids) -> list:
+        """Pin CIDs now, in one request; returns the pinned CIDs."""
+        cids = list(cids)
+        if not cids:
+            return []
+        r = self._post("pin/add", params=[("arg", c) for c in cids] + [("progress", "false")],
+                       timeout=self.pin_timeout)
+        return r.json().get("Pins", cids)
+
+    def pin_later(self, cid: str):
+        """Queue a CID (or an archive "<cid>#<n>" reference) for the background pinner; never blocks."""
+        if not cid:
+            return
+        cid = cid.partition("#")[0]
+        with self._cond:
+            if cid in self._pending:
+                return
+            if len(self._pending) >= self.max_pending:
+                self.counters["pins_dropped"] += 1
+                return
+            self._pending[cid] = (0, 0.0, time.time())
+            if len(self._pending) >= self.pin_batch:
+                self._cond.notify()
+
+    def _take_batch(self) -> list:
+        """
+        Wait for a full batch or the flush interval, then take the CIDs that
+        are due. While everything pending is backing off (e.g. the daemon is
+        down) it sleeps until the earliest retry instead of returning empty.
+        """
+        with self._cond:
+            now = time.monotonic()
+            if sum(1 for _, not_before, _ in self._pending.values() if not_before <= now) < self.pin_batch:
+                self._cond.wait(self.pin_interval)
+            while not self._stop.is_set():
+                now = time.monotonic()
+                batch = []
+                for cid, (attempts, not_before, queued_at) in self._pending.items():
+                    if not_before <= now:
+                        batch.append((cid, attempts, queued_at))
+                        if len(batch) >= self.pin_batch:
+                            break
+                if batch:
+                    for cid, _, _ in batch:
+                        del self._pending[cid]
+                    return batch
+                # New CIDs don't always notify, so wake at least every pin_interval
+                wake = min((not_before for _, not_before, _ in self._pending.values()), default=now + self.pin_interval)
+                self._cond.wait(min(max(wake - now, 0.0), self.pin_interval))
+            return []
+
+    def _retry(self, cid: str, attempts: int, queued_at: float):
+        with self._cond:
+            if attempts >= self.max_attempts:
+                self.counters["pins_given_up"] += 1
+                print(f"⚠️ Giving up pinning {cid} after {attempts} attempts")
+                return
+            backoff = min(2 ** attempts, 300)
+            self._pending[cid] = (attempts, time.monotonic() + backoff, queued_at)
+
+    def _pin_batch(self, batch):
+        try:
+            self.pin(cid for cid, _, _ in batch)
+            self.counters["pinned"] += len(batch)
+            self.counters["pin_batches"] += 1
+            return
+        except IPFSError as e:
+            self.counters["pin_failures"] += 1
+            if len(batch) == 1:
+                cid, attempts, queued_at = batch[0]
+                print(f"⚠️ Failed to pin CID {cid}: {e}")
+                self._retry(cid, attempts + 1, queued_at)
+                return
+        for entry in batch:
+            self._pin_batch([entry])
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._take_batch()
+            if batch:
+                self._pin_batch(batch)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="ipfs-pinner", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, flush=True):
+        """Stop the pinner; with flush, pin what is already due first (one attempt each)."""
+        self._stop.set()
+        with self._cond:
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout=self.pin_timeout)
+            self._thread = None
+        if flush:
+            while True:
+                batch = self._take_due()
+                if not batch:
+                    break
+                self._pin_batch(batch)
+        self.session.close()
+
+    def _take_due(self) -> list:
+        with self._cond:
+            now = time.monotonic()
+            batch = [(c, a, q) for c, (a, nb, q) in self._pending.items() if nb <= now and a == 0][:self.pin_batch]
+            for cid, _, _ in batch:
+                del self._pending[cid]
+            return batch
+
+    def stats(self) -> dict:
+        with self._cond:
+            backlog = len(self._pending)
+            oldest = min((q for _, _, q in self._pending.values()), default=None)
+            counters = dict(self.counters)
+        return {
+            **counters,
+            "pin_backlog": backlog,
+            "oldest_pin_age_seconds": round(time.time() - oldest, 3) if oldest else 0.0,
+        }
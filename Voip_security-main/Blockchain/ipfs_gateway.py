@@ -0,0 +1,240 @@
+"""
+Async IPFS gateway client with connection pooling, hedged requests and a
+content-addressed cache.
+
+CIDs are immutable, so a document fetched once never has to be fetched
+again: results are kept in a bounded in-memory LRU and, optionally, on
+disk under cache_dir/<cid[:2]>/<cid>. On a miss the first gateway is
+asked; if it hasn't answered within `hedge_delay` seconds (or fails) the
+next gateway is raced against it and the first good answer wins.
+
+Gateways are untrusted (ipfs.io is in the default list): documents are
+fetched as trustless CARs and every block is checked against the CID
+(see ipfs_verify) before anything reaches the cache. A gateway whose
+answer doesn't hash to the CID counts as failed and the next one is tried.
+
+References of the form "<cid>#<n>" address record n of a packed archive
+chunk (see cdr_archive). The whole chunk is fetched and cached under its
+CID, weighted by its record count, so the rest of its records are hits.
+"""
+import asyncio
+import json
+import os
+import pathlib
+import re
+import threading
+from collections import OrderedDict
+
+import httpx
+
+from cdr_archive import Chunk, is_chunk, parse_ref
+from ipfs_verify import CAR_ACCEPT, extract_file
+
+
+# CIDv0 (base58btc, "Qm…") or CIDv1 in base32 ("bafy…"); refs may add "#<n>" for an archive record
+CID_PATTERN = re.compile(r"Qm[1-9A-HJ-NP-Za-km-z]{44}|b[a-z2-7]{20,120}")
+REF_PATTERN = re.compile(rf"(?:{CID_PATTERN.pattern})(?:#\d{{1,9}})?")
+
+
+class GatewayError(Exception):
+    """Raised when no gateway could return the requested CID."""
+
+
+def is_valid_ref(ref) -> bool:
+    """True for a well-formed CID or "<cid>#<n>" archive reference (safe to use as a cache path)."""
+    return isinstance(ref, str) and REF_PATTERN.fullmatch(ref) is not None
+
+
+def parse_document(raw: bytes):
+    """Decode a CDR document or archive chunk; tolerate newline-delimited JSON by taking the first line."""
+    if is_chunk(raw):
+        return Chunk(raw)
+    try:
+        return json.loads(raw)
+    except ValueError:
+        first_line = raw.decode(errors="replace").splitlines()[0]
+        return json.loads(first_line)
+
+
+class GatewayClient:
+    def __init__(self, gateways, hedge_delay=0.5, timeout=10.0, cache_size=10_000,
+                 cache_dir=None, max_connections=100):
+        self.gateways = [g.rstrip("/") for g in gateways]
+        self.hedge_delay = hedge_delay
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self.cache_dir = pathlib.Path(cache_dir) if cache_dir else None
+        self.max_connections = max_connections
+        if self.cache_dir:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        self._lru = OrderedDict()      # cid -> (doc, weight)
+        self._lru_weight = 0
+        self._lru_lock = threading.Lock()
+        self._clients = {}
+        self._inflight = {}
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "hedged": 0, "rejected": 0, "errors": 0}
+
+    # ---------- HTTP pool (one per event loop) ----------
+    def _client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+                follow_redirects=True,
+            )
+            self._clients[loop] = client
+        return client
+
+    # ---------- Cache ----------
+    def _lru_get(self, cid):
+        with self._lru_lock:
+            entry = self._lru.get(cid)
+            if entry is None:
+                return None
+            self._lru.move_to_end(cid)
+            return entry[0]
+
+    def _lru_put(self, cid, doc):
+        """cache_size counts CDRs: a chunk weighs as many entries as it has records."""
+        weight = max(len(doc), 1) if isinstance(doc, Chunk) else 1
+        with self._lru_lock:
+            old = self._lru.pop(cid, None)
+            if old is not None:
+                self._lru_weight -= old[1]
+            self._lru[cid] = (doc, weight)
+            self._lru_weight += weight
+            while self._lru_weight > self.cache_size and len(self._lru) > 1:
+                _, (_, w) = self._lru.popitem(last=False)
+                self._lru_weight -= w
+
+    def _disk_path(self, cid):
+        return self.cache_dir / cid[:2] / cid
+
+    def _disk_get(self, cid):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._disk_path(cid), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _disk_put(self, cid, raw: bytes):
+        if not self.cache_dir:
+            return
+        path = self._disk_path(cid)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "wb") as f:
+            f.write(raw)
+        os.replace(tmp, path)
+
+    # ---------- Fetching ----------
+    async def get_json(self, ref: str):
+        """Document for a CID, or one record of an archive chunk for "<cid>#<n>"."""
+        if not is_valid_ref(ref):
+            raise GatewayError(f"Malformed CID {ref!r}")
+        cid, n = parse_ref(ref)
+        doc = await self._get_document(cid)
+        if n is None:
+            return doc
+        if not isinstance(doc, Chunk):
+            raise GatewayError(f"CID {cid} is not a CDR archive chunk")
+        try:
+            return doc.record(n)
+        except IndexError as e:
+            raise GatewayError(str(e))
+
+    async def _get_document(self, cid: str):
+        doc = self._lru_get(cid)
+        if doc is not None:
+            self.counters["memory_hits"] += 1
+            return doc
+
+        raw = await asyncio.to_thread(self._disk_get, cid)
+        if raw is not None:
+            self.counters["disk_hits"] += 1
+            doc = parse_document(raw)
+            self._lru_put(cid, doc)
+            return doc
+
+        # Collapse concurrent misses for the same CID into one network fetch
+        key = (asyncio.get_running_loop(), cid)
+        task = self._inflight.get(key)
+        if task is None:
+            self.counters["misses"] += 1
+            task = asyncio.ensure_future(self._fetch_and_cache(cid))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _fetch_and_cache(self, cid):
+        raw = await self._hedged_fetch(cid)
+        doc = parse_document(raw)
+        self._lru_put(cid, doc)
+        await asyncio.to_thread(self._disk_put, cid, raw)
+        return doc
+
+    async def _fetch_one(self, gateway, cid):
+        r = await self._client().get(f"{gateway}/ipfs/{cid}", params={"format": "car"},
+                                     headers={"Accept": CAR_ACCEPT})
+        r.raise_for_status()
+        try:
+            raw = extract_file(cid, r.content)
+        except ValueError as e:
+            self.counters["rejected"] += 1
+            raise GatewayError(f"{gateway} returned unverifiable content for {cid}: {e}")
+        parse_document(raw)  # a verified CID that isn't a CDR document is still an error
+        return raw
+
+    async def _hedged_fetch(self, cid):
+        pending = set()
+        remaining = list(self.gateways)
+        errors = []
+        try:
+            while remaining or pending:
+                if remaining:
+                    gateway = remaining.pop(0)
+                    if pending:
+                        self.counters["hedged"] += 1
+                    pending.add(asyncio.ensure_future(self._fetch_one(gateway, cid)))
+
+                # Wait for an answer, but only up to hedge_delay while more gateways are left
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=self.hedge_delay if remaining else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    errors.append(str(task.exception()))
+        finally:
+            for task in pending:
+                task.cancel()
+
+        self.counters["errors"] += 1
+        raise GatewayError(f"Unable to fetch CID {cid} from IPFS gateways: {'; '.join(errors)}")
+
+    # ---------- Stats / shutdown ----------
+    def stats(self) -> dict:
+        lookups = self.counters["memory_hits"] + self.counters["disk_hits"] + self.counters["misses"]
+        hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+        with self._lru_lock:
+            size = self._lru_weight
+        return {
+            **self.counters,
+            "hit_rate": round(hits / lookups, 4) if lookups else None,
+            "memory_entries": size,
+            "memory_capacity": self.cache_size,
+            "disk_cache": str(self.cache_dir) if self.cache_dir else None,
+        }
+
+    async def aclose(self):
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
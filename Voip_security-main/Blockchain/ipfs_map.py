@@ -0,0 +1,215 @@
+"""
+Memory-resident idx → IPFS CID index with write-ahead persistence.
+
+The mapping lives in a dense list (contract indexes are contiguous), so a
+lookup is a list access. Durability comes from two files:
+
+* cdr_ipfs_map.json — compacted snapshot, same {"idx": "cid"} shape as before
+* cdr_ipfs_map.log  — append-only JSON lines written since the last snapshot
+
+Writers append under an exclusive file lock; readers in other uvicorn
+workers notice the log grew (or the snapshot was replaced by compaction)
+with a single stat() and replay only the new lines.
+"""
+import json
+import os
+import pathlib
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: single worker, no cross-process locking
+    fcntl = None
+
+
+class CIDIndex:
+    def __init__(self, snapshot_file, compact_every=10_000):
+        self.snapshot_file = pathlib.Path(snapshot_file)
+        self.log_file = self.snapshot_file.with_suffix(".log")
+        self.lock_file = self.snapshot_file.with_suffix(".lock")
+        self.compact_every = compact_every
+
+        self._cids = []
+        self._count = 0
+        self._log_offset = 0
+        self._log_entries = 0
+        self._snapshot_id = None
+        self._mutex = threading.RLock()
+        self._lock_fd = None
+
+    # ---------- Cross-process locking ----------
+    def _flock(self, exclusive: bool):
+        if fcntl is None:
+            return
+        if self._lock_fd is None:
+            self._lock_fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+    def _funlock(self):
+        if fcntl is not None and self._lock_fd is not None:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    # ---------- Loading ----------
+    def load(self):
+        """Load snapshot + log into memory, migrating the old newline format if found."""
+        with self._mutex:
+            self._flock(exclusive=True)
+            try:
+                if not self.snapshot_file.exists():
+                    self._write_snapshot({})
+                    print("🆕 Created new IPFS map file.")
+                self._reload()
+            finally:
+                self._funlock()
+        return self
+
+    def _reload(self):
+        self._cids = []
+        self._count = 0
+        snapshot = self._read_snapshot()
+        for key, cid in snapshot.items():
+            self._put(int(key), cid)
+        self._snapshot_id = self._stat_id(self.snapshot_file)
+        self._log_offset = 0
+        self._log_entries = 0
+        self._replay_log()
+
+    def _read_snapshot(self) -> dict:
+        try:
+            with open(self.snapshot_file, "r") as f:
+                return json.load(f)
+        except json.JSONDecodeError:
+            print("⚠️ Detected old format — migrating...")
+            output = {}
+            with open(self.snapshot_file, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line.strip())
+                        output[str(entry["idx"])] = entry["ipfs_cid"]
+                    except Exception:
+                        continue
+            self._write_snapshot(output)
+            print(f"✅ Migration complete. {len(output)} entries repaired.")
+            return output
+
+    def _replay_log(self):
+        if not self.log_file.exists():
+            return
+        with open(self.log_file, "rb") as f:
+            f.seek(self._log_offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # partially written by another worker; pick it up next time
+                self._log_offset += len(line)
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self._put(int(entry["idx"]), entry["cid"])
+                self._log_entries += 1
+
+    @staticmethod
+    def _stat_id(path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns)
+
+    def _refresh(self):
+        """Pick up writes made by other processes since we last looked."""
+        if fcntl is None:
+            return
+        snapshot_id = self._stat_id(self.snapshot_file)
+        try:
+            log_size = os.path.getsize(self.log_file)
+        except FileNotFoundError:
+            log_size = 0
+        if snapshot_id == self._snapshot_id and log_size == self._log_offset:
+            return
+
+        self._flock(exclusive=False)
+        try:
+            if self._stat_id(self.snapshot_file) != self._snapshot_id or log_size < self._log_offset:
+                self._reload()  # another worker compacted
+            else:
+                self._replay_log()
+        finally:
+            self._funlock()
+
+    # ---------- In-memory array ----------
+    def _put(self, idx: int, cid: str):
+        if idx >= len(self._cids):
+            self._cids.extend([None] * (idx + 1 - len(self._cids)))
+        if self._cids[idx] is None:
+            self._count += 1
+        self._cids[idx] = cid
+
+    # ---------- Public API ----------
+    def set(self, idx: int, cid: str):
+        line = (json.dumps({"idx": idx, "cid": cid}, separators=(",", ":")) + "\n").encode()
+        with self._mutex:
+            self._flock(exclusive=True)
+            try:
+                self._refresh_locked()
+                with open(self.log_file, "ab") as f:
+                    f.write(line)
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._log_offset += len(line)
+                self._log_entries += 1
+                self._put(idx, cid)
+                if self._log_entries >= self.compact_every:
+                    self._compact_locked()
+            finally:
+                self._funlock()
+
+    def _refresh_locked(self):
+        """Catch up while already holding the exclusive lock."""
+        if self._stat_id(self.snapshot_file) != self._snapshot_id:
+            self._reload()
+        else:
+            self._replay_log()
+
+    def get(self, idx: int):
+        with self._mutex:
+            self._refresh()
+            if 0 <= idx < len(self._cids):
+                return self._cids[idx]
+            return None
+
+    def as_dict(self) -> dict:
+        with self._mutex:
+            self._refresh()
+            return {str(i): cid for i, cid in enumerate(self._cids) if cid is not None}
+
+    def __len__(self):
+        with self._mutex:
+            return self._count
+
+    # ---------- Compaction ----------
+    def compact(self):
+        with self._mutex:
+            self._flock(exclusive=True)
+            try:
+                self._refresh_locked()
+                self._compact_locked()
+            finally:
+                self._funlock()
+
+    def _compact_locked(self):
+        self._write_snapshot({str(i): cid for i, cid in enumerate(self._cids) if cid is not None})
+        with open(self.log_file, "wb"):
+            pass
+        self._snapshot_id = self._stat_id(self.snapshot_file)
+        self._log_offset = 0
+        self._log_entries = 0
+        print(f"🗜️ Compacted IPFS map ({self._count} entries).")
+
+    def _write_snapshot(self, data: dict):
+        tmp = self.snapshot_file.with_suffix(".json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.snapshot_file)
@@ -0,0 +1,160 @@
+"""
+Verification of trustless IPFS gateway responses.
+
+Gateways are asked for the CID's blocks as a CAR (?format=car) rather than
+the reassembled file, so every block can be hashed against the CID that
+names it before any of it is trusted. The file is then rebuilt from the
+verified dag-pb/UnixFS (or raw) blocks starting at the root CID. Wrong
+bytes, a missing block or a hash function we can't check all raise
+ValueError, which the gateway client treats as a failed fetch.
+"""
+import base64
+import hashlib
+
+CAR_ACCEPT = "application/vnd.ipld.car;version=1"
+
+DAG_PB = 0x70
+RAW = 0x55
+HASHES = {
+    0x00: None,                 # identity: the digest is the data
+    0x12: hashlib.sha256,
+    0x13: hashlib.sha512,
+}
+UNIXFS_RAW, UNIXFS_FILE = 0, 2
+
+BASE58 = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+
+
+# ---------- Encodings ----------
+def _varint(buf, pos):
+    value = shift = 0
+    while True:
+        if pos >= len(buf):
+            raise ValueError("Truncated varint")
+        b = buf[pos]
+        pos += 1
+        value |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return value, pos
+        shift += 7
+        if shift > 63:
+            raise ValueError("Varint too long")
+
+
+def _b58decode(text):
+    n = 0
+    for ch in text:
+        n = n * 58 + BASE58.index(ch)
+    raw = n.to_bytes((n.bit_length() + 7) // 8, "big")
+    return b"\0" * (len(text) - len(text.lstrip("1"))) + raw
+
+
+def _read_cid(buf, pos=0):
+    """(codec, hash code, digest, end) of a binary CID starting at `pos`."""
+    if buf[pos:pos + 2] == b"\x12\x20":     # CIDv0: bare sha2-256 multihash of a dag-pb block
+        end = pos + 34
+        if end > len(buf):
+            raise ValueError("Truncated CIDv0")
+        return DAG_PB, 0x12, bytes(buf[pos + 2:end]), end
+    version, pos = _varint(buf, pos)
+    if version != 1:
+        raise ValueError(f"Unsupported CID version {version}")
+    codec, pos = _varint(buf, pos)
+    code, pos = _varint(buf, pos)
+    size, pos = _varint(buf, pos)
+    if pos + size > len(buf):
+        raise ValueError("Truncated multihash")
+    return codec, code, bytes(buf[pos:pos + size]), pos + size
+
+
+def decode_cid(cid: str):
+    """(codec, hash code, digest) of a CIDv0 or base32 CIDv1 string."""
+    if cid.startswith("Qm"):
+        raw = _b58decode(cid)
+    elif cid.startswith("b"):
+        body = cid[1:].upper()
+        raw = base64.b32decode(body + "=" * (-len(body) % 8))
+    else:
+        raise ValueError(f"Unsupported CID encoding {cid!r}")
+    codec, code, digest, end = _read_cid(raw)
+    if end != len(raw):
+        raise ValueError(f"Trailing bytes in CID {cid!r}")
+    return codec, code, digest
+
+
+def _fields(buf):
+    """(field number, value) pairs of a protobuf message (varint and length-delimited fields only)."""
+    pos = 0
+    while pos < len(buf):
+        key, pos = _varint(buf, pos)
+        wire = key & 7
+        if wire == 0:
+            value, pos = _varint(buf, pos)
+        elif wire == 2:
+            size, pos = _varint(buf, pos)
+            if pos + size > len(buf):
+                raise ValueError("Truncated protobuf field")
+            value, pos = bytes(buf[pos:pos + size]), pos + size
+        else:
+            raise ValueError(f"Unexpected protobuf wire type {wire}")
+        yield key >> 3, value
+
+
+# ---------- CAR ----------
+def read_car(data: bytes) -> dict:
+    """Blocks of a CARv1 keyed by (codec, hash code, digest); each is checked against its CID."""
+    view = memoryview(data)
+    size, pos = _varint(view, 0)
+    pos += size  # dag-cbor header (version, roots): the root we want is the CID we asked for
+    blocks = {}
+    while pos < len(view):
+        size, pos = _varint(view, pos)
+        end = pos + size
+        if end > len(view):
+            raise ValueError("Truncated CAR section")
+        codec, code, digest, pos = _read_cid(view, pos)
+        block = bytes(view[pos:end])
+        pos = end
+        if code not in HASHES:
+            raise ValueError(f"Unsupported multihash 0x{code:x}")
+        actual = block if HASHES[code] is None else HASHES[code](block).digest()
+        if actual != digest:
+            raise ValueError("CAR block does not match its CID")
+        blocks[(codec, code, digest)] = block
+    return blocks
+
+
+def _file_bytes(key, blocks, out):
+    block = blocks.get(key)
+    if block is None and key[1] == 0x00:
+        block = key[2]  # identity CIDs carry their block inline and may be left out of the CAR
+    if block is None:
+        raise ValueError("CAR is missing a block of the requested DAG")
+    codec = key[0]
+    if codec == RAW:
+        out.append(block)
+        return
+    if codec != DAG_PB:
+        raise ValueError(f"Unsupported codec 0x{codec:x}")
+
+    links, data = [], b""
+    for field, value in _fields(block):
+        if field == 2:
+            link = dict(_fields(value))
+            links.append(_read_cid(link.get(1, b""))[:3])
+        elif field == 1:
+            data = value
+    unixfs = dict(_fields(data))
+    if unixfs.get(1) not in (UNIXFS_RAW, UNIXFS_FILE):
+        raise ValueError("CID is not a UnixFS file")
+    out.append(unixfs.get(2, b""))
+    for child in links:
+        _file_bytes(child, blocks, out)
+
+
+def extract_file(cid: str, car: bytes) -> bytes:
+    """Verified file contents of `cid` from a trustless gateway CAR response."""
+    blocks = read_car(car)
+    out = []
+    _file_bytes(decode_cid(cid), blocks, out)
+    return b"".join(out)
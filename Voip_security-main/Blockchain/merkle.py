@@ -0,0 +1,60 @@
+"""
+Binary SHA-256 Merkle trees over CDR hashes.
+
+Leaves and inner nodes are domain-separated (0x00 / 0x01 prefixes) so an
+inner node can never be passed off as a leaf. An odd node at the end of a
+level is carried up unchanged rather than duplicated, so a batch can't
+produce the same root as the batch with its last CDR repeated.
+"""
+import hashlib
+
+LEAF_PREFIX = b"\x00"
+NODE_PREFIX = b"\x01"
+
+
+def leaf_hash(cdr_hash: str) -> bytes:
+    """Leaf value for a CDR, from its hex SHA-256 hash."""
+    return hashlib.sha256(LEAF_PREFIX + bytes.fromhex(cdr_hash)).digest()
+
+
+def node_hash(left: bytes, right: bytes) -> bytes:
+    return hashlib.sha256(NODE_PREFIX + left + right).digest()
+
+
+def build_levels(leaves: list) -> list:
+    """Return every level of the tree, leaves first and [root] last."""
+    if not leaves:
+        raise ValueError("cannot build a Merkle tree with no leaves")
+    levels = [list(leaves)]
+    while len(levels[-1]) > 1:
+        level = levels[-1]
+        parent = [node_hash(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            parent.append(level[-1])
+        levels.append(parent)
+    return levels
+
+
+def proof_for(levels: list, index: int) -> list:
+    """Inclusion proof for leaf `index` as [(sibling_hex, "L" | "R"), ...] from leaf to root."""
+    proof = []
+    for level in levels[:-1]:
+        sibling = index ^ 1
+        if sibling < len(level):
+            proof.append((level[sibling].hex(), "L" if sibling < index else "R"))
+        index //= 2
+    return proof
+
+
+def verify_proof(leaf: bytes, proof: list, root: bytes) -> bool:
+    node = leaf
+    for sibling_hex, side in proof:
+        sibling = bytes.fromhex(sibling_hex)
+        node = node_hash(sibling, node) if side == "L" else node_hash(node, sibling)
+    return node == root
+
+
+def build_batch(cdr_hashes: list):
+    """Build a tree over CDR hashes; returns (root, [proof per CDR])."""
+    levels = build_levels([leaf_hash(h) for h in cdr_hashes])
+    return levels[-1][0], [proof_for(levels, i) for i in range(len(cdr_hashes))]
@@ -0,0 +1,70 @@
+"""
+Local nonce allocation for the API's sending account.
+
+Letting the node pick nonces only works for one transaction at a time.
+Once several are in flight (restore window, ingest flushes, store_cdr)
+every sender takes its nonce from here instead, so none of them collide.
+
+The counter never moves back to the node's pending nonce: other senders
+may hold nonces above it that they haven't broadcast yet. A nonce whose
+send failed is released instead and handed to the next sender, so it
+doesn't leave a gap that would stall every later transaction.
+"""
+import asyncio
+import heapq
+import threading
+
+
+class NonceManager:
+    def __init__(self, w3, account):
+        self.w3 = w3
+        self.account = account
+        self._lock = threading.Lock()
+        self._next = None
+        self._released = []   # heap of nonces given back by failed sends
+
+    def _chain_nonce(self):
+        return self.w3.eth.get_transaction_count(self.account, "pending")
+
+    def next(self) -> int:
+        with self._lock:
+            if self._released:
+                return heapq.heappop(self._released)
+            if self._next is None:
+                self._next = self._chain_nonce()
+            nonce = self._next
+            self._next += 1
+            return nonce
+
+    def release(self, nonce: int):
+        """
+        Give back a nonce whose send failed. It is reused unless the node
+        shows it was taken after all; if the node is ahead of the counter
+        (transactions sent outside this manager), the counter moves up to it.
+        """
+        chain = self._chain_nonce()
+        with self._lock:
+            if self._next is not None and chain > self._next:
+                self._next = chain
+            if nonce >= chain and nonce not in self._released:
+                heapq.heappush(self._released, nonce)
+            self._released = [n for n in self._released if n >= chain]
+            heapq.heapify(self._released)
+
+    def transact(self, fn, tx: dict):
+        """fn.transact(tx) with a locally assigned nonce; releases the nonce if the send fails."""
+        nonce = self.next()
+        try:
+            return fn.transact({**tx, "nonce": nonce})
+        except Exception:
+            self.release(nonce)
+            raise
+
+    async def transact_async(self, fn, tx: dict):
+        """Same as transact() for an AsyncWeb3 contract function."""
+        nonce = await asyncio.to_thread(self.next)
+        try:
+            return await fn.transact({**tx, "nonce": nonce})
+        except Exception:
+            await asyncio.to_thread(self.release, nonce)
+            raise
@@ -0,0 +1,152 @@
+"""
+Range reads of VoipCDR records with an adaptive page size.
+
+getCDRRange(start, count) returns many records per eth_call. How many fit
+depends on the node (eth_call gas cap, response size limit, timeout), so
+the page size is tuned from experience: a failed call halves it, is
+retried and caps growth below the size that failed; a slow call shrinks
+it and a fast full page doubles it up to that cap. The cap creeps back up
+after a run of successes, so one transient error doesn't pin it low.
+Contracts deployed before getCDRRange existed fall back to one getCDR
+call per record.
+
+Records come back in the v1 getCDR order via the codec, whatever the
+deployed layout.
+"""
+import asyncio
+import threading
+import time
+
+
+class RangeReader:
+    def __init__(self, contract, async_contract, codec, limit=None,
+                 initial_size=100, min_size=1, max_size=500, target_seconds=1.0):
+        """limit(awaitable) wraps async calls, e.g. the API's per-node concurrency limit."""
+        self.contract = contract
+        self.async_contract = async_contract
+        self.codec = codec
+        self.limit = limit or (lambda call: call)
+        self.page_size = initial_size
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_seconds = target_seconds
+        self.ceiling = max_size
+        self._successes = 0
+        self.supported = any(
+            e.get("type") == "function" and e.get("name") == "getCDRRange" for e in contract.abi
+        )
+        self._lock = threading.Lock()
+        self.counters = {"calls": 0, "records": 0, "failures": 0}
+
+    # ---------- Page size tuning ----------
+    def _adapt(self, ok: bool, size: int, elapsed: float = 0.0, full: bool = False):
+        with self._lock:
+            if not ok:
+                self.counters["failures"] += 1
+                self.ceiling = max(self.min_size, size // 2)
+                self.page_size = min(self.ceiling, max(self.min_size, self.page_size // 2))
+                self._successes = 0
+                return
+            self._successes += 1
+            if self._successes % 50 == 0 and self.ceiling < self.max_size:
+                self.ceiling = min(self.max_size, int(self.ceiling * 1.25) + 1)
+            if elapsed > self.target_seconds:
+                self.page_size = max(self.min_size, int(self.page_size * 0.75))
+            elif full and elapsed < self.target_seconds / 2:
+                self.page_size = min(self.ceiling, self.page_size * 2)
+
+    def _record(self, items):
+        with self._lock:
+            self.counters["calls"] += 1
+            self.counters["records"] += len(items)
+
+    # ---------- Sync (background threads) ----------
+    def read(self, start: int, count: int) -> list:
+        """Records [start, start + count) as v1-order tuples; stops early at the end of the array."""
+        if not self.supported:
+            out = []
+            for idx in range(start, start + count):
+                out.append(self.codec.decode(self.contract.functions.getCDR(idx).call()))
+                self._record([idx])
+            return out
+        out, position, end, cap = [], start, start + count, None
+        while position < end:
+            size = min(self.page_size, end - position, cap or end)
+            started = time.perf_counter()
+            try:
+                items = self.contract.functions.getCDRRange(position, size).call()
+            except Exception:
+                if size <= self.min_size:
+                    raise
+                self._adapt(False, size)
+                cap = max(self.min_size, size // 2)  # retry this position with a smaller page
+                continue
+            cap = None
+            self._adapt(True, size, time.perf_counter() - started, full=size == self.page_size)
+            self._record(items)
+            out.extend(self.codec.decode_range_item(i) for i in items)
+            if len(items) < size:
+                break
+            position += len(items)
+        return out
+
+    def iter_pages(self, start: int, end: int, pages_of: int = 5000):
+        """Yield (first_idx, records) for [start, end) a few thousand records at a time."""
+        position = start
+        while position < end:
+            records = self.read(position, min(pages_of, end - position))
+            if not records:
+                return
+            yield position, records
+            position += len(records)
+
+    # ---------- Async (request handlers) ----------
+    async def read_async(self, start: int, count: int) -> list:
+        if not self.supported:
+            calls = [self.limit(self.async_contract.functions.getCDR(i).call()) for i in range(start, start + count)]
+            records = []
+            for result in await asyncio.gather(*calls, return_exceptions=True):
+                if isinstance(result, Exception):
+                    break  # past the end of the array (or a failed read): return the prefix we have
+                records.append(self.codec.decode(result))
+            self._record(records)
+            return records
+        out, position, end, cap = [], start, start + count, None
+        while position < end:
+            size = min(self.page_size, end - position, cap or end)
+            started = time.perf_counter()
+            try:
+                items = await self.limit(self.async_contract.functions.getCDRRange(position, size).call())
+            except Exception:
+                if size <= self.min_size:
+                    raise
+                self._adapt(False, size)
+                cap = max(self.min_size, size // 2)
+                continue
+            cap = None
+            self._adapt(True, size, time.perf_counter() - started, full=size == self.page_size)
+            self._record(items)
+            out.extend(self.codec.decode_range_item(i) for i in items)
+            if len(items) < size:
+                break
+            position += len(items)
+        return out
+
+    async def read_indexes_async(self, indexes) -> dict:
+        """{idx: record} for arbitrary indexes, fetched as contiguous runs; unreadable ones are left out."""
+        runs, records = [], {}
+        for idx in sorted(set(indexes)):
+            if runs and idx == runs[-1][1]:
+                runs[-1][1] += 1
+            else:
+                runs.append([idx, idx + 1])
+        pages = await asyncio.gather(*(self.read_async(a, b - a) for a, b in runs), return_exceptions=True)
+        for (a, _), page in zip(runs, pages):
+            if not isinstance(page, Exception):
+                records.update(zip(range(a, a + len(page)), page))
+        return records
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self.counters, "page_size": self.page_size, "ceiling": self.ceiling,
+                    "range_supported": self.supported}
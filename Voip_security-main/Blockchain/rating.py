@@ -0,0 +1,266 @@
+"""
+Columnar CDR rating and billing aggregation.
+
+Tariffs are matched on the longest destination (callee) prefix and priced
+per second, with an optional off-peak rate outside the peak hours. Rated
+CDRs are held as NumPy columns (strings as integer codes into growing
+dictionaries) and extended incrementally from the local mirror in the
+order rows were written to it (its `seq`, not idx: older records are
+often filled in after newer ones). A row written again because a billed
+field changed replaces the version rated before. A summary request is a
+boolean mask plus a groupby over integer arrays rather than a Python loop
+over records.
+
+Tariff file format (tariffs.json, see tariffs.example.json):
+
+    {
+      "currency": "USD",
+      "default_rate_per_second": 0.05,
+      "peak_hours": [8, 20],
+      "tariffs": [
+        {"name": "UK mobile", "prefix": "447", "rate_per_second": 0.03,
+         "offpeak_rate_per_second": 0.02}
+      ]
+    }
+"""
+import json
+import pathlib
+import threading
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_RATE_PER_SECOND = 0.05
+GROUP_BY = ("caller", "callee", "tariff", "status", "hour", "day", "month")
+STRING_COLUMNS = ("caller", "callee", "status")
+NUMERIC_COLUMNS = ("idx", "ts", "duration", "tariff", "rate", "cost")
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"  # Asterisk Master.csv "start" column
+
+
+def load_tariffs(path) -> dict:
+    """Read a tariff file; a missing file means the old flat per-second rate."""
+    path = pathlib.Path(path)
+    if not path.exists():
+        return {"currency": "USD", "default_rate_per_second": DEFAULT_RATE_PER_SECOND, "tariffs": []}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def parse_timestamps(values: pd.Series) -> np.ndarray:
+    """Epoch seconds (int64) per timestamp string; -1 where it can't be parsed."""
+    parsed = pd.to_datetime(values, format=TIMESTAMP_FORMAT, errors="coerce")
+    if parsed.isna().any():
+        retry = parsed.isna()
+        parsed[retry] = pd.to_datetime(values[retry], format="mixed", errors="coerce")
+    epoch = parsed.to_numpy(dtype="datetime64[s]").astype("int64")
+    epoch[parsed.isna().to_numpy()] = -1
+    return epoch
+
+
+class RatingEngine:
+    def __init__(self, tariffs: dict):
+        self.currency = tariffs.get("currency", "USD")
+        self.default_rate = float(tariffs.get("default_rate_per_second", DEFAULT_RATE_PER_SECOND))
+        self.peak_hours = tuple(tariffs.get("peak_hours", (0, 24)))
+        entries = tariffs.get("tariffs", [])
+
+        # Index -1 is the default tariff, so "no match" needs no special case
+        self.names = [t.get("name", t["prefix"]) for t in entries] + ["default"]
+        self.peak_rates = np.array([float(t["rate_per_second"]) for t in entries] + [self.default_rate])
+        self.offpeak_rates = np.array(
+            [float(t.get("offpeak_rate_per_second", t["rate_per_second"])) for t in entries] + [self.default_rate]
+        )
+        self._by_length = {}
+        for i, t in enumerate(entries):
+            self._by_length.setdefault(len(t["prefix"]), {})[t["prefix"]] = i
+
+        self._lock = threading.Lock()
+        self.reset()
+
+    # ---------- Rating ----------
+    def match_tariffs(self, callee: pd.Series) -> np.ndarray:
+        """Longest-prefix tariff index per callee (-1 = default), matched once per distinct number."""
+        categories = callee.astype("category")
+        numbers = categories.cat.categories.to_series().str.replace(r"[^0-9]", "", regex=True)
+        matched = np.full(len(numbers), -1, dtype=np.int64)
+        for length in sorted(self._by_length, reverse=True):
+            hits = numbers.str[:length].map(self._by_length[length]).to_numpy()
+            take = (matched < 0) & ~pd.isna(hits)
+            matched[take] = hits[take].astype(np.int64)
+        codes = categories.cat.codes.to_numpy()
+        return np.where(codes >= 0, matched[codes], -1)
+
+    def rate(self, rows) -> pd.DataFrame:
+        """Rate mirror rows (dicts or a DataFrame) into a columnar frame with tariff, rate and cost."""
+        df = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(
+            rows, columns=["idx", "caller", "callee", "duration", "status", "timestamp"]
+        )
+        df = df[["idx", "caller", "callee", "duration", "status", "timestamp"]].copy()
+        df["duration"] = pd.to_numeric(df["duration"], errors="coerce").fillna(0).astype(np.int64)
+        df["ts"] = parse_timestamps(df["timestamp"].astype(str))
+
+        hour = np.where(df["ts"].to_numpy() >= 0, (df["ts"].to_numpy() // 3600) % 24, -1)
+        start, end = self.peak_hours
+        peak = (hour < 0) | ((hour >= start) & (hour < end))  # unknown time is rated at peak
+
+        tariff = self.match_tariffs(df["callee"].astype(str))
+        df["tariff"] = tariff
+        df["rate"] = np.where(peak, self.peak_rates[tariff], self.offpeak_rates[tariff])
+        df["cost"] = df["duration"].to_numpy() * df["rate"].to_numpy()
+        return df
+
+    def cost_rows(self, rows) -> list:
+        """Per-row (rate, cost) for a small set of rows, e.g. one /cdrs page."""
+        if not rows:
+            return []
+        df = self.rate(rows)
+        return list(zip(df["rate"].round(6).tolist(), df["cost"].round(2).tolist()))
+
+    def quote(self, row: dict) -> dict:
+        """Tariff, rate and cost for a single CDR (e.g. /billing/{idx})."""
+        df = self.rate([row])
+        return {
+            "tariff": self.names[int(df["tariff"].iloc[0])],
+            "rate_per_second": round(float(df["rate"].iloc[0]), 6),
+            "cost": round(float(df["cost"].iloc[0]), 2),
+        }
+
+    # ---------- Incremental columnar store ----------
+    def _encode(self, column: str, values: pd.Series) -> np.ndarray:
+        """Map strings to stable integer codes, growing the column's dictionary as needed."""
+        codes, uniques = pd.factorize(values)
+        vocab, lookup = self._vocab[column], self._lookup[column]
+        mapping = np.empty(len(uniques), dtype=np.int32)
+        for i, value in enumerate(uniques):
+            code = lookup.get(value)
+            if code is None:
+                code = lookup[value] = len(vocab)
+                vocab.append(value)
+            mapping[i] = code
+        return mapping[codes]
+
+    def refresh(self, mirror, chunk_size=50_000) -> int:
+        """Rate mirror rows written since the last refresh; returns how many were added or re-rated."""
+        added = 0
+        with self._lock:
+            while True:
+                rows = mirror.written_after(self.last_seq, chunk_size)
+                if not rows:
+                    break
+                df = self.rate(rows)
+                chunk = {c: df[c].to_numpy() for c in NUMERIC_COLUMNS}
+                for c in STRING_COLUMNS:
+                    chunk[c] = self._encode(c, df[c].astype(str))
+                self._replace(chunk["idx"])
+                self._chunks.append(chunk)
+                self.last_seq = rows[-1]["seq"]
+                added += len(rows)
+            if added:
+                self._columns = None
+        return added
+
+    def _replace(self, idx: np.ndarray):
+        """Drop earlier versions of rows about to be loaded again; `_loaded` flags every idx held."""
+        if idx.max() >= len(self._loaded):
+            grown = np.zeros(max(int(idx.max()) + 1, 2 * len(self._loaded)), dtype=bool)
+            grown[:len(self._loaded)] = self._loaded
+            self._loaded = grown
+        if self._loaded[idx].any():
+            kept = []
+            for ch in self._chunks:
+                keep = ~np.isin(ch["idx"], idx)
+                kept.append(ch if keep.all() else {c: a[keep] for c, a in ch.items()})
+            self._chunks = kept
+        self._loaded[idx] = True
+
+    def reset(self):
+        """Forget everything loaded (e.g. after a chain reorg rewrote mirror rows)."""
+        with self._lock:
+            self._chunks = []
+            self._columns = None
+            self._vocab = {c: [] for c in STRING_COLUMNS}
+            self._lookup = {c: {} for c in STRING_COLUMNS}
+            self._loaded = np.zeros(0, dtype=bool)
+            self.last_seq = 0
+
+    def columns(self) -> dict:
+        """All loaded CDRs as {column: ndarray}; chunks are merged lazily after a refresh."""
+        with self._lock:
+            if self._columns is None:
+                if self._chunks:
+                    merged = {c: np.concatenate([ch[c] for ch in self._chunks]) for c in self._chunks[0]}
+                else:
+                    merged = {c: np.empty(0, dtype=np.int64) for c in NUMERIC_COLUMNS + STRING_COLUMNS}
+                self._chunks = [merged] if self._chunks else []
+                self._columns = merged
+            return self._columns
+
+    # ---------- Aggregation ----------
+    def summary(self, start=None, end=None, group_by=None, limit=1000) -> dict:
+        """
+        Totals (and optional groups) for CDRs with start <= ts < end (epoch
+        seconds; None = open). Groups are sorted by cost, largest first.
+        """
+        cols = self.columns()
+        ts = cols["ts"]
+        mask = np.ones(len(ts), dtype=bool)
+        if start is not None:
+            mask &= ts >= start
+        if end is not None:
+            mask &= (ts < end) & (ts >= 0)
+        duration = cols["duration"][mask]
+        cost = cols["cost"][mask]
+
+        result = {
+            "currency": self.currency,
+            "calls": int(mask.sum()),
+            "duration": int(duration.sum()),
+            "cost": round(float(cost.sum()), 2),
+        }
+        if group_by:
+            keys = self._group_keys(cols, mask, group_by)
+            grouped = pd.DataFrame({"key": keys, "duration": duration, "cost": cost}).groupby("key", sort=False).agg(
+                calls=("duration", "size"), duration=("duration", "sum"), cost=("cost", "sum")
+            ).sort_values("cost", ascending=False).head(limit)
+            result["groups"] = [
+                {"key": self._group_label(group_by, key), "calls": int(row.calls),
+                 "duration": int(row.duration), "cost": round(float(row.cost), 2)}
+                for key, row in zip(grouped.index, grouped.itertuples(index=False))
+            ]
+        return result
+
+    def _group_keys(self, cols, mask, group_by) -> np.ndarray:
+        if group_by in STRING_COLUMNS or group_by == "tariff":
+            return cols[group_by][mask]
+        # Bucket on integer periods; only the surviving group keys get formatted
+        ts = cols["ts"][mask]
+        if group_by == "month":
+            keys = ts.astype("datetime64[s]").astype("datetime64[M]").astype(np.int64)
+        else:
+            keys = ts // (3600 if group_by == "hour" else 86400)
+        return np.where(ts >= 0, keys, np.iinfo(np.int64).min)
+
+    def _group_label(self, group_by, key):
+        if group_by in STRING_COLUMNS:
+            return self._vocab[group_by][key]
+        if group_by == "tariff":
+            return self.names[key]
+        if key == np.iinfo(np.int64).min:
+            return "unknown"
+        if group_by == "month":
+            return str(np.datetime64(int(key), "M"))
+        seconds = int(key) * (3600 if group_by == "hour" else 86400)
+        stamp = pd.Timestamp(seconds, unit="s")
+        return stamp.strftime("%Y-%m-%d %H:00" if group_by == "hour" else "%Y-%m-%d")
+
+    def describe(self) -> dict:
+        return {
+            "currency": self.currency,
+            "default_rate_per_second": self.default_rate,
+            "peak_hours": list(self.peak_hours),
+            "tariffs": [
+                {"name": n, "peak_rate_per_second": float(p), "offpeak_rate_per_second": float(o)}
+                for n, p, o in zip(self.names, self.peak_rates, self.offpeak_rates)
+            ],
+            "loaded_cdrs": len(self.columns()["idx"]),
+        }
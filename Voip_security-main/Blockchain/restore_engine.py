@@ -0,0 +1,284 @@
+"""
+Background restore of backed-up CDRs onto the chain.
+
+Instead of one storeCDR + wait + sleep per record, the engine groups
+records into batch transactions, takes nonces from the shared
+NonceManager and keeps up to `window` transactions in flight while
+receipts are collected concurrently. Failed batches are retried with exponential backoff.
+
+A batch is only ever sent under a new nonce once its old transaction can
+no longer be mined. One that is still unconfirmed after receipt_timeout
+is re-broadcast at the same nonce with a higher gas price, so whichever
+version mines, the records land on chain once.
+
+Progress is checkpointed as the backup position below which every record
+is settled (restored, skipped or given up on), so a job interrupted by a
+restart resumes there. Records past the checkpoint that had already been
+confirmed are caught by the dedup index on resume.
+"""
+import json
+import os
+import pathlib
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from web3.exceptions import TransactionNotFound
+
+FEE_BUMP = 1.125  # nodes require >= 10% more gas price to replace a pending transaction
+
+
+class RestoreBusy(Exception):
+    """Raised when a restore job is already running."""
+
+
+class RestoreEngine:
+    def __init__(self, w3, nonces, send_batch, on_confirmed, checkpoint_file,
+                 should_restore=None, on_failed=None, window=16, batch_size=50,
+                 max_retries=5, retry_delay=1.0, poll_interval=0.5, receipt_timeout=180.0):
+        """
+        send_batch(batch, nonce, gas_price=None) sends one transaction and
+        returns its hash (gas_price is set when re-broadcasting). on_confirmed(batch, receipt) records a mined batch. should_restore(cdr)
+        filters records (e.g. a dedup claim); on_failed(batch) undoes it for
+        batches that are given up on.
+        """
+        self.w3 = w3
+        self.nonces = nonces
+        self.send_batch = send_batch
+        self.on_confirmed = on_confirmed
+        self.should_restore = should_restore or (lambda cdr: True)
+        self.on_failed = on_failed or (lambda batch: None)
+        self.checkpoint_file = pathlib.Path(checkpoint_file)
+        self.window = window
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self.receipt_timeout = receipt_timeout
+
+        self._lock = threading.Lock()
+        self._job = None
+        self._thread = None
+        self._cancel = threading.Event()
+        self._receipts = ThreadPoolExecutor(max_workers=max(window, 1), thread_name_prefix="restore-receipt")
+
+    # ---------- Checkpoint ----------
+    def load_checkpoint(self):
+        try:
+            with open(self.checkpoint_file, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _save_checkpoint(self):
+        tmp = self.checkpoint_file.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.status(), f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.checkpoint_file)
+
+    # ---------- Job control ----------
+    def start(self, records, total: int, resume=True) -> dict:
+        """
+        Start a job over records(skip) — an iterator factory such as
+        BackupLog.iter_records. Resumes an unfinished checkpointed job
+        unless resume is False.
+        """
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                raise RestoreBusy(f"restore job {self._job['job_id']} is still running")
+
+            previous = self.load_checkpoint() if resume else None
+            if previous and previous.get("state") != "completed":
+                job = dict(previous, state="running", resumed_from=previous["next_position"],
+                           in_flight=0, error=None, finished_at=None)
+                print(f"♻️ Resuming restore job {job['job_id']} at backup position {job['next_position']}")
+            else:
+                job = {
+                    "job_id": uuid.uuid4().hex, "state": "running", "started_at": time.time(),
+                    "finished_at": None, "resumed_from": 0, "next_position": 0,
+                    "restored": 0, "skipped": 0, "failed": 0, "retries": 0,
+                    "transactions": 0, "in_flight": 0, "error": None, "failed_hashes": [],
+                }
+            job["total"] = total
+            self._job = job
+            self._cancel.clear()
+            self._thread = threading.Thread(target=self._run, args=(records,), name="cdr-restore", daemon=True)
+            self._thread.start()
+            return dict(job)
+
+    def cancel(self):
+        self._cancel.set()
+
+    def status(self, job_id=None):
+        with self._lock:
+            if self._job is None or (job_id and self._job["job_id"] != job_id):
+                return None
+            job = dict(self._job)
+        elapsed = (job["finished_at"] or time.time()) - job["started_at"]
+        done = job["restored"] + job["skipped"] + job["failed"]
+        rate = job["restored"] / elapsed if elapsed > 0 else 0.0
+        job["rate_per_second"] = round(rate, 2)
+        remaining = max(job["total"] - job["next_position"], 0)
+        job["eta_seconds"] = round(remaining / rate, 1) if rate and job["state"] == "running" else None
+        job["processed"] = done
+        return job
+
+    def _update(self, **changes):
+        with self._lock:
+            for key, value in changes.items():
+                if key in ("restored", "skipped", "failed", "retries", "transactions"):
+                    self._job[key] += value
+                else:
+                    self._job[key] = value
+
+    # ---------- Worker ----------
+    def _fetch_receipt(self, tx_hash):
+        try:
+            return self.w3.eth.get_transaction_receipt(tx_hash)
+        except TransactionNotFound:
+            return None
+
+    def _run(self, records):
+        try:
+            self._restore(records)
+            state = "cancelled" if self._cancel.is_set() else "completed"
+            self._update(state=state, finished_at=time.time(), in_flight=0)
+            job = self.status()
+            print(f"✅ Restore job {job['job_id']} {state}: {job['restored']} restored, "
+                  f"{job['skipped']} skipped, {job['failed']} failed.")
+        except Exception as e:
+            self._update(state="failed", error=str(e), finished_at=time.time())
+            print(f"⚠️ Restore job failed: {e}")
+        finally:
+            self._save_checkpoint()
+
+    def _restore(self, records):
+        start = self._job["next_position"]
+        source = enumerate(records(start), start=start)
+        exhausted = False
+        cursor = start            # next backup position to read
+        ready = deque()           # batches waiting to be (re)sent: [positions, cdrs, attempts, not_before]
+        inflight = {}             # nonce -> [positions, cdrs, attempts, sent_at, tx_hashes]
+
+        while True:
+            if self._cancel.is_set() and not inflight:
+                for entry in ready:
+                    self.on_failed(entry[1])  # not sent; a resumed job will pick them up again
+                self._checkpoint(cursor, ready, inflight)
+                return
+
+            # 1. Fill the window: retries first, then fresh batches from the backup
+            while not self._cancel.is_set() and len(inflight) < self.window:
+                entry = None
+                if ready and ready[0][3] <= time.monotonic():
+                    entry = ready.popleft()
+                elif not exhausted:
+                    positions, batch = [], []
+                    for position, cdr in source:
+                        cursor = position + 1
+                        if self.should_restore(cdr):
+                            positions.append(position)
+                            batch.append(cdr)
+                            if len(batch) >= self.batch_size:
+                                break
+                        else:
+                            self._update(skipped=1)
+                    else:
+                        exhausted = True
+                    if batch:
+                        entry = [positions, batch, 0, 0.0]
+                if entry is None:
+                    break
+                nonce = self.nonces.next()
+                try:
+                    tx_hash = self.send_batch(entry[1], nonce)
+                    inflight[nonce] = [entry[0], entry[1], entry[2], time.monotonic(), [tx_hash]]
+                    self._update(transactions=1)
+                except Exception as e:
+                    print(f"⚠️ Restore send failed (nonce {nonce}): {e}")
+                    self.nonces.release(nonce)  # not broadcast; the next sender reuses it
+                    self._retry_or_fail(entry, ready)
+
+            if not inflight and not ready and exhausted:
+                self._checkpoint(cursor, ready, inflight)
+                return
+
+            # 2. Collect receipts for everything in flight concurrently
+            time.sleep(self.poll_interval)
+            hashes = [h for entry in inflight.values() for h in entry[4]]
+            receipts = dict(zip(hashes, self._receipts.map(self._fetch_receipt, hashes)))
+            for nonce in list(inflight):
+                positions, batch, attempts, sent_at, tx_hashes = inflight[nonce]
+                receipt = next((receipts[h] for h in tx_hashes if receipts[h] is not None), None)
+                if receipt is None:
+                    if time.monotonic() - sent_at > self.receipt_timeout:
+                        self._unstick(nonce, inflight, ready)
+                    continue
+                del inflight[nonce]
+                if receipt.status == 1:
+                    self.on_confirmed(batch, receipt)
+                    self._update(restored=len(batch))
+                else:
+                    self._retry_or_fail([positions, batch, attempts, 0.0], ready)
+
+            self._checkpoint(cursor, ready, inflight)
+
+    def _unstick(self, nonce, inflight, ready):
+        """
+        Handle a transaction that is still unconfirmed after receipt_timeout.
+        While its nonce is unused it may yet mine, so it is re-broadcast at
+        the same nonce with a bumped gas price. Only when the nonce was
+        consumed by a transaction that isn't ours is the batch retried under
+        a new nonce.
+        """
+        positions, batch, attempts, _, tx_hashes = inflight[nonce]
+        if self.w3.eth.get_transaction_count(self.nonces.account, "latest") > nonce:
+            if any(self._fetch_receipt(h) is not None for h in tx_hashes):
+                return  # ours mined just now; the next poll confirms it
+            print(f"⚠️ Restore nonce {nonce} was used by another transaction — resending the batch")
+            del inflight[nonce]
+            self._retry_or_fail([positions, batch, attempts, 0.0], ready)
+            return
+
+        try:
+            previous = self.w3.eth.get_transaction(tx_hashes[-1])["gasPrice"]
+        except TransactionNotFound:
+            previous = 0  # dropped from the node's pool: re-broadcast at the current price
+        gas_price = max(int(previous * FEE_BUMP) + 1, self.w3.eth.gas_price)
+        try:
+            tx_hashes.append(self.send_batch(batch, nonce, gas_price))
+            print(f"⚠️ Restore tx for nonce {nonce} not mined after {self.receipt_timeout:.0f}s — "
+                  f"re-broadcast at gas price {gas_price}")
+        except Exception as e:
+            print(f"⚠️ Re-broadcast of nonce {nonce} failed, waiting another round: {e}")
+        inflight[nonce][3] = time.monotonic()
+
+    def _retry_or_fail(self, entry, ready):
+        positions, batch, attempts, _ = entry
+        attempts += 1
+        if attempts > self.max_retries:
+            self.on_failed(batch)
+            with self._lock:
+                self._job["failed"] += len(batch)
+                self._job["failed_hashes"] = (self._job["failed_hashes"] + [c["hash"] for c in batch])[-1000:]
+            print(f"❌ Giving up on {len(batch)} CDRs after {self.max_retries} retries.")
+            return
+        delay = self.retry_delay * (2 ** (attempts - 1))
+        ready.append([positions, batch, attempts, time.monotonic() + delay])
+        self._update(retries=1)
+
+    def _checkpoint(self, cursor, ready, inflight):
+        """Advance next_position to the first backup position that is not settled yet."""
+        unsettled = [e[0][0] for e in ready] + [e[0][0] for e in inflight.values()]
+        self._update(next_position=min(unsettled + [cursor]), in_flight=len(inflight))
+        self._save_checkpoint()
+
+    def close(self):
+        self.cancel()
+        if self._thread:
+            self._thread.join(timeout=30)
+        self._receipts.shutdown(wait=False)
@@ -0,0 +1,70 @@
+"""RatingEngine.refresh() against a mirror whose rows arrive out of idx order."""
+import pytest
+
+from cdr_mirror import CDRMirror
+from rating import RatingEngine
+
+
+def mirror_row(idx, duration, **extra):
+    return {
+        "idx": idx, "caller": "1001", "callee": "447700900123", "duration": duration, "status": "ANSWERED",
+        "timestamp": "2025-10-29 10:00:00", "hash": f"{idx:064x}", "ipfs_cid": None, "block_number": None, **extra,
+    }
+
+
+@pytest.fixture
+def mirror(tmp_path):
+    m = CDRMirror(tmp_path / "mirror.db")
+    yield m
+    m.close()
+
+
+@pytest.fixture
+def engine():
+    return RatingEngine({"default_rate_per_second": 1.0})
+
+
+def test_rows_filled_in_below_the_newest_idx_are_rated(mirror, engine):
+    mirror.upsert_many([mirror_row(100, 10)])                 # follower writes the newest record first
+    assert engine.refresh(mirror) == 1
+    mirror.upsert_many([mirror_row(i, 1) for i in range(5)])  # cold sync / page fill fill in older ones later
+    assert engine.refresh(mirror) == 5
+
+    summary = engine.summary()
+    assert summary["calls"] == 6
+    assert summary["duration"] == 15
+    assert summary["cost"] == 15.0
+
+
+def test_interleaved_writes_across_refreshes(mirror, engine):
+    for idxs in ([50, 51], [10], [52, 3, 4], [20]):
+        mirror.upsert_many([mirror_row(i, 2) for i in idxs])
+        engine.refresh(mirror, chunk_size=2)
+    assert sorted(engine.columns()["idx"].tolist()) == [3, 4, 10, 20, 50, 51, 52]
+
+
+def test_updates_to_rated_rows_are_not_counted_twice(mirror, engine):
+    mirror.upsert_many([mirror_row(1, 30), mirror_row(2, 30)])
+    engine.refresh(mirror)
+    mirror.upsert_many([mirror_row(1, 30, ipfs_cid="QmYwAPJzv5CZsnA625s3Xf2nemtYgPpHdWEz79ojWnPbdG", block_number=7)])
+    assert engine.refresh(mirror) == 0
+    assert engine.summary()["calls"] == 2
+
+
+def test_rows_whose_billed_fields_change_are_rated_again(mirror, engine):
+    mirror.upsert_many([mirror_row(1, 30, status="NO ANSWER"), mirror_row(2, 30)])
+    engine.refresh(mirror, chunk_size=1)
+    mirror.upsert_many([mirror_row(1, 45)])  # status and duration filled in after the first rating
+    assert engine.refresh(mirror) == 1
+
+    summary = engine.summary()
+    assert summary["calls"] == 2
+    assert summary["duration"] == 75
+    assert [g["key"] for g in engine.summary(group_by="status")["groups"]] == ["ANSWERED"]
+
+
+def test_reset_rates_everything_again(mirror, engine):
+    mirror.upsert_many([mirror_row(5, 1), mirror_row(1, 1)])
+    engine.refresh(mirror)
+    engine.reset()
+    assert engine.refresh(mirror) == 2
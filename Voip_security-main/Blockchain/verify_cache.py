@@ -0,0 +1,116 @@
+"""
+Persistent cache of CDR verification results.
+
+A record's on-chain hash never changes and a CID always names the same
+bytes, so the outcome of verifying (idx, onchain_hash, ipfs_cid) is fixed
+once computed. Results are kept in SQLite and mirrored in a dict keyed by
+idx; a lookup only hits if the stored hash and CID still match the triple
+being asked about. The only thing that can make an entry wrong is a chain
+reorg that replaces the record at idx, so invalidation is by idx or by
+block number.
+"""
+import json
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS verifications (
+    idx          INTEGER PRIMARY KEY,
+    onchain_hash TEXT NOT NULL,
+    ipfs_cid     TEXT NOT NULL,
+    verified     INTEGER NOT NULL,
+    result       TEXT NOT NULL,
+    block_number INTEGER,
+    verified_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS verifications_block ON verifications (block_number);
+"""
+
+
+class VerificationCache:
+    def __init__(self, path):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+        self.counters = {"hits": 0, "misses": 0, "stores": 0, "invalidated": 0}
+
+        self._entries = {}
+        for idx, onchain_hash, cid, result in self._conn.execute(
+            "SELECT idx, onchain_hash, ipfs_cid, result FROM verifications"
+        ):
+            self._entries[idx] = (onchain_hash, cid, json.loads(result))
+
+    # ---------- Lookups ----------
+    def get(self, idx: int, onchain_hash: str, ipfs_cid: str):
+        """Cached verification dict for this exact triple, or None."""
+        entry = self._entries.get(idx)
+        if entry is not None and entry[0] == onchain_hash and entry[1] == ipfs_cid:
+            self.counters["hits"] += 1
+            return entry[2]
+        self.counters["misses"] += 1
+        return None
+
+    def verified(self, idx: int, onchain_hash: str, ipfs_cid: str):
+        """True / False if this triple was verified before, None if it never was (no counters)."""
+        entry = self._entries.get(idx)
+        if entry is not None and entry[0] == onchain_hash and entry[1] == ipfs_cid:
+            return entry[2]["verified"]
+        return None
+
+    # ---------- Writes ----------
+    def put(self, idx: int, onchain_hash: str, ipfs_cid: str, result: dict, block_number=None):
+        """Store a completed verification (verified or mismatch — never a fetch error)."""
+        with self._lock:
+            self._conn.execute(
+                """INSERT OR REPLACE INTO verifications
+                   (idx, onchain_hash, ipfs_cid, verified, result, block_number, verified_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                (idx, onchain_hash, ipfs_cid, int(bool(result["verified"])),
+                 json.dumps(result, default=str), block_number, time.time()),
+            )
+            self._conn.commit()
+            self._entries[idx] = (onchain_hash, ipfs_cid, result)
+            self.counters["stores"] += 1
+
+    def invalidate(self, idxs=(), from_block=None) -> int:
+        """
+        Drop entries for the given indexes and, with from_block, every entry
+        recorded at or after that block (or without a known block).
+        """
+        with self._lock:
+            idxs = set(idxs)
+            if from_block is not None:
+                rows = self._conn.execute(
+                    "SELECT idx FROM verifications WHERE block_number >= ? OR block_number IS NULL",
+                    (from_block,),
+                ).fetchall()
+                idxs.update(r[0] for r in rows)
+            self._conn.executemany("DELETE FROM verifications WHERE idx = ?", [(i,) for i in idxs])
+            self._conn.commit()
+            dropped = sum(1 for i in idxs if self._entries.pop(i, None) is not None)
+            self.counters["invalidated"] += dropped
+            return dropped
+
+    # ---------- Stats / shutdown ----------
+    def __contains__(self, idx: int):
+        return idx in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return {
+            **self.counters,
+            "entries": len(self._entries),
+            "hit_rate": round(self.counters["hits"] / lookups, 4) if lookups else None,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
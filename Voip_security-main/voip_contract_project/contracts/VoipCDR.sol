@@ -12,7 +12,27 @@ contract VoipCDR {
         string hash;
     }
 
+    struct CDRInput {
+        string caller;
+        string callee;
+        uint256 duration;
+        string status;
+        string timestamp;
+        string hash;
+    }
+
+    // Merkle-batched mode: one root per batch of CDRs instead of one record per CDR
+    struct Anchor {
+        bytes32 root;
+        uint64 leafCount;
+        uint64 anchoredAt;
+    }
+
     Record[] public records;
+    Anchor[] public anchors;
+
+    event CDRStored(uint256 indexed idx, bytes32 indexed hashKey, Record record);
+    event BatchAnchored(uint256 indexed batchId, bytes32 indexed root, uint256 leafCount);
 
     function storeCDR(
         string memory caller,
@@ -22,13 +42,44 @@ contract VoipCDR {
         string memory timestamp,
         string memory hash
     ) public {
-        records.push(Record(records.length, caller, callee, duration, status, timestamp, hash));
+        _store(caller, callee, duration, status, timestamp, hash);
+    }
+
+    function storeCDRBatch(CDRInput[] calldata batch) external {
+        for (uint256 i = 0; i < batch.length; i++) {
+            CDRInput calldata c = batch[i];
+            _store(c.caller, c.callee, c.duration, c.status, c.timestamp, c.hash);
+        }
+    }
+
+    function _store(
+        string memory caller,
+        string memory callee,
+        uint256 duration,
+        string memory status,
+        string memory timestamp,
+        string memory hash
+    ) internal {
+        Record memory r = Record(records.length, caller, callee, duration, status, timestamp, hash);
+        records.push(r);
+        emit CDRStored(r.id, keccak256(bytes(r.hash)), r);
+    }
+
+    function anchorBatch(bytes32 root, uint64 leafCount) external returns (uint256 batchId) {
+        require(leafCount > 0, "VoipCDR: empty batch");
+        batchId = anchors.length;
+        anchors.push(Anchor(root, leafCount, uint64(block.timestamp)));
+        emit BatchAnchored(batchId, root, leafCount);
     }
 
     function recordCount() public view returns (uint256) {
         return records.length;
     }
 
+    function anchorCount() public view returns (uint256) {
+        return anchors.length;
+    }
+
     function getCDR(uint256 idx) public view returns (
         string memory caller,
         string memory callee,
@@ -40,4 +91,15 @@ contract VoipCDR {
         Record memory r = records[idx];
         return (r.caller, r.callee, r.duration, r.status, r.timestamp, r.hash);
     }
+
+    // Up to `count` records starting at `start` (fewer at the end of the array), in one eth_call
+    function getCDRRange(uint256 start, uint256 count) public view returns (Record[] memory page) {
+        uint256 end = start + count;
+        if (end > records.length) end = records.length;
+        if (start >= end) return new Record[](0);
+        page = new Record[](end - start);
+        for (uint256 i = start; i < end; i++) {
+            page[i - start] = records[i];
+        }
+    }
 }
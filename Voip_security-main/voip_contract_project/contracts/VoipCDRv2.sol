@@ -0,0 +1,90 @@
+// SPDX-License-Identifier: MIT
+pragma solidity ^0.8.28;
+
+// Compact CDR layout: 3 storage slots per record instead of ~9 for VoipCDR.
+// The record's index in `records` is its id, so no id field is stored.
+contract VoipCDRv2 {
+    enum Status { UNKNOWN, ANSWERED, NO_ANSWER, BUSY, FAILED, CONGESTION }
+
+    struct Record {
+        bytes32 hash;       // slot 0: sha256 of the CDR string
+        bytes16 caller;     // slot 1: ASCII, zero-padded
+        bytes16 callee;
+        uint64 timestamp;   // slot 2: unix seconds (UTC)
+        uint32 duration;    //         seconds
+        Status status;
+    }
+
+    struct Anchor {
+        bytes32 root;
+        uint64 leafCount;
+        uint64 anchoredAt;
+    }
+
+    Record[] public records;
+    Anchor[] public anchors;
+
+    event CDRStored(uint256 indexed idx, bytes32 indexed hashKey, Record record);
+    event BatchAnchored(uint256 indexed batchId, bytes32 indexed root, uint256 leafCount);
+
+    function storeCDR(
+        bytes32 hash,
+        bytes16 caller,
+        bytes16 callee,
+        uint64 timestamp,
+        uint32 duration,
+        Status status
+    ) public {
+        _store(Record(hash, caller, callee, timestamp, duration, status));
+    }
+
+    function storeCDRBatch(Record[] calldata batch) external {
+        for (uint256 i = 0; i < batch.length; i++) {
+            _store(batch[i]);
+        }
+    }
+
+    function _store(Record memory r) internal {
+        uint256 idx = records.length;
+        records.push(r);
+        emit CDRStored(idx, r.hash, r);
+    }
+
+    function anchorBatch(bytes32 root, uint64 leafCount) external returns (uint256 batchId) {
+        require(leafCount > 0, "VoipCDRv2: empty batch");
+        batchId = anchors.length;
+        anchors.push(Anchor(root, leafCount, uint64(block.timestamp)));
+        emit BatchAnchored(batchId, root, leafCount);
+    }
+
+    function recordCount() public view returns (uint256) {
+        return records.length;
+    }
+
+    function anchorCount() public view returns (uint256) {
+        return anchors.length;
+    }
+
+    function getCDR(uint256 idx) public view returns (
+        bytes32 hash,
+        bytes16 caller,
+        bytes16 callee,
+        uint64 timestamp,
+        uint32 duration,
+        Status status
+    ) {
+        Record storage r = records[idx];
+        return (r.hash, r.caller, r.callee, r.timestamp, r.duration, r.status);
+    }
+
+    // Up to `count` records starting at `start` (fewer at the end of the array), in one eth_call
+    function getCDRRange(uint256 start, uint256 count) public view returns (Record[] memory page) {
+        uint256 end = start + count;
+        if (end > records.length) end = records.length;
+        if (start >= end) return new Record[](0);
+        page = new Record[](end - start);
+        for (uint256 i = start; i < end; i++) {
+            page[i - start] = records[i];
+        }
+    }
+}
@@ -2,10 +2,13 @@ import { ethers, artifacts } from "hardhat"; // ✅ import artifacts from hardha
 import fs from "fs";
 import path from "path";
 
+// CDR_CONTRACT=VoipCDRv2 deploys the packed record layout; the backend detects it from the ABI
+const CONTRACT_NAME = process.env.CDR_CONTRACT || "VoipCDR";
+
 async function main() {
-  console.log("⏳ Deploying VoipCDR contract...");
+  console.log(`⏳ Deploying ${CONTRACT_NAME} contract...`);
 
-  const VoipCDR = await ethers.getContractFactory("VoipCDR");
+  const VoipCDR = await ethers.getContractFactory(CONTRACT_NAME);
   const contract = await VoipCDR.deploy();
   await contract.waitForDeployment();
 
@@ -13,7 +16,7 @@ async function main() {
   console.log(`✅ Contract deployed at: ${address}`);
 
   // Save ABI & address for backend
-  const artifact = await artifacts.readArtifact("VoipCDR"); // ✅ use artifacts from Hardhat
+  const artifact = await artifacts.readArtifact(CONTRACT_NAME); // ✅ use artifacts from Hardhat
 
   const backendDir = path.join(__dirname, "../backend"); // adjust path if needed
   if (!fs.existsSync(backendDir)) fs.mkdirSync(backendDir);
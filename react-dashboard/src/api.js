@@ -39,10 +39,11 @@ api.interceptors.response.use(
 // CDR Blockchain API Service
 // ===============================
 export const cdrAPI = {
-  // Fetch all stored CDRs
-  getAllCDRs: async () => {
+  // Fetch stored CDRs; filters/sorting are applied server-side
+  // (caller, callee, status, q, hash_prefix, from, to, min_duration, max_duration, sort, order, limit, cursor)
+  getAllCDRs: async (params = {}) => {
     try {
-      const response = await api.get('/cdrs');
+      const response = await api.get('/cdrs', { params });
       return response.data;
     } catch (error) {
       console.error('Error fetching CDRs:', error);
@@ -107,6 +108,51 @@ export const cdrAPI = {
     }
   },
 
+  // Live push of new CDRs over /ws/cdrs; reconnects with backoff and resumes after the last idx seen.
+  // Returns an unsubscribe function.
+  subscribeCDRs: (params = {}, { onCDR, onReorg, onStatus } = {}) => {
+    const base = api.defaults.baseURL.replace(/^http/, 'ws');
+    let socket = null;
+    let closed = false;
+    let retryDelay = 1000;
+    let lastIdx = params.after;
+
+    const connect = () => {
+      const query = new URLSearchParams(
+        Object.entries({ ...params, after: lastIdx }).filter(([, v]) => v !== undefined && v !== null && v !== '')
+      );
+      socket = new WebSocket(`${base}/ws/cdrs?${query}`);
+      socket.onopen = () => {
+        retryDelay = 1000;
+        onStatus && onStatus('live');
+      };
+      socket.onmessage = (event) => {
+        const message = JSON.parse(event.data);
+        if (message.type === 'cdr') {
+          lastIdx = Math.max(lastIdx ?? -1, message.cdr.id);
+          onCDR && onCDR(message.cdr);
+        } else if (message.type === 'reorg') {
+          if (message.removed.length && lastIdx !== undefined) {
+            lastIdx = Math.min(lastIdx, Math.min(...message.removed) - 1);
+          }
+          onReorg && onReorg(message);
+        }
+      };
+      socket.onclose = () => {
+        if (closed) return;
+        onStatus && onStatus('reconnecting');
+        setTimeout(connect, retryDelay);
+        retryDelay = Math.min(retryDelay * 2, 30000);
+      };
+    };
+
+    connect();
+    return () => {
+      closed = true;
+      if (socket) socket.close();
+    };
+  },
+
   // Health check for API status
   healthCheck: async () => {
     try {
@@ -1,4 +1,4 @@
-import React, { useState, useEffect, useCallback } from 'react';
+import React, { useState, useEffect, useCallback, useRef } from 'react';
 import { cdrAPI } from '../api';
 import StatsCard from '../components/StatsCard';
 import CDRTable from '../components/CDRTable';
@@ -9,11 +9,13 @@ import HealthCheck from '../components/HealthCheck';
 
 const Dashboard = () => {
   const [cdrs, setCdrs] = useState([]);
-  const [filteredCdrs, setFilteredCdrs] = useState([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
   const [searchTerm, setSearchTerm] = useState('');
+  const [query, setQuery] = useState('');
   const [lastRefresh, setLastRefresh] = useState(new Date());
+  const [liveStatus, setLiveStatus] = useState('connecting');
+  const lastIdRef = useRef(undefined);
 
   // Fetch CDRs from API (with verification)
   const fetchCDRs = useCallback(async () => {
@@ -21,23 +23,29 @@ const Dashboard = () => {
       setLoading(true);
       setError(null);
 
-      const response = await cdrAPI.getAllCDRs();
+      // ✅ Search runs on the backend's indexes (exact caller/callee or hash prefix)
+      const params = query ? { q: query, sort: 'timestamp', order: 'desc' } : { sort: 'idx', order: 'desc' };
+      const response = await cdrAPI.getAllCDRs(params);
       const records = response.cdrs || [];
 
-      // ✅ Verify each CDR using backend
+      // ✅ /cdrs already carries cached verification results; only verify rows the backend hasn't seen yet
       const verifiedResults = await Promise.all(
-        records.map(async (cdr, i) => {
+        records.map(async (cdr) => {
+          if (cdr.verified !== null && cdr.verified !== undefined) {
+            return cdr;
+          }
           try {
-            const verifyRes = await cdrAPI.verifyCDR(i, cdr.ipfs_cid);
+            const verifyRes = await cdrAPI.verifyCDR(cdr.id, cdr.ipfs_cid);
             return { ...cdr, verified: verifyRes.verified };
           } catch (err) {
-            console.warn(`Verification failed for record ${i}:`, err.message);
+            console.warn(`Verification failed for record ${cdr.id}:`, err.message);
             return { ...cdr, verified: false };
           }
         })
       );
 
       setCdrs(verifiedResults);
+      lastIdRef.current = records.length ? Math.max(...records.map((cdr) => cdr.id)) : -1;
       setLastRefresh(new Date());
     } catch (err) {
       console.error('Error fetching CDRs:', err);
@@ -45,30 +53,19 @@ const Dashboard = () => {
     } finally {
       setLoading(false);
     }
-  }, []);
-
-  // Filter CDRs based on search term
-  const filterCDRs = useCallback((searchValue) => {
-    if (!searchValue.trim()) {
-      setFilteredCdrs(cdrs);
-      return;
-    }
-
-    const filtered = cdrs.filter(cdr =>
-      cdr.caller.toLowerCase().includes(searchValue.toLowerCase()) ||
-      cdr.callee.toLowerCase().includes(searchValue.toLowerCase()) ||
-      cdr.hash.toLowerCase().includes(searchValue.toLowerCase()) ||
-      (cdr.ipfs_cid && cdr.ipfs_cid.toLowerCase().includes(searchValue.toLowerCase()))
-    );
-    setFilteredCdrs(filtered);
-  }, [cdrs]);
+  }, [query]);
 
   // Handle search
   const handleSearch = (searchValue) => {
     setSearchTerm(searchValue);
-    filterCDRs(searchValue);
   };
 
+  // Debounce typing so each keystroke doesn't hit the backend
+  useEffect(() => {
+    const timer = setTimeout(() => setQuery(searchTerm.trim()), 300);
+    return () => clearTimeout(timer);
+  }, [searchTerm]);
+
   // Calculate statistics
   const getStats = () => {
     const total = cdrs.length;
@@ -80,17 +77,41 @@ const Dashboard = () => {
 
   const stats = getStats();
 
-  // Auto-refresh every 5 seconds
-  useEffect(() => {
-    fetchCDRs();
-    const interval = setInterval(fetchCDRs, 20000);
-    return () => clearInterval(interval);
-  }, [fetchCDRs]);
+  // Add a pushed CDR (verifying it first if the backend hasn't yet)
+  const addCDR = useCallback(async (cdr) => {
+    let record = cdr;
+    if (cdr.ipfs_cid && (cdr.verified === null || cdr.verified === undefined)) {
+      try {
+        const verifyRes = await cdrAPI.verifyCDR(cdr.id, cdr.ipfs_cid);
+        record = { ...cdr, verified: verifyRes.verified };
+      } catch (err) {
+        record = { ...cdr, verified: false };
+      }
+    }
+    setCdrs((prev) => (prev.some((c) => c.id === record.id) ? prev : [record, ...prev]));
+    setLastRefresh(new Date());
+  }, []);
 
-  // Update filtered CDRs when CDRs change
+  // Load once, then receive new CDRs over the push channel instead of re-polling /cdrs
   useEffect(() => {
-    filterCDRs(searchTerm);
-  }, [cdrs, searchTerm, filterCDRs]);
+    let cancelled = false;
+    let unsubscribe = () => {};
+    fetchCDRs().then(() => {
+      if (cancelled) return;
+      unsubscribe = cdrAPI.subscribeCDRs(
+        { ...(query ? { q: query } : {}), after: lastIdRef.current },
+        {
+          onCDR: addCDR,
+          onReorg: ({ removed }) => setCdrs((prev) => prev.filter((c) => !removed.includes(c.id))),
+          onStatus: setLiveStatus,
+        }
+      );
+    });
+    return () => {
+      cancelled = true;
+      unsubscribe();
+    };
+  }, [fetchCDRs, query, addCDR]);
 
   // Auto-dismiss error after 8 seconds
   useEffect(() => {
@@ -117,7 +138,7 @@ const Dashboard = () => {
             <div className="flex items-center space-x-4">
               <HealthCheck />
               <div className="text-sm text-gray-500">
-                Last updated: {lastRefresh.toLocaleTimeString()}
+                {{ live: '🟢 Live', reconnecting: '🟡 Reconnecting' }[liveStatus] || '⚪ Connecting'} · Last updated: {lastRefresh.toLocaleTimeString()}
               </div>
               <button
                 onClick={fetchCDRs}
@@ -203,14 +224,14 @@ const Dashboard = () => {
         <div className="mb-6">
           <SearchBar
             onSearch={handleSearch}
-            placeholder="Search by caller, callee, hash, or IPFS CID..."
+            placeholder="Search by caller, callee, or hash prefix..."
           />
         </div>
 
         {/* Charts and QR Code */}
         <div className="grid grid-cols-1 lg:grid-cols-3 gap-6 mb-8">
           <div className="lg:col-span-2">
-            <Chart cdrs={filteredCdrs} loading={loading} />
+            <Chart cdrs={cdrs} loading={loading} />
           </div>
           <div>
             <QRCodeDisplay cdrs={cdrs} loading={loading} />
@@ -219,7 +240,7 @@ const Dashboard = () => {
 
         {/* CDR Table */}
         <CDRTable
-          cdrs={filteredCdrs}
+          cdrs={cdrs}
           loading={loading}
           onRefresh={fetchCDRs}
         />